@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 import os
 from dotenv import load_dotenv
+from corsheaders.defaults import default_headers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -47,6 +48,8 @@ DATA_UPLOAD_MAX_MEMORY_SIZE = int(os.getenv('DATA_UPLOAD_MAX_MEMORY_SIZE', 15 *
 
 # Permitir todos los orígenes (para desarrollo)
 CORS_ALLOW_ALL_ORIGINS = True
+# Header de reintentos seguros (ver tienda/middleware.py)
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
 
 # O especificar orígenes permitidos
 # CORS_ALLOWED_ORIGINS = [
@@ -97,12 +100,13 @@ SIMPLE_JWT = {
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'Control_de_Venta.tienda.middleware.WhiteNoiseAsyncMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'Control_de_Venta.tienda.middleware.IdempotencyKeyMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -155,6 +159,58 @@ else:
     }
 
 
+# Cache: Redis if REDIS_URL is set (shared across workers), otherwise per-process memory.
+# The "analytics" alias holds versioned analytics responses (see tienda/analytics_cache.py).
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+        'analytics': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'analytics',
+        },
+        # LRU eviction requires `maxmemory-policy allkeys-lru` on the Redis server.
+        'chat': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'chat',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'analytics': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'analytics',
+            'OPTIONS': {'MAX_ENTRIES': 1000},
+        },
+        # LocMemCache evicts the least recently used entries past MAX_ENTRIES.
+        'chat': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'chat',
+            'OPTIONS': {'MAX_ENTRIES': int(os.getenv('CHAT_CACHE_MAX_ENTRIES', 2000))},
+        },
+    }
+ANALYTICS_CACHE_TTL = int(os.getenv('ANALYTICS_CACHE_TTL', 60 * 60))
+# Chat answer cache (see tienda/chat_cache.py).
+CHAT_CACHE_TTL = int(os.getenv('CHAT_CACHE_TTL', 60 * 60))
+# Max dHash Hamming distance for reusing a near-duplicate image analysis (0 = exact matches only).
+# Off by default: product variants (flavour, size) sit a few bits apart and would share an analysis.
+IMAGE_DEDUP_DISTANCE = int(os.getenv('IMAGE_DEDUP_DISTANCE', 0))
+
+# Idempotency-Key replay window and how long a duplicate waits for the in-flight original.
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', 24 * 60 * 60))
+IDEMPOTENCY_ESPERA = int(os.getenv('IDEMPOTENCY_ESPERA', 10))
+
+# Stock reservations (cart holds): shared in Redis if REDIS_URL is set, otherwise per process.
+RESERVAS_TTL = int(os.getenv('RESERVAS_TTL', 15 * 60))
+
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
@@ -1,13 +1,19 @@
 from django.contrib import admin
 from django.db import transaction
-from django.core.exceptions import ValidationError
-from .models import Producto, Cliente, Venta, VentaDetalle, Categoria
+from .models import Producto, Cliente, Venta, VentaDetalle, Categoria, MovimientoStock
+from .stock import (
+	activar_modo_caliente, descontar_stock_lote, devolver_stock_lote, fijar_stock, guardar_sin_stock,
+)
+from .canasta import marcar_venta
+from .reservas import verificar_disponible
+from .rollups import marcar_dia
+from .ventas import recalcular_totales
 
 
 @admin.register(Categoria)
 class CategoriaAdmin(admin.ModelAdmin):
 	"""Configuración del admin para Categoría."""
-	list_display = ('nombre', 'activa')
+	list_display = ('nombre', 'activa', 'stock_minimo')
 	search_fields = ('nombre',)
 	list_filter = ('activa',)
 
@@ -15,9 +21,50 @@ class CategoriaAdmin(admin.ModelAdmin):
 @admin.register(Producto)
 class ProductoAdmin(admin.ModelAdmin):
 	"""Configuración del admin para Producto."""
-	list_display = ('nombre', 'codigo', 'cantidad', 'precio', 'categoria')
+	list_display = ('nombre', 'codigo', 'cantidad', 'slots_stock', 'stock_minimo', 'stock_bajo', 'precio', 'categoria')
 	search_fields = ('nombre', 'codigo')
-	list_filter = ('cantidad', 'categoria')
+	list_filter = ('stock_bajo', 'cantidad', 'categoria')
+	readonly_fields = ('slots_stock', 'stock_bajo')
+	actions = ('activar_modo_caliente', 'desactivar_modo_caliente')
+
+	@admin.action(description='Activar modo caliente (8 slots de stock)')
+	def activar_modo_caliente(self, request, queryset):
+		for pk in queryset.values_list('pk', flat=True):
+			activar_modo_caliente(pk, 8)
+
+	@admin.action(description='Desactivar modo caliente')
+	def desactivar_modo_caliente(self, request, queryset):
+		for pk in queryset.filter(slots_stock__gt=0).values_list('pk', flat=True):
+			activar_modo_caliente(pk, 0)
+
+	def save_model(self, request, obj, form, change):
+		if not change:
+			return super().save_model(request, obj, form, change)
+		# No pisar el stock con el valor leído al abrir el formulario; si se
+		# editó la cantidad, se registra como ajuste en el libro de movimientos
+		with transaction.atomic():
+			guardar_sin_stock(obj)
+			if 'cantidad' in form.changed_data:
+				fijar_stock(obj.pk, obj.cantidad)
+
+
+@admin.register(MovimientoStock)
+class MovimientoStockAdmin(admin.ModelAdmin):
+	"""Libro de movimientos de stock (solo lectura)."""
+	list_display = ('fecha', 'producto', 'tipo', 'cantidad', 'venta')
+	list_filter = ('tipo', 'fecha')
+	search_fields = ('producto__nombre', 'producto__codigo')
+	list_select_related = ('producto', 'venta')
+	raw_id_fields = ('producto', 'venta')
+
+	def has_add_permission(self, request):
+		return False
+
+	def has_change_permission(self, request, obj=None):
+		return False
+
+	def has_delete_permission(self, request, obj=None):
+		return False
 
 
 @admin.register(Cliente)
@@ -43,62 +90,69 @@ class VentaAdmin(admin.ModelAdmin):
 	o modifica la venta junto con sus detalles.
 	"""
 	inlines = [VentaDetalleInline]
-	list_display = ('fecha', 'cliente', 'total_display')
+	list_display = ('fecha', 'cliente', 'items', 'total')
+	list_select_related = ('cliente',)
+	readonly_fields = ('total', 'items')
 	search_fields = ('cliente__rut',)
 	list_filter = ('fecha',)
 
-	def total_display(self, obj):
-		return obj.total()
-	total_display.short_description = 'Total'
-
 	def save_model(self, request, obj, form, change):
 		# Solo guardar la cabecera aquí; el ajuste de stock se hace al guardar el formset
 		super().save_model(request, obj, form, change)
 
 	def save_formset(self, request, form, formset, change):
-		# Guardar y validar transaccionalmente los detalles y ajustar el stock
+		# Guardar y validar transaccionalmente los detalles y ajustar el stock.
+		# Las líneas originales se leen en una consulta, los deltas por producto
+		# se calculan en memoria y se aplican con un UPDATE condicional en bloque,
+		# así el costo no crece con la cantidad de líneas editadas.
 		with transaction.atomic():
+			venta = form.instance
 			# Guardar la cabecera si acaso no está guardada
-			if form.instance and form.instance.pk is None:
-				form.instance.save()
+			if venta and venta.pk is None:
+				venta.save()
+			marcar_venta(venta.pk)
 
 			instances = formset.save(commit=False)
+			eliminados = formset.deleted_objects
+			originales = VentaDetalle.objects.in_bulk(
+				[inst.pk for inst in instances if inst.pk] + [obj.pk for obj in eliminados]
+			)
 
-			# Validar stock para nuevos/actualizados detalles
+			# Delta neto por producto: positivo descuenta, negativo devuelve
+			deltas = {}
 			for inst in instances:
-				producto = inst.producto
-				# Si el detalle ya existe, calcular delta de cantidad
-				if inst.pk:
-					orig = VentaDetalle.objects.get(pk=inst.pk)
-					delta = inst.cantidad - orig.cantidad
-				else:
-					delta = inst.cantidad
-
-				if delta > 0 and producto.cantidad < delta:
-					raise ValidationError(f"Stock insuficiente para {producto.nombre} (disponible: {producto.cantidad})")
-
-			# Aplicar cambios: restar stock por los deltas y guardar instancias
+				orig = originales.get(inst.pk)
+				if orig:
+					deltas[orig.producto_id] = deltas.get(orig.producto_id, 0) - orig.cantidad
+				deltas[inst.producto_id] = deltas.get(inst.producto_id, 0) + inst.cantidad
+			for obj_del in eliminados:
+				orig = originales.get(obj_del.pk, obj_del)
+				deltas[orig.producto_id] = deltas.get(orig.producto_id, 0) - orig.cantidad
+
+			# Levanta StockInsuficiente (ValidationError) si algún producto no alcanza,
+			# contando como no disponible lo retenido por reservas
+			aumentos = {pid: d for pid, d in deltas.items() if d > 0}
+			if aumentos:
+				verificar_disponible([
+					(p, aumentos[p.pk]) for p in Producto.objects.filter(pk__in=aumentos).prefetch_related('slots')
+				])
+			descontar_stock_lote(aumentos, venta=venta)
+			devolver_stock_lote({pid: -d for pid, d in deltas.items() if d < 0}, venta=venta)
+
+			nuevos = [inst for inst in instances if not inst.pk]
+			modificados = [inst for inst in instances if inst.pk]
 			for inst in instances:
-				producto = inst.producto
-				if inst.pk:
-					orig = VentaDetalle.objects.get(pk=inst.pk)
-					delta = inst.cantidad - orig.cantidad
-				else:
-					delta = inst.cantidad
-
-				if delta != 0:
-					producto.cantidad -= delta
-					producto.save()
-
-				inst.save()
-
-			# Manejar objetos eliminados: devolver el stock
-			for obj_del in formset.deleted_objects:
-				prod = obj_del.producto
-				prod.cantidad += obj_del.cantidad
-				prod.save()
-				obj_del.delete()
+				# bulk_create/bulk_update no pasan por save(): fijar el precio aquí
+				if inst.precio_unitario in (None, ''):
+					inst.precio_unitario = inst.producto.precio
+			VentaDetalle.objects.bulk_create(nuevos)
+			if modificados:
+				VentaDetalle.objects.bulk_update(modificados, ['producto', 'cantidad', 'precio_unitario'])
+			if eliminados:
+				VentaDetalle.objects.filter(pk__in=[obj.pk for obj in eliminados]).delete()
 
 			formset.save_m2m()
+			recalcular_totales(Venta.objects.filter(pk=venta.pk))
+			marcar_dia(venta.fecha)
 
 # Control_de_Venta/tienda/admin.py
\ No newline at end of file
@@ -0,0 +1,174 @@
+"""
+Vistas asíncronas de IA (chat e imágenes) para servir bajo daphne (ASGI).
+
+Las llamadas a Groq tardan hasta GROQ_TIMEOUT_SECONDS: hechas de forma
+síncrona, cada consulta retendría un hilo del servidor y con pocas
+consultas simultáneas el resto de la API se quedaría esperando. Aquí el
+flujo usa `AsyncGroq`: mientras Groq responde, la petición solo es una
+corrutina suspendida en el event loop. Lo que acota las llamadas en vuelo es
+el semáforo de `groq_utils.cupo_groq` (GROQ_MAX_CONCURRENCIA), no el pool de
+hilos.
+
+`responder_chat` y `responder_imagen` son la única implementación del flujo
+(caché, historial y guardado): POST /api/chat/ y POST /api/images/ se
+enrutan aquí (`coleccion`), y `ChatMessageViewSet.create` /
+`ImageAnalysisViewSet.create` las llaman con `async_to_sync` cuando la
+petición llega por otra ruta del router (p. ej. sufijos de formato).
+
+DRF no tiene vistas asíncronas, así que son vistas de Django:
+- autenticación JWT igual que la API (`JWTAuthentication`, vía
+  `sync_to_async` porque lee el usuario de la BD);
+- ORM asíncrono para el historial y el guardado del mensaje;
+- el trabajo de Pillow (huellas y preprocesamiento de imágenes) corre en el
+  pool de hilos de `groq_utils.en_hilo_imagenes`;
+- la lógica de contexto e inventario del chat se reutiliza del ViewSet
+  (consultas síncronas cortas, en `sync_to_async`), igual que el caché de
+  respuestas (`chat_cache`) y de análisis de imágenes (`imagen_cache`).
+
+Rutas: POST /api/chat/ y POST /api/images/ (el resto de métodos sigue en el
+ViewSet), y sus alias POST /api/ai/chat/ y POST /api/ai/imagen/.
+"""
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from . import chat_cache, imagen_cache
+from .groq_utils import analyze_product_image_v2_async, chat_with_groq_async, en_hilo_imagenes
+from .models import ChatMessage
+from .serializers import ChatMessageSerializer
+from .views import ChatMessageViewSet, ImageAnalysisViewSet
+
+logger = logging.getLogger(__name__)
+
+
+async def _usuario(request):
+    """Usuario del header `Authorization: Bearer <jwt>`, o None."""
+    try:
+        resultado = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except AuthenticationFailed:
+        return None
+    return resultado[0] if resultado else None
+
+
+def _no_autenticado():
+    return JsonResponse(
+        {'detail': 'Las credenciales de autenticación no se proveyeron o no son válidas.'},
+        status=status.HTTP_401_UNAUTHORIZED,
+    )
+
+
+def _json(respuesta):
+    """Convierte una `Response` de DRF de los helpers del ViewSet en `JsonResponse`."""
+    response = JsonResponse(respuesta.data, status=respuesta.status_code, safe=False)
+    if 'X-Cache' in respuesta:
+        response['X-Cache'] = respuesta['X-Cache']
+    return response
+
+
+def _datos(request):
+    if request.content_type == 'application/json':
+        try:
+            datos = json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+        return datos if isinstance(datos, dict) else None
+    return request.POST
+
+
+async def responder_chat(user, datos):
+    """Flujo de POST /api/chat/ para `user`. Retorna una `Response` de DRF."""
+    user_message = str(datos.get('user_message') or '').strip()
+    context_type = datos.get('context_type') or 'general'
+    if not user_message:
+        return Response({'error': 'El mensaje no puede estar vacío.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Respuesta determinista desde inventario (sin IA) si la pregunta es de precio/stock
+    ai_response = await sync_to_async(ChatMessageViewSet._try_inventory_answer)(user_message)
+    hit = None
+    if not ai_response:
+        # Pregunta repetida con los mismos datos: respuesta cacheada, sin Groq
+        clave, ai_response = await sync_to_async(chat_cache.buscar)(user_message, context_type)
+        hit = ai_response is not None
+    if not ai_response:
+        context = await sync_to_async(ChatMessageViewSet._build_context)(context_type, user_message)
+        history = [h async for h in ChatMessage.objects.filter(user=user).order_by('-timestamp')[:5]]
+        ai_response = await chat_with_groq_async(
+            user_message, context=context, history=ChatMessageViewSet._history_messages(history)
+        )
+        # Si Groq falló, no guardar el mensaje como si fuera respuesta válida:
+        # 503 para que el frontend pueda manejar el error.
+        if isinstance(ai_response, str) and ai_response.strip().lower().startswith('error'):
+            return Response(
+                {'error': ai_response, 'code': 'GROQ_UNAVAILABLE'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+        await sync_to_async(chat_cache.guardar)(clave, ai_response)
+
+    chat_msg = await ChatMessage.objects.acreate(
+        user=user,
+        user_message=user_message,
+        ai_response=ai_response,
+        context_type=context_type,
+    )
+    response = Response(ChatMessageSerializer(chat_msg).data, status=status.HTTP_201_CREATED)
+    if hit is not None:
+        response['X-Cache'] = 'HIT' if hit else 'MISS'
+    return response
+
+
+async def responder_imagen(request):
+    """Flujo de POST /api/images/ (imagen en `request.FILES`). Retorna una `Response` de DRF."""
+    image_bytes, error = ImageAnalysisViewSet._leer_imagen(request)
+    if error:
+        return error
+    # Misma imagen (o casi) ya analizada: resultado guardado, sin Groq
+    huellas = await en_hilo_imagenes(imagen_cache.huellas, image_bytes)
+    huellas, analysis_result, coincidencia = await sync_to_async(imagen_cache.buscar_huellas)(huellas)
+    if analysis_result is None:
+        # En Railway es mejor fallar rápido que agotar timeouts del proxy (502).
+        analysis_result = await analyze_product_image_v2_async(image_bytes, max_retries=0)
+        await sync_to_async(imagen_cache.guardar)(huellas, analysis_result)
+    return ImageAnalysisViewSet._respuesta_analisis(request, analysis_result, coincidencia)
+
+
+@csrf_exempt
+@require_POST
+async def chat(request):
+    """Chat con Groq: POST /api/chat/ (y su alias /api/ai/chat/)."""
+    user = await _usuario(request)
+    if user is None:
+        return _no_autenticado()
+    datos = _datos(request)
+    if datos is None:
+        return JsonResponse({'error': 'JSON inválido.'}, status=status.HTTP_400_BAD_REQUEST)
+    return _json(await responder_chat(user, datos))
+
+
+@csrf_exempt
+@require_POST
+async def imagen(request):
+    """Análisis de imagen de producto: POST /api/images/ (y su alias /api/ai/imagen/)."""
+    user = await _usuario(request)
+    if user is None:
+        return _no_autenticado()
+    return _json(await responder_imagen(request))
+
+
+def coleccion(vista_post, vista_viewset):
+    """Ruta de una colección: POST va a `vista_post` (asíncrona) y el resto al ViewSet."""
+    vista_viewset = sync_to_async(vista_viewset)
+
+    @csrf_exempt
+    async def vista(request, *args, **kwargs):
+        if request.method == 'POST':
+            return await vista_post(request)
+        return await vista_viewset(request, *args, **kwargs)
+    return vista
@@ -0,0 +1,74 @@
+"""
+Caché versionado para las respuestas de analíticas.
+
+Cada respuesta se guarda bajo (endpoint, parámetros, versión de datos). Las
+escrituras sobre Venta, VentaDetalle y Producto (señales en `signals.py`) y
+las actualizaciones de los resúmenes diarios (`rollups.py`) incrementan la
+versión al confirmar, así que las entradas viejas dejan de leerse sin tener
+que borrarlas una por una; el TTL las termina de limpiar. Los agregados
+caros que cambian poco con cada venta (los segmentos RFM de `trends`) se
+guardan sin versión (`versionado=False`) y se renuevan solo por TTL.
+
+Usa el alias de caché `analytics` (Redis si `REDIS_URL` está definido, si no
+memoria local). En tests basta con sobreescribir `CACHES['analytics']`.
+"""
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+CLAVE_VERSION = 'analytics:version'
+
+
+def _cache():
+    return caches['analytics']
+
+
+def version_datos() -> int:
+    """Versión actual de los datos de analíticas."""
+    # Inicializar con la hora evita reutilizar una versión vieja si la clave
+    # fue desalojada del caché
+    return _cache().get_or_set(CLAVE_VERSION, int(time.time() * 1000), timeout=None)
+
+
+def _incrementar():
+    try:
+        _cache().incr(CLAVE_VERSION)
+    except ValueError:
+        _cache().add(CLAVE_VERSION, int(time.time() * 1000), timeout=None)
+
+
+def invalidar() -> None:
+    """Incrementa la versión de datos cuando confirme la transacción actual.
+
+    Incrementar antes del commit permitiría que una lectura concurrente
+    guarde datos viejos bajo la versión nueva.
+    """
+    transaction.on_commit(_incrementar)
+
+
+def cacheado(endpoint: str, params, calcular, ttl: int = None, guardar_si=None, versionado: bool = True):
+    """Retorna (valor, hit) para `endpoint` con `params`, calculándolo si falta.
+
+    `calcular` se invoca sin argumentos solo en un miss. El valor debe ser
+    serializable por el backend de caché (pickle). Si `guardar_si(valor)`
+    es falso (p. ej. Groq respondió con error) el valor no se guarda. Con
+    `versionado=False` la clave no incluye la versión de datos: el valor
+    dura el TTL aunque haya ventas nuevas.
+    """
+    ttl = ttl or getattr(settings, 'ANALYTICS_CACHE_TTL', 3600)
+    huella = hashlib.sha256(
+        json.dumps(sorted(dict(params).items()), default=str).encode()
+    ).hexdigest()[:32]
+    version = version_datos() if versionado else 'ttl'
+    clave = f'analytics:{endpoint}:{version}:{huella}'
+    valor = _cache().get(clave)
+    if valor is not None:
+        return valor, True
+    valor = calcular()
+    if guardar_si is None or guardar_si(valor):
+        _cache().set(clave, valor, timeout=ttl)
+    return valor, False
@@ -0,0 +1,212 @@
+"""
+Análisis de canasta: qué productos se compran juntos.
+
+`ParProductos` es la matriz de co-ocurrencia de productos por venta,
+guardada de forma dispersa (solo pares de productos distintos con conteo
+> 0) y en ambas direcciones, así "qué se compra con X" es un rango del
+índice único (producto_a, producto_b). Sin diagonal: las ventas que
+incluyen a X salen de los resúmenes diarios (suma de
+`ProductoDiario.lineas`), que cuentan las mismas ventas resumidas.
+
+Con n_ab = ventas con a y b, n_a = ventas con a y N = ventas totales (suma
+de `VentaDiaria.ventas`), las métricas se calculan al consultar:
+
+    soporte(a, b)   = n_ab / N
+    confianza(a→b)  = n_ab / n_a
+    lift(a, b)      = n_ab · N / (n_a · n_b)
+
+(n_a cuenta líneas: una venta con dos líneas del mismo producto lo cuenta
+dos veces, un error menor que no justifica otra tabla.)
+
+Mantenimiento:
+- `reconstruir` arma la matriz desde cero con un auto-join de
+  `VentaDetalle` por venta, agrupado en la BD (INSERT ... SELECT por lotes
+  de ventas, sin traer pares a Python). Comando `reconstruir_canasta`.
+- Las ventas nuevas se suman al resumirse (`acumular_ventas`, llamado por
+  `rollups.resumir_pendientes` en su transacción, fuera de la de la venta),
+  con el mismo auto-join. La matriz cuenta las ventas con
+  `Venta.resumida`, igual que los resúmenes diarios.
+- Las ediciones y eliminaciones de ventas ya resumidas llaman a
+  `marcar_venta` antes de modificarlas: al confirmar se resta la canasta
+  anterior y se suma la nueva.
+"""
+from collections import Counter
+
+from django.db import connection, transaction
+from django.db.models import Count, F, FloatField, Max, Min, OuterRef, Subquery, Sum
+from django.db.models.functions import Cast
+
+from .models import ParProductos, ProductoDiario, Venta, VentaDetalle, VentaDiaria
+
+ORDENES = ('confianza', 'lift')
+
+
+def _tabla():
+    qn = connection.ops.quote_name
+    return qn(ParProductos._meta.db_table), qn('producto_a_id'), qn('producto_b_id'), qn('ventas')
+
+
+def _sql_upsert(origen: str) -> str:
+    """INSERT de (producto_a, producto_b, ventas) desde `origen` que suma sobre el par existente."""
+    tabla, a, b, ventas = _tabla()
+    return (
+        f'INSERT INTO {tabla} ({a}, {b}, {ventas}) {origen} '
+        f'ON CONFLICT ({a}, {b}) DO UPDATE SET {ventas} = {tabla}.{ventas} + excluded.{ventas}'
+    )
+
+
+def _pares(productos):
+    """Pares ordenados (a, b) de productos distintos de una canasta."""
+    ids = set(productos)
+    return ((a, b) for a in ids for b in ids if a != b)
+
+
+def _sumar_lineas(cursor, lineas) -> None:
+    """Suma a la matriz los pares de `lineas` (queryset de `VentaDetalle`), agrupados en la BD."""
+    # (producto de la línea, producto de otra línea de la misma venta, ventas distintas)
+    pares = (
+        lineas.annotate(otro=F('venta__detalles__producto_id')).exclude(otro=F('producto_id'))
+        .values('producto_id', 'otro').annotate(n=Count('venta_id', distinct=True)).order_by()
+    )
+    sql, params = pares.query.sql_with_params()
+    # WHERE true: evita la ambigüedad de ON CONFLICT tras un SELECT en SQLite
+    cursor.execute(_sql_upsert(f'SELECT * FROM ({sql}) pares WHERE true'), params)
+
+
+def acumular_ventas(venta_ids) -> None:
+    """Suma las canastas de las ventas `venta_ids`, ya con sus líneas. Una sola sentencia."""
+    with connection.cursor() as cursor:
+        _sumar_lineas(cursor, VentaDetalle.objects.filter(venta_id__in=venta_ids))
+
+
+def acumular(canastas) -> None:
+    """Suma canastas nuevas: un iterable de ids de producto por venta. Una sola sentencia."""
+    conteos = Counter()
+    for productos in canastas:
+        conteos.update(_pares(productos))
+    if not conteos:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(_sql_upsert('VALUES (%s, %s, %s)'), [(a, b, n) for (a, b), n in conteos.items()])
+
+
+def _canasta(venta_id) -> frozenset:
+    return frozenset(VentaDetalle.objects.filter(venta_id=venta_id).values_list('producto_id', flat=True))
+
+
+def marcar_venta(venta_id) -> None:
+    """Registra la canasta actual de una venta que se va a editar o eliminar.
+
+    Llamar una vez por venta y transacción, antes de modificar sus líneas.
+    Al confirmar se reemplaza en la matriz la canasta anterior por la que
+    quede (vacía si la venta se eliminó). Una venta aún sin resumir no está
+    en la matriz: se sumará con sus líneas finales. El bloqueo de la venta
+    impide que `rollups.resumir_pendientes` la resuma a mitad de la edición.
+    """
+    resumida = Venta.objects.select_for_update().filter(pk=venta_id).values_list('resumida', flat=True).first()
+    if not resumida:
+        return
+    anterior = _canasta(venta_id)
+    transaction.on_commit(lambda: _reemplazar(venta_id, anterior))
+
+
+def _reemplazar(venta_id, anterior) -> None:
+    nueva = _canasta(venta_id)
+    if nueva == anterior:
+        return
+    with transaction.atomic():
+        if anterior:
+            pares = ParProductos.objects.filter(producto_a__in=anterior, producto_b__in=anterior)
+            pares.filter(ventas__gt=0).update(ventas=F('ventas') - 1)
+        acumular([nueva])
+        if anterior:
+            pares.filter(ventas=0).delete()
+
+
+def reconstruir(lote: int = 5000) -> int:
+    """Recalcula la matriz desde cero, por lotes de `lote` ids de venta.
+
+    Solo cuenta las ventas ya resumidas (las pendientes se suman al
+    resumirse). Todo corre en una transacción: las consultas ven la matriz
+    anterior hasta que termina. Retorna la cantidad de pares escritos.
+    """
+    lineas = VentaDetalle.objects.filter(venta__resumida=True)
+    rango = lineas.aggregate(min=Min('venta_id'), max=Max('venta_id'))
+    with transaction.atomic():
+        ParProductos.objects.all().delete()
+        if rango['min'] is None:
+            return 0
+        with connection.cursor() as cursor:
+            for inicio in range(rango['min'], rango['max'] + 1, lote):
+                _sumar_lineas(cursor, lineas.filter(venta_id__gte=inicio, venta_id__lt=inicio + lote))
+        return ParProductos.objects.count()
+
+
+def _total_ventas() -> int:
+    return VentaDiaria.objects.aggregate(n=Sum('ventas'))['n'] or 0
+
+
+def _ventas_con(campo):
+    """Ventas que incluyen al producto de `campo`, desde `ProductoDiario`."""
+    return Subquery(
+        ProductoDiario.objects.filter(producto=OuterRef(campo)).values('producto')
+        .annotate(n=Sum('lineas')).values('n')[:1]
+    )
+
+
+def _metricas(n_ab, n_a, n_b, total) -> dict:
+    return {
+        'soporte': round(n_ab / total, 4) if total else 0,
+        'confianza': round(n_ab / n_a, 4) if n_a else 0,
+        'lift': round(n_ab * total / (n_a * n_b), 3) if total and n_a and n_b else 0,
+    }
+
+
+def frecuentemente_juntos(producto_id, n: int = 10, orden: str = 'confianza', minimo: int = 1) -> dict:
+    """Productos que más se compran junto a `producto_id`. Tres consultas.
+
+    `orden='confianza'` prioriza lo que más acompaña al producto (n_ab);
+    `orden='lift'` lo que se compra con él más de lo esperable por su
+    popularidad (n_ab / n_b). `minimo` descarta pares con menos ventas
+    conjuntas, útil con lift para no premiar coincidencias aisladas.
+    """
+    if orden not in ORDENES:
+        raise ValueError(f'orden debe ser uno de {ORDENES}')
+    total = _total_ventas()
+    n_a = ProductoDiario.objects.filter(producto_id=producto_id).aggregate(n=Sum('lineas'))['n'] or 0
+    criterio = '-ventas' if orden == 'confianza' else '-afinidad'
+    filas = (
+        ParProductos.objects.filter(producto_a_id=producto_id, ventas__gte=minimo)
+        .annotate(n_b=_ventas_con('producto_b'), afinidad=Cast('ventas', FloatField()) / F('n_b'))
+        .order_by(criterio, 'producto_b_id')
+        .values_list('producto_b_id', 'producto_b__nombre', 'producto_b__codigo', 'ventas', 'n_b')[:n]
+    )
+    return {
+        'producto': producto_id,
+        'ventas': n_a,
+        'total_ventas': total,
+        'sugerencias': [
+            {'producto': pid, 'nombre': nombre, 'codigo': codigo, 'ventas_juntos': n_ab,
+             **_metricas(n_ab, n_a, n_b, total)}
+            for pid, nombre, codigo, n_ab, n_b in filas
+        ],
+    }
+
+
+def pares_frecuentes(n: int = 10, minimo: int = 2) -> list:
+    """Los `n` pares de productos distintos más comprados juntos, con sus métricas.
+
+    Recorre la matriz (un par por fila, a < b); pensado para reportes
+    cacheados como el análisis de tendencias.
+    """
+    total = _total_ventas()
+    filas = (
+        ParProductos.objects.filter(producto_a_id__lt=F('producto_b_id'), ventas__gte=minimo)
+        .annotate(n_a=_ventas_con('producto_a'), n_b=_ventas_con('producto_b'))
+        .order_by('-ventas', 'producto_a_id', 'producto_b_id')
+        .values_list('producto_a__nombre', 'producto_b__nombre', 'ventas', 'n_a', 'n_b')[:n]
+    )
+    return [
+        {'producto_a': a, 'producto_b': b, 'ventas_juntos': n_ab, **_metricas(n_ab, n_a, n_b, total)}
+        for a, b, n_ab, n_a, n_b in filas
+    ]
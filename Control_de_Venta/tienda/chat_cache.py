@@ -0,0 +1,121 @@
+"""
+Caché de respuestas del chat IA.
+
+Muchas preguntas se repiten ("¿cuánto cuesta el pendrive SanDisk?"), y cada
+una armaba el contexto y hacía una llamada completa a Groq. La respuesta se
+guarda bajo:
+
+    (pregunta normalizada, context_type, versión de los datos del contexto)
+
+- La pregunta se normaliza: minúsculas, sin tildes ni signos, espacios
+  colapsados ("¿Cuánto cuesta el PENDRIVE?" == "cuanto cuesta el pendrive").
+- La versión depende del contexto que ve el modelo: catálogo (`producto`,
+  `stock`), ventas (`venta`, la versión de `analytics_cache`) o ninguna
+  (`general`). La versión del catálogo sube al confirmar cambios de
+  productos o categorías (`signals.py`) y cuando un producto cruza su
+  umbral de stock (`stock.revisar_umbrales`), así las entradas viejas dejan
+  de leerse. Los contextos de catálogo llevan el estado de stock bajo y no
+  la cantidad exacta, que cambia con cada venta; esa la responde en vivo
+  `ChatMessageViewSet._try_inventory_answer`, sin caché.
+- Las entradas vencen por TTL (`CHAT_CACHE_TTL`) y, al llenarse el caché,
+  se descartan las menos usadas (LRU: `MAX_ENTRIES` en memoria local,
+  `maxmemory-policy allkeys-lru` en Redis).
+
+El historial del usuario no entra en la clave (anularía los aciertos); por
+eso no se cachean preguntas de menos de `MIN_PALABRAS` palabras, que
+suelen depender de la conversación ("¿y cuánto cuesta?").
+
+Usa el alias de caché `chat`. Los contadores de aciertos y fallos viven en
+el mismo caché (compartidos entre workers con Redis) y se exponen en
+GET /api/chat/cache/.
+"""
+import hashlib
+import re
+import time
+import unicodedata
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .analytics_cache import version_datos
+
+CLAVE_VERSION = 'chat:version:catalogo'
+CONTADORES = ('aciertos', 'fallos', 'omitidas')
+MIN_PALABRAS = 3
+CONTEXTOS_CATALOGO = ('producto', 'stock')
+
+
+def _cache():
+    return caches['chat']
+
+
+def normalizar(pregunta: str) -> str:
+    """Minúsculas, sin tildes ni signos de puntuación, espacios colapsados."""
+    texto = unicodedata.normalize('NFKD', pregunta.lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(re.findall(r'\w+', texto))
+
+
+def version_catalogo() -> int:
+    """Versión actual del catálogo (productos, precios y stock bajo)."""
+    return _cache().get_or_set(CLAVE_VERSION, int(time.time() * 1000), timeout=None)
+
+
+def _incrementar():
+    try:
+        _cache().incr(CLAVE_VERSION)
+    except ValueError:
+        _cache().add(CLAVE_VERSION, int(time.time() * 1000), timeout=None)
+
+
+def invalidar_catalogo() -> None:
+    """Incrementa la versión del catálogo cuando confirme la transacción actual."""
+    transaction.on_commit(_incrementar)
+
+
+def _version(context_type) -> str:
+    if context_type in CONTEXTOS_CATALOGO:
+        return f'c{version_catalogo()}'
+    if context_type == 'venta':
+        return f'v{version_datos()}'
+    return '-'
+
+
+def _contar(contador: str) -> None:
+    clave = f'chat:stats:{contador}'
+    try:
+        _cache().incr(clave)
+    except ValueError:
+        if not _cache().add(clave, 1, timeout=None):
+            _cache().incr(clave)
+
+
+def buscar(pregunta: str, context_type: str):
+    """Retorna (clave, respuesta). `respuesta` es None en un fallo; `clave` es None si no se cachea."""
+    normalizada = normalizar(pregunta)
+    if len(normalizada.split()) < MIN_PALABRAS:
+        _contar('omitidas')
+        return None, None
+    huella = hashlib.sha256(f'{context_type}|{normalizada}'.encode()).hexdigest()[:32]
+    clave = f'chat:{_version(context_type)}:{huella}'
+    respuesta = _cache().get(clave)
+    _contar('aciertos' if respuesta is not None else 'fallos')
+    return clave, respuesta
+
+
+def guardar(clave, respuesta: str) -> None:
+    """Guarda la respuesta de Groq bajo la clave de `buscar` (sin efecto si es None)."""
+    if clave:
+        _cache().set(clave, respuesta, timeout=getattr(settings, 'CHAT_CACHE_TTL', 3600))
+
+
+def estadisticas() -> dict:
+    """Contadores de aciertos, fallos y preguntas omitidas, y la tasa de aciertos."""
+    valores = _cache().get_many([f'chat:stats:{c}' for c in CONTADORES])
+    datos = {c: valores.get(f'chat:stats:{c}', 0) for c in CONTADORES}
+    consultas = datos['aciertos'] + datos['fallos']
+    datos['tasa_aciertos'] = round(datos['aciertos'] / consultas, 4) if consultas else 0
+    datos['ttl'] = getattr(settings, 'CHAT_CACHE_TTL', 3600)
+    datos['version_catalogo'] = version_catalogo()
+    return datos
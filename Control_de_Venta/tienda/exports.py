@@ -0,0 +1,292 @@
+"""
+Exportación a Excel (XLSX) de ventas, inventario y analíticas.
+
+Los libros se arman con el modo write-only de openpyxl, que escribe cada
+fila a disco al agregarla, y las filas se leen con
+`.values_list(...).iterator(chunk_size=...)` (cursor del lado del servidor
+en PostgreSQL), así que la memoria no crece con el tamaño del reporte: no se
+materializan querysets, instancias de modelo ni serializers.
+
+Un XLSX es un zip cuyo índice va al final, así que el libro se arma
+completo en un archivo temporal antes de responder: la memoria queda plana,
+pero el primer byte sale cuando el libro está escrito. Después
+`respuesta_xlsx` lo envía en bloques y el archivo se borra al cerrarse la
+respuesta.
+
+Para extracciones masivas (BI) los listados de la API aceptan además
+`?format=csv` y `?format=ndjson` (`ExportacionStreamingMixin`): una sola
+respuesta streaming, sin paginación, sin COUNT(*) y sin serializers, con
+las columnas planas de `campos_exportacion`; aquí sí cada bloque de filas
+sale apenas llega de la BD.
+
+Bajo daphne (ASGI) Django consume los iteradores síncronos de una respuesta
+con `sync_to_async(list)`, es decir, todo en memoria antes del primer byte.
+Las respuestas de este módulo (`RespuestaStreaming`, `ArchivoStreaming`)
+leen en cambio un bloque por vez en el hilo de la petición; bajo WSGI se
+iteran igual que siempre.
+"""
+import csv
+import io
+import json
+import tempfile
+from datetime import date, datetime
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.settings import api_settings
+
+from .models import CategoriaDiaria, Producto, ProductoDiario, VentaDetalle, VentaDiaria
+from .reposicion import metricas_reposicion
+from .stock import stock_con_slots
+
+CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+# Límite de filas de una hoja de Excel (incluye el encabezado)
+MAX_FILAS = 1_048_576
+CHUNK = 2000
+
+
+_FIN = object()
+
+
+class _BloquesEnHiloMixin:
+    """Iteración async de un contenido síncrono, un bloque por `sync_to_async`.
+
+    El hilo es el de la petición (`thread_sensitive`), así que el cursor
+    del lado del servidor de `.iterator()` sigue en la misma conexión.
+    """
+
+    async def __aiter__(self):
+        if self.is_async:
+            async for bloque in self.streaming_content:
+                yield bloque
+            return
+        bloques = iter(self.streaming_content)
+        siguiente = sync_to_async(next)
+        while (bloque := await siguiente(bloques, _FIN)) is not _FIN:
+            yield bloque
+
+
+class RespuestaStreaming(_BloquesEnHiloMixin, StreamingHttpResponse):
+    """`StreamingHttpResponse` que también hace streaming bajo ASGI."""
+
+
+class ArchivoStreaming(_BloquesEnHiloMixin, FileResponse):
+    """`FileResponse` que también envía el archivo por bloques bajo ASGI."""
+
+
+def _local(fecha):
+    # Excel no admite zonas horarias: se exporta la hora local sin tzinfo
+    return timezone.localtime(fecha).replace(tzinfo=None) if isinstance(fecha, datetime) else fecha
+
+
+def _escribir_hoja(libro, titulo, encabezados, filas, anchos=None):
+    """Agrega `filas` a una hoja nueva; si superan el límite de Excel continúa en otra."""
+    parte = 1
+    hoja = None
+    escritas = MAX_FILAS
+    for fila in filas:
+        if escritas >= MAX_FILAS:
+            hoja = libro.create_sheet(titulo if parte == 1 else f'{titulo} ({parte})')
+            for i, ancho in enumerate(anchos or [], start=1):
+                hoja.column_dimensions[get_column_letter(i)].width = ancho
+            hoja.append(encabezados)
+            escritas = 1
+            parte += 1
+        hoja.append(fila)
+        escritas += 1
+    if hoja is None:
+        libro.create_sheet(titulo).append(encabezados)
+
+
+def escribir_ventas(libro, ventas, chunk: int = CHUNK):
+    """Hojas "Ventas" (una fila por venta) y "Detalle" (una fila por línea)."""
+    cabeceras = ventas.order_by('fecha', 'pk').values_list('pk', 'fecha', 'cliente__rut', 'items', 'total')
+    _escribir_hoja(
+        libro, 'Ventas', ['ID', 'Fecha', 'Cliente', 'Ítems', 'Total'],
+        ((pk, _local(fecha), rut, items, total) for pk, fecha, rut, items, total in cabeceras.iterator(chunk_size=chunk)),
+        anchos=[10, 20, 14, 8, 14],
+    )
+    lineas = (
+        VentaDetalle.objects.filter(venta__in=ventas.values('pk'))
+        .order_by('venta__fecha', 'venta_id', 'pk')
+        .values_list('venta_id', 'venta__fecha', 'producto__codigo', 'producto__nombre',
+                     'cantidad', 'precio_unitario')
+    )
+    _escribir_hoja(
+        libro, 'Detalle', ['Venta', 'Fecha', 'Código', 'Producto', 'Cantidad', 'Precio unitario', 'Subtotal'],
+        ((venta, _local(fecha), codigo, nombre, cantidad, precio, cantidad * precio)
+         for venta, fecha, codigo, nombre, cantidad, precio in lineas.iterator(chunk_size=chunk)),
+        anchos=[10, 20, 16, 40, 10, 16, 16],
+    )
+
+
+def escribir_inventario(libro, chunk: int = CHUNK):
+    """Hoja "Inventario": stock total (incluidos los slots) y valorizado por producto."""
+    filas = (
+        stock_con_slots(Producto.objects.all())
+        .order_by('nombre', 'pk')
+        .values_list('codigo', 'nombre', 'categoria__nombre', 'stock', 'precio')
+    )
+    _escribir_hoja(
+        libro, 'Inventario', ['Código', 'Producto', 'Categoría', 'Stock', 'Precio', 'Valor stock'],
+        ((codigo, nombre, categoria or '', stock, precio, stock * precio)
+         for codigo, nombre, categoria, stock, precio in filas.iterator(chunk_size=chunk)),
+        anchos=[16, 40, 20, 10, 14, 16],
+    )
+
+
+def escribir_analiticas(libro, desde, hasta, chunk: int = CHUNK):
+    """Resúmenes diarios del rango [desde, hasta] y métricas de reposición actuales."""
+    rango = {'fecha__gte': desde, 'fecha__lte': hasta}
+    _escribir_hoja(
+        libro, 'Resumen diario', ['Fecha', 'Ventas', 'Unidades', 'Ingresos', 'Líneas'],
+        VentaDiaria.objects.filter(**rango).order_by('fecha')
+        .values_list('fecha', 'ventas', 'unidades', 'ingresos', 'lineas').iterator(chunk_size=chunk),
+        anchos=[12, 10, 10, 16, 10],
+    )
+    _escribir_hoja(
+        libro, 'Productos', ['Fecha', 'Código', 'Producto', 'Unidades', 'Ingresos', 'Líneas'],
+        ProductoDiario.objects.filter(**rango).order_by('fecha', 'producto_id')
+        .values_list('fecha', 'producto__codigo', 'producto__nombre', 'unidades', 'ingresos', 'lineas')
+        .iterator(chunk_size=chunk),
+        anchos=[12, 16, 40, 10, 16, 10],
+    )
+    _escribir_hoja(
+        libro, 'Categorías', ['Fecha', 'Categoría', 'Unidades', 'Ingresos', 'Líneas'],
+        CategoriaDiaria.objects.filter(**rango).order_by('fecha', 'categoria_id')
+        .values_list('fecha', 'categoria__nombre', 'unidades', 'ingresos', 'lineas')
+        .iterator(chunk_size=chunk),
+        anchos=[12, 24, 10, 16, 10],
+    )
+    m = metricas_reposicion()
+    _escribir_hoja(
+        libro, 'Reposición',
+        ['Código', 'Producto', 'Stock', 'Pronóstico diario', 'Método', 'Stock seguridad',
+         'Punto reorden', 'Días cobertura', 'Cantidad a pedir'],
+        ((m['codigo'][i], m['nombre'][i], int(m['stock'][i]), round(float(m['pronostico'][i]), 2),
+          'croston' if m['intermitente'][i] else 'ses', round(float(m['stock_seguridad'][i]), 1),
+          round(float(m['punto_reorden'][i]), 1),
+          round(float(m['dias_cobertura'][i]), 1) if m['pronostico'][i] > 0 else None,
+          int(m['cantidad_reorden'][i]))
+         for i in range(len(m['id']))),
+        anchos=[16, 40, 10, 16, 10, 14, 14, 14, 14],
+    )
+
+
+def respuesta_xlsx(escribir, nombre: str) -> FileResponse:
+    """Arma un libro write-only con `escribir(libro)` y lo entrega como descarga.
+
+    El libro se escribe completo antes de responder (ver el docstring del
+    módulo); luego se envía por bloques. El archivo temporal queda abierto
+    en la respuesta y se elimina cuando Django la cierra.
+    """
+    libro = Workbook(write_only=True)
+    escribir(libro)
+    archivo = tempfile.TemporaryFile(suffix='.xlsx')
+    try:
+        libro.save(archivo)
+    except Exception:
+        archivo.close()
+        raise
+    archivo.seek(0)
+    return ArchivoStreaming(archivo, as_attachment=True, filename=nombre, content_type=CONTENT_TYPE)
+
+
+
+# --- Exportación streaming CSV / NDJSON -------------------------------------
+
+class CSVRenderer(BaseRenderer):
+    """Habilita `?format=csv`; los listados los arma `ExportacionStreamingMixin`.
+
+    Si llega a renderizar datos (p. ej. un error) los entrega como JSON.
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return JSONRenderer().render(data)
+
+
+class NDJSONRenderer(CSVRenderer):
+    """Habilita `?format=ndjson` (un objeto JSON por línea)."""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+
+def _celda_csv(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    if isinstance(valor, (dict, list)):
+        return json.dumps(valor, ensure_ascii=False)
+    return valor
+
+
+def filas_csv(campos, filas, lote: int = 500):
+    """Genera el CSV en bloques de `lote` filas (encabezado incluido)."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(campos)
+    pendientes = 0
+    for fila in filas:
+        escritor.writerow([_celda_csv(v) for v in fila])
+        pendientes += 1
+        if pendientes >= lote:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pendientes = 0
+    yield buffer.getvalue()
+
+
+def filas_ndjson(campos, filas, lote: int = 500):
+    """Genera NDJSON en bloques de `lote` filas."""
+    codificar = DjangoJSONEncoder(ensure_ascii=False).encode
+    bloque = []
+    for fila in filas:
+        bloque.append(codificar(dict(zip(campos, fila))))
+        if len(bloque) >= lote:
+            yield '\n'.join(bloque) + '\n'
+            bloque = []
+    if bloque:
+        yield '\n'.join(bloque) + '\n'
+
+
+class ExportacionStreamingMixin:
+    """Agrega `?format=csv` y `?format=ndjson` al `list` de un ViewSet.
+
+    Lee `queryset_exportacion()` con `.values_list(*campos_exportacion)
+    .iterator(chunk_size)` y escribe las filas a medida que llegan de la BD.
+    Respeta `get_queryset` (filtros por usuario) pero no pagina.
+    """
+    campos_exportacion = ()
+    chunk_exportacion = CHUNK
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, CSVRenderer, NDJSONRenderer]
+
+    def queryset_exportacion(self):
+        return self.filter_queryset(self.get_queryset())
+
+    def list(self, request, *args, **kwargs):
+        formato = request.accepted_renderer.format
+        if formato not in ('csv', 'ndjson'):
+            return super().list(request, *args, **kwargs)
+        campos = list(self.campos_exportacion)
+        filas = (
+            self.queryset_exportacion().prefetch_related(None)
+            .values_list(*campos).iterator(chunk_size=self.chunk_exportacion)
+        )
+        generar = filas_csv if formato == 'csv' else filas_ndjson
+        response = RespuestaStreaming(
+            generar(campos, filas), content_type=f'{request.accepted_renderer.media_type}; charset=utf-8'
+        )
+        if formato == 'csv':
+            nombre = self.basename or self.queryset.model._meta.model_name
+            response['Content-Disposition'] = f'attachment; filename="{nombre}_{timezone.localdate():%Y%m%d}.csv"'
+        return response
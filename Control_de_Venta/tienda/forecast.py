@@ -0,0 +1,127 @@
+"""
+Pronóstico de demanda y punto de reorden para todo el catálogo.
+
+Trabaja sobre la matriz de ventas diarias Y (días × productos) armada desde
+`ProductoDiario` y recorre el tiempo una sola vez; en cada paso actualiza
+con numpy el estado de todos los productos a la vez:
+
+- Suavizamiento exponencial simple (SES) para demanda regular.
+- Croston con corrección SBA para demanda intermitente (muchos días en 0).
+  Un producto se trata como intermitente si el intervalo promedio entre
+  ventas (ADI) supera 1.32 días (criterio de Syntetos-Boylan).
+
+Con el pronóstico diario f y la desviación σ de los errores a un paso:
+
+    stock_seguridad  = z(nivel_servicio) · σ · √plazo
+    punto_reorden    = f · plazo + stock_seguridad
+    cantidad_reorden = max(0, punto_reorden + f · cobertura − stock)
+
+Los resultados son deterministas: la API los expone tal cual y, si se pide,
+Groq solo los explica.
+"""
+from datetime import timedelta
+from statistics import NormalDist
+
+import numpy as np
+from django.utils import timezone
+
+from .models import ProductoDiario
+
+# Umbral de Syntetos-Boylan para considerar la demanda intermitente
+ADI_INTERMITENTE = 1.32
+
+
+def matriz_diaria(ids, dias: int, hasta=None, dtype=np.float32):
+    """Arma la matriz de unidades vendidas (dias × len(ids)) desde los resúmenes.
+
+    `ids` debe venir ordenado ascendente. La última fila es `hasta` (por
+    defecto hoy). Una sola consulta sobre `ProductoDiario`.
+    """
+    hasta = hasta or timezone.localdate()
+    desde = hasta - timedelta(days=dias - 1)
+    filas = ProductoDiario.objects.filter(fecha__gte=desde, fecha__lte=hasta).values_list(
+        'producto_id', 'fecha', 'unidades'
+    )
+    Y = np.zeros((dias, len(ids)), dtype=dtype)
+    if not len(ids):
+        return Y
+    datos = np.array([(pid, (fecha - desde).days, n) for pid, fecha, n in filas], dtype=np.int64).reshape(-1, 3)
+    pos = np.searchsorted(ids, datos[:, 0])
+    validos = (pos < len(ids)) & (np.asarray(ids)[np.minimum(pos, len(ids) - 1)] == datos[:, 0])
+    Y[datos[validos, 1], pos[validos]] = datos[validos, 2]
+    return Y
+
+
+def pronosticar(Y, alpha: float = 0.1):
+    """Pronóstico diario por producto para la matriz Y (días × productos).
+
+    Corre SES y Croston-SBA en la misma pasada y elige por producto según el
+    ADI. Retorna un dict de arrays de largo `productos`: `pronostico`
+    (unidades/día), `sigma` (desviación del error a un paso), `adi` e
+    `intermitente`.
+    """
+    dias, n = Y.shape
+    nivel = np.zeros(n)           # SES
+    tamano = np.zeros(n)          # Croston: tamaño de la demanda
+    intervalo = np.ones(n)        # Croston: intervalo entre demandas
+    desde_ultima = np.ones(n)     # días desde la última demanda (incluye el actual)
+    iniciado = np.zeros(n, dtype=bool)
+    sse_ses = np.zeros(n)
+    sse_croston = np.zeros(n)
+    demandas = np.zeros(n)
+    factor_sba = 1 - alpha / 2
+
+    for t in range(dias):
+        y = Y[t].astype(np.float64)
+        hay = y > 0
+        # Errores del pronóstico hecho en t-1 (desde que el producto tuvo venta)
+        f_croston = np.where(iniciado, factor_sba * tamano / intervalo, 0.0)
+        sse_ses += np.where(iniciado, (y - nivel) ** 2, 0.0)
+        sse_croston += np.where(iniciado, (y - f_croston) ** 2, 0.0)
+
+        primera = hay & ~iniciado
+        nivel = np.where(primera, y, nivel + alpha * (y - nivel) * iniciado)
+        tamano = np.where(primera, y, np.where(hay, tamano + alpha * (y - tamano), tamano))
+        # El intervalo hasta la primera venta se desconoce (la historia puede
+        # empezar antes de que el producto existiera): se inicializa con el
+        # primer intervalo observado, entre la primera y la segunda venta
+        segunda = hay & (demandas == 1)
+        intervalo = np.where(
+            segunda, desde_ultima,
+            np.where(hay & (demandas > 1), intervalo + alpha * (desde_ultima - intervalo), intervalo),
+        )
+        iniciado |= hay
+        desde_ultima = np.where(hay, 1.0, desde_ultima + 1)
+        demandas += hay
+
+    # Días observados desde la primera venta: los anteriores no cuentan ni
+    # para el ADI ni para promediar el error
+    observados = np.maximum(dias - np.argmax(Y > 0, axis=0), 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        adi = np.where(demandas > 0, observados / demandas, np.inf)
+    intermitente = adi > ADI_INTERMITENTE
+    pronostico = np.where(intermitente, factor_sba * tamano / intervalo, nivel)
+    sse = np.where(intermitente, sse_croston, sse_ses)
+    sigma = np.sqrt(sse / observados)
+    sin_ventas = demandas == 0
+    pronostico[sin_ventas] = 0.0
+    sigma[sin_ventas] = 0.0
+    return {'pronostico': pronostico, 'sigma': sigma, 'adi': adi, 'intermitente': intermitente}
+
+
+def politica_reposicion(pronostico, sigma, stock, plazo: int = 7, cobertura: int = 14,
+                        nivel_servicio: float = 0.95):
+    """Stock de seguridad, punto de reorden y cantidad a pedir por producto."""
+    z = NormalDist().inv_cdf(nivel_servicio)
+    stock_seguridad = z * sigma * np.sqrt(plazo)
+    punto_reorden = pronostico * plazo + stock_seguridad
+    cantidad_reorden = np.ceil(np.maximum(punto_reorden + pronostico * cobertura - stock, 0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dias_cobertura = np.where(pronostico > 0, stock / pronostico, np.inf)
+    return {
+        'stock_seguridad': stock_seguridad,
+        'punto_reorden': punto_reorden,
+        'cantidad_reorden': cantidad_reorden,
+        'dias_cobertura': dias_cobertura,
+        'atencion': (pronostico > 0) & (stock <= punto_reorden),
+    }
@@ -4,13 +4,21 @@ Usa dos modelos:
 - Llama 3.3 70B (chat normal, análisis)
 - Llama 4 Maverick (visión - fotos)
 """
+import asyncio
 import os
+import re
 import json
 import base64
+import threading
 import time
 import logging
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from io import BytesIO
-from groq import Groq
+import httpx
+from groq import AsyncGroq, Groq
+from PIL import Image, ImageOps
 
 logger = logging.getLogger(__name__)
 
@@ -24,29 +32,255 @@ GROQ_API_KEY_CHAT = _env_str('GROQ_API_KEY_CHAT')
 GROQ_API_KEY_VISION = _env_str('GROQ_API_KEY_VISION')
 GROQ_TIMEOUT_SECONDS = float(_env_str('GROQ_TIMEOUT_SECONDS', '15'))
 GROQ_MAX_RETRIES = int(_env_str('GROQ_MAX_RETRIES', '0'))
+# Pool HTTP compartido por proceso (conexiones keep-alive reutilizadas entre llamadas)
+GROQ_CONNECT_TIMEOUT = float(_env_str('GROQ_CONNECT_TIMEOUT', '5'))
+GROQ_MAX_CONNECTIONS = int(_env_str('GROQ_MAX_CONNECTIONS', '20'))
+GROQ_MAX_KEEPALIVE = int(_env_str('GROQ_MAX_KEEPALIVE', '10'))
+GROQ_KEEPALIVE_EXPIRY = float(_env_str('GROQ_KEEPALIVE_EXPIRY', '30'))
+# Preprocesamiento de imágenes para visión (GROQ_IMAGEN_LADO_MAX=0 envía el original)
+GROQ_IMAGEN_LADO_MAX = int(_env_str('GROQ_IMAGEN_LADO_MAX', '1280'))
+GROQ_IMAGEN_FORMATO = _env_str('GROQ_IMAGEN_FORMATO', 'JPEG').upper()  # JPEG o WEBP
+GROQ_IMAGEN_CALIDAD = int(_env_str('GROQ_IMAGEN_CALIDAD', '82'))
+GROQ_IMAGEN_HILOS = int(_env_str('GROQ_IMAGEN_HILOS', str(min(4, os.cpu_count() or 1))))
 
 # Modelos disponibles en Groq (Diciembre 2025)
 MODEL_CHAT = "llama-3.3-70b-versatile"  # Para chat y análisis
 MODEL_VISION = "meta-llama/llama-4-maverick-17b-128e-instruct"  # Para visión (fotos)
 
-def get_groq_client_chat():
-    """Retorna cliente Groq configurado para chat (Llama 3.3 70B)."""
-    api_key = GROQ_API_KEY_CHAT or _env_str('GROQ_API_KEY')
-    # Groq() levanta excepción si api_key falta; esto se maneja en el caller.
+
+def crear_cliente(api_key, base_url=None):
+    """Cliente Groq nuevo con su propio pool de conexiones (límites y timeouts del entorno)."""
+    http_client = httpx.Client(
+        timeout=httpx.Timeout(GROQ_TIMEOUT_SECONDS, connect=GROQ_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=GROQ_MAX_CONNECTIONS,
+            max_keepalive_connections=GROQ_MAX_KEEPALIVE,
+            keepalive_expiry=GROQ_KEEPALIVE_EXPIRY,
+        ),
+    )
     try:
-        return Groq(api_key=api_key, timeout=GROQ_TIMEOUT_SECONDS, max_retries=GROQ_MAX_RETRIES)
-    except TypeError:
-        # Compatibilidad con versiones del SDK que no exponen `max_retries`.
-        return Groq(api_key=api_key, timeout=GROQ_TIMEOUT_SECONDS)
+        # Groq() levanta excepción si api_key falta; esto se maneja en el caller.
+        try:
+            return Groq(api_key=api_key, base_url=base_url, timeout=GROQ_TIMEOUT_SECONDS,
+                        max_retries=GROQ_MAX_RETRIES, http_client=http_client)
+        except TypeError:
+            # Compatibilidad con versiones del SDK que no exponen `max_retries`.
+            return Groq(api_key=api_key, base_url=base_url, timeout=GROQ_TIMEOUT_SECONDS,
+                        http_client=http_client)
+    except Exception:
+        http_client.close()
+        raise
+
+
+# Registro de clientes del proceso: uno por (api_key, base_url), creado al
+# primer uso. httpx.Client es seguro entre hilos, así que todas las llamadas
+# comparten sus conexiones keep-alive (sin TLS ni TCP nuevos por llamada).
+# Tras un fork (gunicorn --preload, multiprocessing) el hijo no debe usar los
+# sockets del padre: se detecta por pid y el registro se rehace vacío.
+_clientes = {}
+_clientes_lock = threading.Lock()
+_clientes_pid = os.getpid()
+
+
+def _reiniciar_clientes():
+    global _clientes, _clientes_lock, _clientes_pid
+    _clientes, _clientes_lock, _clientes_pid = {}, threading.Lock(), os.getpid()
+
+
+if hasattr(os, 'register_at_fork'):
+    # También un lock nuevo: otro hilo del padre podía tenerlo tomado al hacer fork
+    os.register_at_fork(after_in_child=_reiniciar_clientes)
+
+
+def cliente_compartido(api_key, base_url=None):
+    """Cliente Groq del proceso para `api_key`, creado una sola vez."""
+    if _clientes_pid != os.getpid():
+        _reiniciar_clientes()
+    clave = (api_key, base_url)
+    cliente = _clientes.get(clave)
+    if cliente is None:
+        with _clientes_lock:
+            cliente = _clientes.get(clave)
+            if cliente is None:
+                cliente = _clientes[clave] = crear_cliente(api_key, base_url)
+    return cliente
+
+
+def get_groq_client_chat():
+    """Retorna cliente Groq configurado para chat (Llama 3.3 70B), compartido en el proceso."""
+    return cliente_compartido(GROQ_API_KEY_CHAT or _env_str('GROQ_API_KEY'))
 
 
 def get_groq_client_vision():
-    """Retorna cliente Groq configurado para visión (Llama 4 Maverick)."""
-    api_key = GROQ_API_KEY_VISION or _env_str('GROQ_API_KEY')
+    """Retorna cliente Groq configurado para visión (Llama 4 Maverick), compartido en el proceso."""
+    return cliente_compartido(GROQ_API_KEY_VISION or _env_str('GROQ_API_KEY'))
+
+
+# Clientes asíncronos (vistas async bajo daphne). Un AsyncClient de httpx y
+# un semáforo solo sirven en el event loop donde se crearon, así que se
+# guardan por loop (daphne usa uno por proceso). El semáforo acota las
+# llamadas en vuelo a Groq del proceso: las que esperan cupo no ocupan
+# hilos, y si no lo obtienen en GROQ_ESPERA_CONCURRENCIA segundos fallan con
+# `GroqOcupado` en vez de encolarse sin límite.
+GROQ_MAX_CONCURRENCIA = int(_env_str('GROQ_MAX_CONCURRENCIA', '100'))
+GROQ_ESPERA_CONCURRENCIA = float(_env_str('GROQ_ESPERA_CONCURRENCIA', '30'))
+
+_por_loop = weakref.WeakKeyDictionary()
+
+
+class GroqOcupado(Exception):
+    """No hubo cupo para otra llamada a Groq dentro de la espera."""
+
+
+def _estado_loop():
+    loop = asyncio.get_running_loop()
+    estado = _por_loop.get(loop)
+    if estado is None:
+        estado = _por_loop[loop] = {'clientes': {}, 'semaforo': asyncio.Semaphore(GROQ_MAX_CONCURRENCIA)}
+    return estado
+
+
+def crear_cliente_async(api_key, base_url=None):
+    """AsyncGroq con su propio pool; admite tantas conexiones como cupos del semáforo."""
+    http_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(GROQ_TIMEOUT_SECONDS, connect=GROQ_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=GROQ_MAX_CONCURRENCIA,
+            max_keepalive_connections=GROQ_MAX_KEEPALIVE,
+            keepalive_expiry=GROQ_KEEPALIVE_EXPIRY,
+        ),
+    )
+    return AsyncGroq(api_key=api_key, base_url=base_url, timeout=GROQ_TIMEOUT_SECONDS,
+                     max_retries=GROQ_MAX_RETRIES, http_client=http_client)
+
+
+def cliente_compartido_async(api_key, base_url=None):
+    """AsyncGroq del event loop actual para `api_key`, creado una sola vez."""
+    clientes = _estado_loop()['clientes']
+    clave = (api_key, base_url)
+    if clave not in clientes:
+        clientes[clave] = crear_cliente_async(api_key, base_url)
+    return clientes[clave]
+
+
+# Pool de hilos para decodificar y re-encodar imágenes desde las vistas
+# async: Pillow libera el GIL en esas operaciones, así que no frenan el event
+# loop ni ocupan los hilos de `sync_to_async` (que atienden el ORM). Como los
+# hilos no sobreviven a un fork, el hijo crea su propio pool.
+_pool_imagenes = None
+_pool_imagenes_lock = threading.Lock()
+
+
+def _reiniciar_pool_imagenes():
+    global _pool_imagenes, _pool_imagenes_lock
+    _pool_imagenes, _pool_imagenes_lock = None, threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reiniciar_pool_imagenes)
+
+
+async def en_hilo_imagenes(funcion, *args):
+    """Ejecuta `funcion(*args)` (trabajo de Pillow) en el pool de imágenes y espera el resultado."""
+    global _pool_imagenes
+    if _pool_imagenes is None:
+        with _pool_imagenes_lock:
+            if _pool_imagenes is None:
+                _pool_imagenes = ThreadPoolExecutor(GROQ_IMAGEN_HILOS, thread_name_prefix='groq-imagen')
+    return await asyncio.get_running_loop().run_in_executor(_pool_imagenes, funcion, *args)
+
+
+@asynccontextmanager
+async def cupo_groq():
+    """Reserva uno de los GROQ_MAX_CONCURRENCIA cupos de llamada del proceso."""
+    semaforo = _estado_loop()['semaforo']
+    try:
+        await asyncio.wait_for(semaforo.acquire(), GROQ_ESPERA_CONCURRENCIA)
+    except asyncio.TimeoutError:
+        raise GroqOcupado(
+            f"demasiadas consultas simultáneas (máx. {GROQ_MAX_CONCURRENCIA}); reintenta en unos segundos"
+        ) from None
     try:
-        return Groq(api_key=api_key, timeout=GROQ_TIMEOUT_SECONDS, max_retries=GROQ_MAX_RETRIES)
-    except TypeError:
-        return Groq(api_key=api_key, timeout=GROQ_TIMEOUT_SECONDS)
+        yield
+    finally:
+        semaforo.release()
+
+
+SYSTEM_PROMPT_CHAT = """Eres un asistente IA especializado en inventario y ventas.
+Reglas estrictas:
+- Responde SIEMPRE en español, de forma breve y directa.
+- Si se proporciona un catálogo en el contexto, RESPONDE EXCLUSIVAMENTE usando esos datos.
+- Si el producto consultado NO está en el catálogo, di literalmente: "En este momento no tenemos ese producto".
+- Para precios, usa el campo exacto "precio" del catálogo sin estimaciones.
+- No inventes marcas, precios, variantes ni stock.
+"""
+
+
+def _error_config_chat(e):
+    return (
+        "Error: Groq API key no configurada para chat. "
+        "Define GROQ_API_KEY_CHAT (o GROQ_API_KEY) en Railway. "
+        f"Detalle: {str(e)}"
+    )
+
+
+def _mensajes_chat(user_message, context=None, history=None):
+    """Prompt de sistema (con contexto si se proporciona) + historial + mensaje nuevo."""
+    system_prompt = SYSTEM_PROMPT_CHAT
+    if context:
+        system_prompt += f"\n\nContexto actual del negocio:\n{context}"
+    messages = history or []
+    messages.append({"role": "user", "content": user_message})
+    return [{"role": "system", "content": system_prompt}] + messages
+
+
+def _error_chat(e, attempt):
+    """Registra un fallo de la llamada de chat.
+
+    Retorna (reintentar, mensaje): se reintenta una vez ante errores de
+    conexión; si no, `mensaje` es el error para el usuario.
+    """
+    msg = str(e) or e.__class__.__name__
+    # Log para diagnóstico en Railway (sin exponer secretos)
+    logger.warning("Groq chat error: %s: %s", e.__class__.__name__, msg)
+    cause = getattr(e, "__cause__", None) or getattr(e, "__context__", None)
+    if cause is not None:
+        logger.warning(
+            "Groq chat root-cause: %s: %s",
+            cause.__class__.__name__,
+            str(cause) or repr(cause),
+        )
+    is_connection_like = (
+        "connection" in msg.lower()
+        or "connect" in msg.lower()
+        or "dns" in msg.lower()
+        or e.__class__.__name__.lower() in {"apiconnectionerror", "connecterror"}
+    )
+    if is_connection_like and attempt == 0:
+        return True, None
+    is_timeout_like = (
+        "timeout" in msg.lower()
+        or e.__class__.__name__.lower() in {"timeoutexception", "readtimeout", "connecttimeout"}
+    )
+    if is_timeout_like:
+        # Incluir traceback para ver si fue connect/read timeout, TLS, etc.
+        logger.exception("Groq chat timeout (attempt %s)", attempt + 1)
+        return False, (
+            "Error al consultar Groq (chat): timeout. "
+            "Prueba subir GROQ_TIMEOUT_SECONDS (por ejemplo 25) en Railway y reintenta. "
+            f"Detalle: {msg}"
+        )
+    if is_connection_like:
+        # Traceback ayuda a diferenciar DNS, SSL, refused, etc.
+        logger.exception("Groq chat connection error (attempt %s)", attempt + 1)
+        return False, (
+            "Error al consultar Groq (chat): no se pudo conectar con Groq. "
+            "Suele ser un problema temporal de red/egress/DNS en Railway (o timeout bajo). "
+            "Prueba subir GROQ_TIMEOUT_SECONDS (por ejemplo 25) y reintenta. "
+            "Reintenta o revisa los logs del servicio. "
+            f"Detalle: {msg}"
+        )
+    return False, f"Error al consultar Groq (chat): {msg}"
 
 
 def chat_with_groq(user_message, context=None, history=None):
@@ -64,84 +298,62 @@ def chat_with_groq(user_message, context=None, history=None):
     try:
         client = get_groq_client_chat()
     except Exception as e:
-        return (
-            "Error: Groq API key no configurada para chat. "
-            "Define GROQ_API_KEY_CHAT (o GROQ_API_KEY) en Railway. "
-            f"Detalle: {str(e)}"
-        )
-    
-    # Construir el prompt con contexto si se proporciona
-    system_prompt = """Eres un asistente IA especializado en inventario y ventas.
-Reglas estrictas:
-- Responde SIEMPRE en español, de forma breve y directa.
-- Si se proporciona un catálogo en el contexto, RESPONDE EXCLUSIVAMENTE usando esos datos.
-- Si el producto consultado NO está en el catálogo, di literalmente: "En este momento no tenemos ese producto".
-- Para precios, usa el campo exacto "precio" del catálogo sin estimaciones.
-- No inventes marcas, precios, variantes ni stock.
-"""
-    
-    if context:
-        system_prompt += f"\n\nContexto actual del negocio:\n{context}"
-    
-    # Preparar mensajes: historial + nuevo
-    messages = history or []
-    messages.append({"role": "user", "content": user_message})
-    
+        return _error_config_chat(e)
+
+    messages = _mensajes_chat(user_message, context, history)
     last_error = None
     # Mitigar fallos transitorios de red (Railway/egress/DNS) sin alargar demasiado.
     for attempt in range(2):
         try:
             response = client.chat.completions.create(
                 model=MODEL_CHAT,
-                messages=[{"role": "system", "content": system_prompt}] + messages,
+                messages=messages,
                 temperature=0.2,
                 max_tokens=768,
             )
             return response.choices[0].message.content
         except Exception as e:
             last_error = e
-            msg = str(e) or e.__class__.__name__
-            # Log para diagnóstico en Railway (sin exponer secretos)
-            logger.warning("Groq chat error: %s: %s", e.__class__.__name__, msg)
-            cause = getattr(e, "__cause__", None) or getattr(e, "__context__", None)
-            if cause is not None:
-                logger.warning(
-                    "Groq chat root-cause: %s: %s",
-                    cause.__class__.__name__,
-                    str(cause) or repr(cause),
-                )
-            is_connection_like = (
-                "connection" in msg.lower()
-                or "connect" in msg.lower()
-                or "dns" in msg.lower()
-                or e.__class__.__name__.lower() in {"apiconnectionerror", "connecterror"}
-            )
-            if is_connection_like and attempt == 0:
+            reintentar, error = _error_chat(e, attempt)
+            if reintentar:
                 time.sleep(0.4)
                 continue
-            is_timeout_like = (
-                "timeout" in msg.lower()
-                or e.__class__.__name__.lower() in {"timeoutexception", "readtimeout", "connecttimeout"}
-            )
-            if is_timeout_like:
-                # Incluir traceback para ver si fue connect/read timeout, TLS, etc.
-                logger.exception("Groq chat timeout (attempt %s)", attempt + 1)
-                return (
-                    "Error al consultar Groq (chat): timeout. "
-                    "Prueba subir GROQ_TIMEOUT_SECONDS (por ejemplo 25) en Railway y reintenta. "
-                    f"Detalle: {msg}"
-                )
-            if is_connection_like:
-                # Traceback ayuda a diferenciar DNS, SSL, refused, etc.
-                logger.exception("Groq chat connection error (attempt %s)", attempt + 1)
-                return (
-                    "Error al consultar Groq (chat): no se pudo conectar con Groq. "
-                    "Suele ser un problema temporal de red/egress/DNS en Railway (o timeout bajo). "
-                    "Prueba subir GROQ_TIMEOUT_SECONDS (por ejemplo 25) y reintenta. "
-                    "Reintenta o revisa los logs del servicio. "
-                    f"Detalle: {msg}"
+            return error
+
+    return f"Error al consultar Groq (chat): {str(last_error) if last_error else 'Error desconocido'}"
+
+
+async def chat_with_groq_async(user_message, context=None, history=None):
+    """Versión asíncrona de `chat_with_groq` (mismo prompt, reintentos y errores).
+
+    La llamada ocupa un cupo de `cupo_groq` y no bloquea ningún hilo.
+    """
+    try:
+        client = cliente_compartido_async(GROQ_API_KEY_CHAT or _env_str('GROQ_API_KEY'))
+    except Exception as e:
+        return _error_config_chat(e)
+
+    messages = _mensajes_chat(user_message, context, history)
+    last_error = None
+    for attempt in range(2):
+        try:
+            async with cupo_groq():
+                response = await client.chat.completions.create(
+                    model=MODEL_CHAT,
+                    messages=messages,
+                    temperature=0.2,
+                    max_tokens=768,
                 )
-            return f"Error al consultar Groq (chat): {msg}"
+            return response.choices[0].message.content
+        except GroqOcupado as e:
+            return f"Error al consultar Groq (chat): {e}"
+        except Exception as e:
+            last_error = e
+            reintentar, error = _error_chat(e, attempt)
+            if reintentar:
+                await asyncio.sleep(0.4)
+                continue
+            return error
 
     return f"Error al consultar Groq (chat): {str(last_error) if last_error else 'Error desconocido'}"
 
@@ -170,7 +382,11 @@ def analyze_image_with_groq(image_bytes, prompt=None):
             }
         )
     
-    # Convertir a base64
+    # Convertir a base64 (si Pillow no la lee, se envía el original como antes)
+    try:
+        image_bytes, mime = preprocesar_imagen(image_bytes)
+    except Exception:
+        mime = 'image/jpeg'
     image_b64 = base64.standard_b64encode(image_bytes).decode('utf-8')
     
     default_prompt = prompt or """Analiza esta imagen y extrae la siguiente información si está disponible:
@@ -185,7 +401,7 @@ Responde en formato JSON con las claves: nombre, codigo, precio, cantidad, marca
     
     try:
         # Formato correcto para Groq Vision API
-        image_url = f"data:image/jpeg;base64,{image_b64}"
+        image_url = f"data:{mime};base64,{image_b64}"
         
         response = client.chat.completions.create(
             model=MODEL_VISION,
@@ -234,17 +450,16 @@ def generate_stock_suggestions(productos_info):
             f"Detalle: {str(e)}"
         )
     
-    prompt = f"""Basándote en los siguientes datos de inventario y ventas, sugiere qué productos deberían reordenarse:
+    prompt = f"""Estos productos están en o bajo su punto de reorden. Los números ya fueron calculados (pronóstico diario de demanda, stock de seguridad, punto de reorden y cantidad a pedir); no los modifiques:
 
 {json.dumps(productos_info, indent=2, ensure_ascii=False)}
 
-Considera:
-- Stock actual vs. demanda
-- Velocidad de venta
-- Margen de seguridad recomendado (20-30% sobre demanda promedio)
-- Productos sin movimiento reciente
+Explica brevemente:
+- Qué productos reponer primero y por qué (días de cobertura, fecha de quiebre)
+- La cantidad a pedir de cada uno (usa `cantidad_reorden`)
+- Si la demanda es intermitente (método croston) o regular (ses)
 
-Responde con una lista priorizada de productos a reabastecer, incluyendo cantidad sugerida."""
+Responde con una lista priorizada de productos a reabastecer."""
     
     try:
         response = client.chat.completions.create(
@@ -280,13 +495,13 @@ def analyze_sales_trends(ventas_info):
     
     prompt = f"""Analiza las siguientes tendencias de ventas y proporciona insights:
 
-{json.dumps(ventas_info, indent=2, ensure_ascii=False)}
+{json.dumps(ventas_info, indent=2, ensure_ascii=False, default=str)}
 
 Identifica:
 1. Productos con mayor crecimiento/decrecimiento
 2. Patrones estacionales o semanales
-3. Clientes más activos
-4. Oportunidades de venta cruzada
+3. Clientes más activos (segmentos RFM y top_clientes)
+4. Oportunidades de venta cruzada (pares de ventas_cruzadas: confianza y lift)
 5. Recomendaciones estratégicas
 
 Sé conciso pero informativo."""
@@ -303,77 +518,7 @@ Sé conciso pero informativo."""
         return f"Error al analizar tendencias (chat): {str(e)}"
 
 
-def analyze_product_image_v2(image_bytes, max_retries=2):
-    """
-    Analiza una imagen de producto con Groq Vision (Llama 4 Maverick).
-    Versión mejorada con validaciones, reintentos y fallbacks.
-    
-    Args:
-        image_bytes: Bytes de la imagen.
-        max_retries: Número máximo de reintentos si falla.
-    
-    Returns:
-        dict: Siempre retorna un diccionario con los campos:
-            - producto (str): Nombre del producto
-            - precio_estimado (float): Precio estimado
-            - categoria (str): Categoría del producto
-            - descripcion (str): Descripción
-            - error (str, opcional): Si hay error, se incluye aquí
-    """
-    import logging
-    logger = logging.getLogger(__name__)
-    
-    # Validaciones iniciales
-    if not image_bytes or len(image_bytes) == 0:
-        logger.warning("Imagen vacía recibida")
-        return {
-            "producto": "",
-            "precio_estimado": 0.0,
-            "categoria": "",
-            "descripcion": "Imagen vacía o corrupta",
-            "error": "La imagen está vacía"
-        }
-    
-    # Limitar tamaño máximo (10MB)
-    if len(image_bytes) > 10 * 1024 * 1024:
-        logger.warning(f"Imagen demasiado grande: {len(image_bytes)} bytes")
-        return {
-            "producto": "",
-            "precio_estimado": 0.0,
-            "categoria": "",
-            "descripcion": "Archivo de imagen muy grande",
-            "error": "La imagen excede el tamaño máximo (10MB)"
-        }
-    
-    try:
-        client = get_groq_client_vision()
-    except Exception as e:
-        logger.error(f"Groq Vision no configurado: {str(e)}")
-        return {
-            "producto": "",
-            "precio_estimado": 0.0,
-            "categoria": "",
-            "descripcion": "No se pudo analizar (API key faltante)",
-            "error": (
-                "Groq API key no configurada para visión. "
-                "Define GROQ_API_KEY_VISION (o GROQ_API_KEY) en Railway."
-            ),
-        }
-    
-    # Convertir a base64
-    try:
-        image_b64 = base64.standard_b64encode(image_bytes).decode('utf-8')
-    except Exception as e:
-        logger.error(f"Error al codificar imagen a base64: {str(e)}")
-        return {
-            "producto": "",
-            "precio_estimado": 0.0,
-            "categoria": "",
-            "descripcion": "Error al procesar la imagen",
-            "error": "La imagen está corrupta"
-        }
-    
-    prompt = """Analiza esta imagen y responde SOLO con JSON válido.
+PROMPT_PRODUCTO_V2 = """Analiza esta imagen y responde SOLO con JSON válido.
 
 Identifica:
 1. Producto: nombre, marca, modelo
@@ -400,125 +545,272 @@ REGLAS:
 - categoria SIEMPRE debe tener valor de la lista
 - precio_estimado = 0 si no es visible
 - SOLO JSON, sin texto extra"""
+
+
+MIME_IMAGEN = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'WEBP': 'image/webp', 'GIF': 'image/gif'}
+
+
+def preprocesar_imagen(image_bytes):
+    """Imagen lista para Groq Vision: retorna (bytes, mime).
+
+    Aplica la orientación EXIF, reduce el lado mayor a GROQ_IMAGEN_LADO_MAX y
+    re-encoda en GROQ_IMAGEN_FORMATO con GROQ_IMAGEN_CALIDAD, sin metadatos
+    (la transparencia queda sobre fondo blanco). Si el original no necesitaba
+    rotarse ni reducirse y pesa menos que el re-encodado, se envía tal cual
+    con su MIME real. Levanta si Pillow no puede leer la imagen.
+    """
+    with Image.open(BytesIO(image_bytes)) as original:
+        formato = original.format
+        if not GROQ_IMAGEN_LADO_MAX:
+            return image_bytes, MIME_IMAGEN.get(formato, 'image/jpeg')
+        orientacion = original.getexif().get(0x0112, 1)
+        reducir = max(original.size) > GROQ_IMAGEN_LADO_MAX
+        # JPEG: decodifica directo a una escala reducida (mucho más rápido en fotos grandes)
+        original.draft('RGB', (GROQ_IMAGEN_LADO_MAX, GROQ_IMAGEN_LADO_MAX))
+        imagen = ImageOps.exif_transpose(original)
+        if reducir:
+            imagen.thumbnail((GROQ_IMAGEN_LADO_MAX, GROQ_IMAGEN_LADO_MAX), Image.Resampling.LANCZOS)
+        if imagen.mode != 'RGB':
+            rgba = imagen.convert('RGBA')
+            imagen = Image.new('RGB', rgba.size, 'white')
+            imagen.paste(rgba, mask=rgba.getchannel('A'))
+
+    destino = 'WEBP' if GROQ_IMAGEN_FORMATO == 'WEBP' else 'JPEG'
+    salida = BytesIO()
+    if destino == 'WEBP':
+        imagen.save(salida, 'WEBP', quality=GROQ_IMAGEN_CALIDAD, method=4)
+    else:
+        imagen.save(salida, 'JPEG', quality=GROQ_IMAGEN_CALIDAD, optimize=True)
+    if (not reducir and orientacion == 1 and formato in MIME_IMAGEN
+            and len(image_bytes) <= salida.tell()):
+        return image_bytes, MIME_IMAGEN[formato]
+    return salida.getvalue(), MIME_IMAGEN[destino]
+
+
+def _analisis_vacio(descripcion, error):
+    return {
+        "producto": "",
+        "precio_estimado": 0.0,
+        "categoria": "",
+        "descripcion": descripcion,
+        "error": error,
+    }
+
+
+def _preparar_imagen_v2(image_bytes):
+    """Valida y preprocesa la imagen (`preprocesar_imagen`) y arma los mensajes para Groq Vision.
+
+    Retorna (mensajes, None) o (None, análisis de error).
+    """
+    # Validaciones iniciales
+    if not image_bytes or len(image_bytes) == 0:
+        logger.warning("Imagen vacía recibida")
+        return None, _analisis_vacio("Imagen vacía o corrupta", "La imagen está vacía")
+
+    # Limitar tamaño máximo (10MB)
+    if len(image_bytes) > 10 * 1024 * 1024:
+        logger.warning(f"Imagen demasiado grande: {len(image_bytes)} bytes")
+        return None, _analisis_vacio("Archivo de imagen muy grande", "La imagen excede el tamaño máximo (10MB)")
+
+    # Orientar, reducir y re-encodar antes de convertir a base64
+    try:
+        enviada, mime = preprocesar_imagen(image_bytes)
+        image_b64 = base64.standard_b64encode(enviada).decode('utf-8')
+    except Exception as e:
+        logger.error(f"Error al preparar la imagen: {str(e)}")
+        return None, _analisis_vacio("Error al procesar la imagen", "La imagen está corrupta")
+    logger.info(f"Imagen para Groq: {len(image_bytes)} -> {len(enviada)} bytes ({mime})")
+
+    # Formato correcto para Groq Vision API
+    image_url = f"data:{mime};base64,{image_b64}"
+    mensajes = [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": PROMPT_PRODUCTO_V2
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": image_url
+                    }
+                }
+            ]
+        }
+    ]
+    return mensajes, None
+
+
+def _error_config_vision(e):
+    logger.error(f"Groq Vision no configurado: {str(e)}")
+    return _analisis_vacio(
+        "No se pudo analizar (API key faltante)",
+        "Groq API key no configurada para visión. "
+        "Define GROQ_API_KEY_VISION (o GROQ_API_KEY) en Railway.",
+    )
+
+
+def _resultado_imagen_v2(response_text):
+    """Convierte la respuesta de Groq en el dict del análisis. Levanta si no es utilizable."""
+    logger.info(f"Respuesta de Groq: {response_text}")
+
+    # Intentar parsear JSON
+    try:
+        analysis_data = json.loads(response_text)
+    except json.JSONDecodeError:
+        # Si no es JSON válido, intentar extraer JSON de la respuesta
+        logger.warning("Respuesta no es JSON válido, intentando extraer...")
+        try:
+            # Buscar JSON entre { }
+            start_idx = response_text.find('{')
+            end_idx = response_text.rfind('}') + 1
+            if start_idx >= 0 and end_idx > start_idx:
+                json_str = response_text[start_idx:end_idx]
+                analysis_data = json.loads(json_str)
+            else:
+                raise ValueError("No se encontró JSON en la respuesta")
+        except Exception as json_error:
+            logger.error(f"No se pudo extraer JSON: {str(json_error)}")
+            analysis_data = None
+
+    if not analysis_data:
+        raise ValueError("Análisis devolvió datos vacíos")
+
+    # Validar y limpiar datos con conversión segura
+    try:
+        # Extraer y limpiar nombre del producto
+        producto = str(analysis_data.get("producto", "")).strip()
+        if not producto or producto.lower() in ["", "null", "undefined"]:
+            producto = "Producto desconocido"
+
+        # Extraer y convertir precio
+        precio_raw = analysis_data.get("precio_estimado", 0)
+        try:
+            if isinstance(precio_raw, str):
+                # Si es string, extraer números
+                numeros = re.findall(r'\d+\.?\d*', precio_raw)
+                precio_estimado = float(numeros[0]) if numeros else 0.0
+            else:
+                precio_estimado = float(precio_raw) if precio_raw else 0.0
+        except (ValueError, TypeError):
+            precio_estimado = 0.0
+
+        # Extraer categoría
+        categoria = str(analysis_data.get("categoria", "")).strip()
+        if not categoria or categoria.lower() in ["", "null", "undefined", "sin categoría"]:
+            categoria = "Sin categoría"
+
+        # Extraer descripción
+        descripcion = str(analysis_data.get("descripcion", "")).strip()
+        if not descripcion or descripcion.lower() in ["", "null", "undefined"]:
+            descripcion = f"Imagen de {producto}"
+
+        resultado = {
+            "producto": producto,
+            "precio_estimado": precio_estimado,
+            "categoria": categoria,
+            "descripcion": descripcion
+        }
+
+        logger.info(f"✅ Análisis exitoso: {resultado}")
+        return resultado
+
+    except Exception as conversion_error:
+        logger.error(f"❌ Error al procesar datos: {str(conversion_error)}")
+        logger.error(f"Datos crudos: {analysis_data}")
+        raise
+
+
+def _fallo_imagen_v2(max_retries, last_error):
+    # Fallback: devolver estructura válida sin datos
+    logger.error(f"Análisis falló después de {max_retries + 1} intentos. Último error: {last_error}")
+    return _analisis_vacio(
+        "No se pudo reconocer el producto",
+        f"Error en IA después de {max_retries + 1} intentos: {last_error}",
+    )
+
+
+def analyze_product_image_v2(image_bytes, max_retries=2):
+    """
+    Analiza una imagen de producto con Groq Vision (Llama 4 Maverick).
+    Versión mejorada con validaciones, reintentos y fallbacks.
     
-    retry_count = 0
-    last_error = None
+    Args:
+        image_bytes: Bytes de la imagen.
+        max_retries: Número máximo de reintentos si falla.
     
-    while retry_count <= max_retries:
+    Returns:
+        dict: Siempre retorna un diccionario con los campos:
+            - producto (str): Nombre del producto
+            - precio_estimado (float): Precio estimado
+            - categoria (str): Categoría del producto
+            - descripcion (str): Descripción
+            - error (str, opcional): Si hay error, se incluye aquí
+    """
+    mensajes, error = _preparar_imagen_v2(image_bytes)
+    if error:
+        return error
+    try:
+        client = get_groq_client_vision()
+    except Exception as e:
+        return _error_config_vision(e)
+
+    last_error = None
+    for intento in range(max_retries + 1):
         try:
-            logger.info(f"Intento {retry_count + 1} de análisis de imagen")
-            
-            # Formato correcto para Groq Vision API
-            image_url = f"data:image/jpeg;base64,{image_b64}"
-            
+            logger.info(f"Intento {intento + 1} de análisis de imagen")
             response = client.chat.completions.create(
                 model=MODEL_VISION,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": prompt
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": image_url
-                                }
-                            }
-                        ]
-                    }
-                ],
+                messages=mensajes,
                 temperature=0.3,
                 max_tokens=512,
             )
-            
-            response_text = response.choices[0].message.content.strip()
-            logger.info(f"Respuesta de Groq: {response_text}")
-            
-            # Intentar parsear JSON
-            try:
-                analysis_data = json.loads(response_text)
-            except json.JSONDecodeError:
-                # Si no es JSON válido, intentar extraer JSON de la respuesta
-                logger.warning("Respuesta no es JSON válido, intentando extraer...")
-                try:
-                    # Buscar JSON entre { }
-                    start_idx = response_text.find('{')
-                    end_idx = response_text.rfind('}') + 1
-                    if start_idx >= 0 and end_idx > start_idx:
-                        json_str = response_text[start_idx:end_idx]
-                        analysis_data = json.loads(json_str)
-                    else:
-                        raise ValueError("No se encontró JSON en la respuesta")
-                except Exception as json_error:
-                    logger.error(f"No se pudo extraer JSON: {str(json_error)}")
-                    analysis_data = None
-            
-            if analysis_data:
-                # Validar y limpiar datos con conversión segura
-                try:
-                    # Extraer y limpiar nombre del producto
-                    producto = str(analysis_data.get("producto", "")).strip()
-                    if not producto or producto.lower() in ["", "null", "undefined"]:
-                        producto = "Producto desconocido"
-                    
-                    # Extraer y convertir precio
-                    precio_raw = analysis_data.get("precio_estimado", 0)
-                    try:
-                        if isinstance(precio_raw, str):
-                            # Si es string, extraer números
-                            import re
-                            numeros = re.findall(r'\d+\.?\d*', precio_raw)
-                            precio_estimado = float(numeros[0]) if numeros else 0.0
-                        else:
-                            precio_estimado = float(precio_raw) if precio_raw else 0.0
-                    except (ValueError, TypeError):
-                        precio_estimado = 0.0
-                    
-                    # Extraer categoría
-                    categoria = str(analysis_data.get("categoria", "")).strip()
-                    if not categoria or categoria.lower() in ["", "null", "undefined", "sin categoría"]:
-                        categoria = "Sin categoría"
-                    
-                    # Extraer descripción
-                    descripcion = str(analysis_data.get("descripcion", "")).strip()
-                    if not descripcion or descripcion.lower() in ["", "null", "undefined"]:
-                        descripcion = f"Imagen de {producto}"
-                    
-                    resultado = {
-                        "producto": producto,
-                        "precio_estimado": precio_estimado,
-                        "categoria": categoria,
-                        "descripcion": descripcion
-                    }
-                    
-                    logger.info(f"✅ Análisis exitoso: {resultado}")
-                    return resultado
-                    
-                except Exception as conversion_error:
-                    logger.error(f"❌ Error al procesar datos: {str(conversion_error)}")
-                    logger.error(f"Datos crudos: {analysis_data}")
-                    raise
-            else:
-                raise ValueError("Análisis devolvió datos vacíos")
-        
+            return _resultado_imagen_v2(response.choices[0].message.content.strip())
         except Exception as e:
             last_error = str(e)
-            logger.warning(f"❌ Intento {retry_count + 1} falló: {last_error}")
-            retry_count += 1
-            
-            if retry_count <= max_retries:
-                logger.info(f"🔄 Reintentando análisis (intento {retry_count + 1}/{max_retries + 1})...")
-                continue
-    
-    # Fallback: devolver estructura válida sin datos
-    logger.error(f"Análisis falló después de {max_retries + 1} intentos. Último error: {last_error}")
-    return {
-        "producto": "",
-        "precio_estimado": 0.0,
-        "categoria": "",
-        "descripcion": "No se pudo reconocer el producto",
-        "error": f"Error en IA después de {max_retries + 1} intentos: {last_error}"
-    }
+            logger.warning(f"❌ Intento {intento + 1} falló: {last_error}")
+            if intento < max_retries:
+                logger.info(f"🔄 Reintentando análisis (intento {intento + 2}/{max_retries + 1})...")
+
+    return _fallo_imagen_v2(max_retries, last_error)
+
+
+async def analyze_product_image_v2_async(image_bytes, max_retries=2):
+    """Versión asíncrona de `analyze_product_image_v2` (mismo prompt, reintentos y fallbacks).
+
+    Cada intento ocupa un cupo de `cupo_groq`; si no hay cupo dentro de la
+    espera no se reintenta. El preprocesamiento de la imagen corre en el
+    pool de `en_hilo_imagenes`.
+    """
+    mensajes, error = await en_hilo_imagenes(_preparar_imagen_v2, image_bytes)
+    if error:
+        return error
+    try:
+        client = cliente_compartido_async(GROQ_API_KEY_VISION or _env_str('GROQ_API_KEY'))
+    except Exception as e:
+        return _error_config_vision(e)
+
+    last_error = None
+    for intento in range(max_retries + 1):
+        try:
+            logger.info(f"Intento {intento + 1} de análisis de imagen")
+            async with cupo_groq():
+                response = await client.chat.completions.create(
+                    model=MODEL_VISION,
+                    messages=mensajes,
+                    temperature=0.3,
+                    max_tokens=512,
+                )
+            return _resultado_imagen_v2(response.choices[0].message.content.strip())
+        except GroqOcupado as e:
+            last_error = str(e)
+            break
+        except Exception as e:
+            last_error = str(e)
+            logger.warning(f"❌ Intento {intento + 1} falló: {last_error}")
+            if intento < max_retries:
+                logger.info(f"🔄 Reintentando análisis (intento {intento + 2}/{max_retries + 1})...")
+
+    return _fallo_imagen_v2(max_retries, last_error)
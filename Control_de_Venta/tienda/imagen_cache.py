@@ -0,0 +1,116 @@
+"""
+Caché de análisis de imágenes por contenido.
+
+El personal fotografía los mismos envases una y otra vez, y cada subida
+(`ImageAnalysisViewSet.create`, `create_producto_from_image` o
+POST /api/ai/imagen/) costaba una llamada a Groq Vision de varios segundos.
+Los análisis exitosos se guardan en `HuellaImagen` (sin el archivo ni el
+usuario: solo las huellas y `analysis_result`, fuera del historial de
+`ImageAnalysis`), así el caché sobrevive reinicios y se comparte entre
+workers:
+
+- `sha256`: hash de los píxeles normalizados (orientación EXIF aplicada,
+  RGB), no de los bytes del archivo; la misma foto re-encodada o con otros
+  metadatos es un acierto exacto.
+- `phash`: dHash de 64 bits (hex). Si no hay acierto exacto se busca la
+  huella más cercana entre los últimos `VENTANA_SIMILARES` análisis; con
+  distancia de Hamming <= `IMAGE_DEDUP_DISTANCE` se reutiliza su resultado:
+  otra foto del mismo envase, recortada o con otra luz. Viene en 0
+  (desactivado): variantes del mismo envase (otro sabor, otro tamaño)
+  quedan a pocos bits de distancia y se confundirían. Crear un producto
+  desde la foto (`create_producto_from_image`) acepta solo aciertos
+  exactos aunque el umbral esté activo.
+
+Los resultados con `error` no se guardan, para reintentar en la próxima
+subida.
+"""
+import hashlib
+import io
+import logging
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+from .models import HuellaImagen
+
+logger = logging.getLogger(__name__)
+
+VENTANA_SIMILARES = 5000
+EXACTO = 'exacto'
+SIMILAR = 'similar'
+
+
+def _dhash(imagen) -> str:
+    """Hash de diferencias: 8x9 en grises, un bit por par de píxeles vecinos."""
+    chica = imagen.convert('L').resize((9, 8), Image.Resampling.LANCZOS)
+    pixeles = chica.tobytes()
+    bits = 0
+    for fila in range(8):
+        for col in range(8):
+            izquierda, derecha = pixeles[fila * 9 + col], pixeles[fila * 9 + col + 1]
+            bits = (bits << 1) | (izquierda > derecha)
+    return f'{bits:016x}'
+
+
+def huellas(image_bytes: bytes):
+    """(sha256, phash) de la imagen. Si Pillow no la decodifica: sha256 de los bytes y phash ''."""
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as original:
+            imagen = ImageOps.exif_transpose(original).convert('RGB')
+    except Exception as e:
+        logger.warning(f"No se pudo decodificar la imagen para el caché: {e}")
+        return hashlib.sha256(image_bytes).hexdigest(), ''
+    contenido = hashlib.sha256(f'{imagen.width}x{imagen.height}:'.encode())
+    contenido.update(imagen.tobytes())
+    return contenido.hexdigest(), _dhash(imagen)
+
+
+def distancia(phash_a: str, phash_b: str) -> int:
+    """Distancia de Hamming entre dos dHash en hex."""
+    return (int(phash_a, 16) ^ int(phash_b, 16)).bit_count()
+
+
+def _similar(phash: str):
+    """Análisis más cercano a `phash` dentro del umbral, o None."""
+    umbral = getattr(settings, 'IMAGE_DEDUP_DISTANCE', 0)
+    if not phash or umbral <= 0:
+        return None
+    candidatos = (
+        HuellaImagen.objects.exclude(phash='').order_by('-id')
+        .values_list('id', 'phash')[:VENTANA_SIMILARES]
+    )
+    mejor = min(((distancia(phash, otro), pk) for pk, otro in candidatos), default=None)
+    if mejor is None or mejor[0] > umbral:
+        return None
+    return HuellaImagen.objects.only('analysis_result').get(pk=mejor[1])
+
+
+def buscar(image_bytes: bytes, similares: bool = True):
+    """Retorna (huellas, análisis, coincidencia).
+
+    `análisis` es None si no hay uno guardado; `coincidencia` es `EXACTO`,
+    `SIMILAR` o None. Con `similares=False` solo cuentan los aciertos exactos.
+    """
+    return buscar_huellas(huellas(image_bytes), similares=similares)
+
+
+def buscar_huellas(huellas_imagen, similares: bool = True):
+    """Como `buscar`, con las huellas ya calculadas (p. ej. en el pool de imágenes de Groq)."""
+    sha256, phash = huellas_imagen
+    encontrado = (
+        HuellaImagen.objects.filter(sha256=sha256).only('analysis_result').order_by('-id').first()
+    )
+    if encontrado:
+        return (sha256, phash), encontrado.analysis_result, EXACTO
+    encontrado = _similar(phash) if similares else None
+    if encontrado:
+        return (sha256, phash), encontrado.analysis_result, SIMILAR
+    return (sha256, phash), None, None
+
+
+def guardar(huellas_imagen, analisis: dict):
+    """Registra un análisis exitoso bajo sus huellas. Retorna la `HuellaImagen` o None."""
+    if not analisis or analisis.get('error'):
+        return None
+    sha256, phash = huellas_imagen
+    return HuellaImagen.objects.create(sha256=sha256, phash=phash, analysis_result=analisis)
@@ -0,0 +1,239 @@
+"""
+Ranking incremental de productos por unidades e ingresos.
+
+Periodos: día, semana (ISO), mes y total histórico, siempre los vigentes
+según la fecha local. Cada venta confirmada suma sus líneas a los rankings
+de los periodos que contienen su fecha (`acumular`, llamado al confirmar
+`rollups.resumir_pendientes`), así que leer el top-N no recorre ventas ni
+líneas.
+
+Igual que las reservas, el estado vive en un backend intercambiable: en
+memoria del proceso (diccionarios producto -> puntaje por periodo; un
+worker) o sorted sets de Redis cuando `REDIS_URL` está definido
+(`ZINCRBY` al escribir, `ZREVRANGE 0 N-1` al leer: O(log M + N)).
+
+El estado se carga desde `ProductoDiario` la primera vez que se usa (o tras
+`reiniciar`, que llama `rollups.reconstruir` cuando se editan ventas
+pasadas); si falla Redis se registra el error y se recarga en el siguiente
+uso, sin afectar la venta.
+"""
+import heapq
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from .models import Producto, ProductoDiario
+
+logger = logging.getLogger(__name__)
+
+PERIODOS = ('dia', 'semana', 'mes', 'total')
+METRICAS = ('unidades', 'ingresos')
+# Vida de las claves en Redis: el periodo más un margen
+TTL_PERIODO = {'dia': 2 * 86400, 'semana': 8 * 86400, 'mes': 32 * 86400, 'total': None}
+
+
+def claves_periodo(dia) -> dict:
+    """Clave de cada periodo que contiene `dia`."""
+    iso = dia.isocalendar()
+    return {
+        'dia': dia.isoformat(),
+        'semana': f'{iso.year}-W{iso.week:02d}',
+        'mes': dia.strftime('%Y-%m'),
+        'total': 'total',
+    }
+
+
+class LeaderboardEnMemoria:
+    """Backend en memoria del proceso. No se comparte entre workers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._puntajes = None   # (metrica, periodo, clave) -> {producto_id: valor}
+
+    def cargado(self):
+        return self._puntajes is not None
+
+    def cargar(self, puntajes):
+        with self._lock:
+            self._puntajes = {k: dict(v) for k, v in puntajes.items()}
+
+    def reiniciar(self):
+        with self._lock:
+            self._puntajes = None
+
+    def acumular(self, incrementos, vigentes):
+        """Suma `incrementos` ({(metrica, periodo, clave): {pid: delta}}) y descarta periodos vencidos."""
+        with self._lock:
+            if self._puntajes is None:
+                return
+            for clave in [k for k in self._puntajes if k[2] not in vigentes]:
+                del self._puntajes[clave]
+            for clave, deltas in incrementos.items():
+                puntajes = self._puntajes.setdefault(clave, {})
+                for pid, delta in deltas.items():
+                    puntajes[pid] = puntajes.get(pid, 0) + delta
+
+    def top(self, clave, n):
+        with self._lock:
+            puntajes = (self._puntajes or {}).get(clave, {})
+            return heapq.nlargest(n, puntajes.items(), key=lambda item: (item[1], -item[0]))
+
+
+class LeaderboardRedis:
+    """Backend compartido entre workers: un sorted set por métrica y periodo.
+
+    Claves: `<prefijo>:<metrica>:<periodo>` (zset producto -> puntaje) y
+    `<prefijo>:cargado` (marca de carga inicial).
+    """
+
+    def __init__(self, url, prefijo='tienda:top'):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._prefijo = prefijo
+
+    def _clave(self, clave):
+        metrica, _, periodo = clave
+        return f'{self._prefijo}:{metrica}:{periodo}'
+
+    def cargado(self):
+        return bool(self._redis.exists(f'{self._prefijo}:cargado'))
+
+    def cargar(self, puntajes):
+        pipe = self._redis.pipeline(transaction=True)
+        for clave, valores in puntajes.items():
+            pipe.delete(self._clave(clave))
+            if valores:
+                pipe.zadd(self._clave(clave), {str(pid): float(v) for pid, v in valores.items()})
+            if TTL_PERIODO[clave[1]]:
+                pipe.expire(self._clave(clave), TTL_PERIODO[clave[1]])
+        pipe.set(f'{self._prefijo}:cargado', 1)
+        pipe.execute()
+
+    def reiniciar(self):
+        self._redis.delete(f'{self._prefijo}:cargado')
+
+    def acumular(self, incrementos, vigentes):
+        # Los periodos vencidos se eliminan solos por TTL
+        pipe = self._redis.pipeline(transaction=False)
+        for clave, deltas in incrementos.items():
+            for pid, delta in deltas.items():
+                pipe.zincrby(self._clave(clave), float(delta), str(pid))
+            if TTL_PERIODO[clave[1]]:
+                pipe.expire(self._clave(clave), TTL_PERIODO[clave[1]])
+        pipe.execute()
+
+    def top(self, clave, n):
+        filas = self._redis.zrevrange(self._clave(clave), 0, n - 1, withscores=True)
+        return [(int(pid), valor) for pid, valor in filas]
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Backend configurado: Redis si hay `REDIS_URL`, si no en memoria."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                url = getattr(settings, 'REDIS_URL', None)
+                _backend = LeaderboardRedis(url) if url else LeaderboardEnMemoria()
+    return _backend
+
+
+def set_backend(backend):
+    """Reemplaza el backend (tests o un sustituto local). Retorna el anterior."""
+    global _backend
+    anterior, _backend = _backend, backend
+    return anterior
+
+
+def _vigentes(hoy):
+    return set(claves_periodo(hoy).values())
+
+
+def reconstruir() -> None:
+    """Carga los rankings vigentes desde `ProductoDiario` (una consulta agrupada)."""
+    hoy = timezone.localdate()
+    claves = claves_periodo(hoy)
+    desde = {
+        'dia': hoy,
+        'semana': hoy - timedelta(days=hoy.weekday()),
+        'mes': hoy.replace(day=1),
+    }
+    agregados = {}
+    for periodo in PERIODOS:
+        filtro = Q(fecha__gte=desde[periodo], fecha__lte=hoy) if periodo != 'total' else None
+        agregados[f'u_{periodo}'] = Sum('unidades', filter=filtro)
+        agregados[f'i_{periodo}'] = Sum('ingresos', filter=filtro)
+    puntajes = {(m, p, claves[p]): {} for m in METRICAS for p in PERIODOS}
+    for fila in ProductoDiario.objects.values('producto_id').annotate(**agregados).order_by().iterator():
+        for periodo in PERIODOS:
+            if fila[f'u_{periodo}']:
+                puntajes[('unidades', periodo, claves[periodo])][fila['producto_id']] = fila[f'u_{periodo}']
+                puntajes[('ingresos', periodo, claves[periodo])][fila['producto_id']] = float(fila[f'i_{periodo}'] or 0)
+    get_backend().cargar(puntajes)
+
+
+def reiniciar() -> None:
+    """Descarta el estado; se recarga desde los resúmenes en el próximo uso."""
+    try:
+        get_backend().reiniciar()
+    except Exception:
+        logger.exception('No se pudo reiniciar el ranking de productos')
+
+
+def acumular(por_producto) -> None:
+    """Suma ventas confirmadas: `por_producto` = {(dia, producto_id): (unidades, ingresos, ...)}.
+
+    Solo se actualizan los periodos vigentes (una venta sincronizada con
+    fecha antigua cuenta en el total y no en el día de hoy).
+    """
+    try:
+        backend = get_backend()
+        if not backend.cargado():
+            # Los resúmenes ya incluyen estas ventas: cargarlos basta
+            reconstruir()
+            return
+        vigentes = _vigentes(timezone.localdate())
+        incrementos = {}
+        for (dia, pid), (unidades, ingresos, *_) in por_producto.items():
+            for periodo, clave in claves_periodo(dia).items():
+                if clave not in vigentes:
+                    continue
+                u = incrementos.setdefault(('unidades', periodo, clave), {})
+                u[pid] = u.get(pid, 0) + unidades
+                i = incrementos.setdefault(('ingresos', periodo, clave), {})
+                i[pid] = i.get(pid, 0) + float(ingresos)
+        backend.acumular(incrementos, vigentes)
+    except Exception:
+        logger.exception('No se pudo actualizar el ranking de productos')
+        reiniciar()
+
+
+def top(periodo: str = 'dia', metrica: str = 'unidades', n: int = 10) -> list:
+    """Top-`n` productos del periodo vigente por `metrica`, con nombre y código."""
+    if periodo not in PERIODOS or metrica not in METRICAS:
+        raise ValueError(f'periodo debe ser uno de {PERIODOS} y metrica uno de {METRICAS}')
+    backend = get_backend()
+    if not backend.cargado():
+        reconstruir()
+    clave = (metrica, periodo, claves_periodo(timezone.localdate())[periodo])
+    filas = backend.top(clave, n)
+    productos = Producto.objects.in_bulk([pid for pid, _ in filas])
+    return [
+        {
+            'producto': pid,
+            'nombre': productos[pid].nombre,
+            'codigo': productos[pid].codigo,
+            metrica: round(valor, 2) if metrica == 'ingresos' else int(valor),
+        }
+        # Las líneas editadas o quitadas pueden dejar productos en cero
+        for pid, valor in filas if pid in productos and valor > 0
+    ]
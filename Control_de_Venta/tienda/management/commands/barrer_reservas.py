@@ -0,0 +1,21 @@
+"""
+Barre las reservas de stock vencidas.
+
+Las operaciones sobre reservas ya barren en lotes pequeños al pasar; este
+comando vacía el atraso completo (útil con Redis, programado cada minuto).
+    python manage.py barrer_reservas --lote 500
+"""
+from django.core.management.base import BaseCommand
+
+from ...reservas import barrer_reservas
+
+
+class Command(BaseCommand):
+    help = 'Libera las reservas de stock vencidas en lotes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=500, help='Reservas por iteración')
+
+    def handle(self, *args, **opts):
+        barridas = barrer_reservas(lote=opts['lote'])
+        self.stdout.write(self.style.SUCCESS(f"Reservas vencidas liberadas: {barridas}"))
@@ -0,0 +1,59 @@
+"""
+Benchmark del motor de pronóstico sobre un catálogo sintético.
+
+Uso:
+    python manage.py bench_forecast                       # 50.000 productos × 730 días
+    python manage.py bench_forecast --productos 5000 --dias 365
+    python manage.py bench_forecast --intermitentes 0.6   # 60% de productos con demanda esporádica
+
+Genera en memoria una matriz de ventas diarias (Poisson para los productos
+regulares, Bernoulli × Poisson para los intermitentes), corre `pronosticar`
+y `politica_reposicion` y reporta tiempos, productos por segundo y cuántos
+se clasificaron como intermitentes. No toca la base de datos.
+"""
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from ...forecast import politica_reposicion, pronosticar
+
+
+class Command(BaseCommand):
+    help = 'Mide el tiempo del pronóstico de demanda sobre datos sintéticos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--productos', type=int, default=50000)
+        parser.add_argument('--dias', type=int, default=730)
+        parser.add_argument('--intermitentes', type=float, default=0.4,
+                            help='Fracción de productos con demanda intermitente')
+        parser.add_argument('--semilla', type=int, default=42)
+
+    def handle(self, *args, **opts):
+        n, dias = opts['productos'], opts['dias']
+        rng = np.random.default_rng(opts['semilla'])
+
+        inicio = time.perf_counter()
+        tasa = rng.gamma(2.0, 2.0, size=n).astype(np.float32)
+        prob_venta = np.where(rng.random(n) < opts['intermitentes'], rng.uniform(0.05, 0.5, n), 1.0)
+        Y = rng.poisson(tasa, size=(dias, n)).astype(np.float32)
+        Y *= rng.random((dias, n), dtype=np.float32) < prob_venta
+        stock = rng.integers(0, 200, size=n).astype(np.float64)
+        t_datos = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        pronostico = pronosticar(Y)
+        t_pronostico = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        politica = politica_reposicion(pronostico['pronostico'], pronostico['sigma'], stock)
+        t_politica = time.perf_counter() - inicio
+
+        total = t_pronostico + t_politica
+        self.stdout.write(f'Matriz: {dias} días × {n} productos ({Y.nbytes / 1e6:.0f} MB) en {t_datos:.2f}s')
+        self.stdout.write(f'Pronóstico: {t_pronostico:.2f}s | Política: {t_politica:.3f}s')
+        self.stdout.write(f'Throughput: {n / total:,.0f} productos/s')
+        self.stdout.write(
+            f'Intermitentes (Croston): {int(pronostico["intermitente"].sum())} '
+            f'| En punto de reorden: {int(politica["atencion"].sum())}'
+        )
@@ -0,0 +1,96 @@
+"""
+Benchmark de latencia por llamada a Groq: cliente nuevo por llamada vs. cliente compartido.
+
+Uso:
+    python manage.py bench_groq                     # 200 llamadas contra un endpoint falso local
+    python manage.py bench_groq --llamadas 500 --hilos 8
+    SSL_CERT_FILE=cert.pem python manage.py bench_groq --url https://localhost:8443
+
+Levanta un servidor HTTP/1.1 local que responde como
+`/openai/v1/chat/completions` (sin latencia propia) y mide `N` llamadas con
+el SDK de dos formas: creando un `Groq(...)` por llamada (comportamiento
+anterior) y reutilizando `cliente_compartido`. Contra el servidor local la
+diferencia es la construcción del cliente y el handshake TCP; contra un
+endpoint HTTPS (`--url`) se suma el handshake TLS, que es lo que se ahorra en
+producción frente a api.groq.com. No usa la API real ni la base de datos.
+"""
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+from ... import groq_utils
+
+RESPUESTA = json.dumps({
+    'id': 'bench', 'object': 'chat.completion', 'created': 0, 'model': groq_utils.MODEL_CHAT,
+    'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': 'ok'}}],
+    'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2},
+}).encode()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    disable_nagle_algorithm = True  # encabezados y cuerpo van en escrituras separadas
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(RESPUESTA)))
+        self.end_headers()
+        self.wfile.write(RESPUESTA)
+
+    def log_message(self, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Compara la latencia por llamada con cliente Groq nuevo vs. compartido.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--llamadas', type=int, default=200)
+        parser.add_argument('--hilos', type=int, default=1, help='Llamadas concurrentes')
+        parser.add_argument('--url', help='Endpoint falso externo; por defecto uno local')
+
+    def handle(self, *args, **opts):
+        servidor = None
+        url = opts['url']
+        if not url:
+            servidor = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+            servidor.daemon_threads = True
+            threading.Thread(target=servidor.serve_forever, daemon=True).start()
+            url = f'http://127.0.0.1:{servidor.server_address[1]}'
+        try:
+            self._medir('Cliente por llamada', url, opts, compartido=False)
+            self._medir('Cliente compartido', url, opts, compartido=True)
+        finally:
+            if servidor:
+                servidor.shutdown()
+
+    def _medir(self, titulo, url, opts, compartido):
+        def llamada(_):
+            inicio = time.perf_counter()
+            cliente = (groq_utils.cliente_compartido('bench', url) if compartido
+                       else groq_utils.crear_cliente('bench', url))
+            cliente.chat.completions.create(
+                model=groq_utils.MODEL_CHAT, messages=[{'role': 'user', 'content': 'hola'}], max_tokens=1,
+            )
+            if not compartido:
+                cliente.close()
+            return time.perf_counter() - inicio
+
+        # Calentamiento: el primer uso del compartido crea el cliente y abre la conexión
+        llamada(0)
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(opts['hilos']) as ejecutor:
+            tiempos = sorted(ejecutor.map(llamada, range(opts['llamadas'])))
+        total = time.perf_counter() - inicio
+        p95 = tiempos[int(len(tiempos) * 0.95) - 1]
+        self.stdout.write(
+            f'{titulo}: mediana {statistics.median(tiempos) * 1000:.2f} ms | p95 {p95 * 1000:.2f} ms '
+            f'| {len(tiempos) / total:,.0f} llamadas/s'
+        )
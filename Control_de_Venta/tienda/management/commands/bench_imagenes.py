@@ -0,0 +1,132 @@
+"""
+Benchmark del preprocesamiento de imágenes antes de Groq Vision.
+
+Uso:
+    python manage.py bench_imagenes                       # fotos de 640 a 4032 px, enlace de 20 Mbps
+    python manage.py bench_imagenes --lados 1024 4032 --repeticiones 10 --mbps 5
+    GROQ_IMAGEN_FORMATO=WEBP python manage.py bench_imagenes
+
+Genera fotos sintéticas (gradiente con ruido, JPEG calidad 95 como una
+cámara de celular) de cada lado mayor y, por cada una, compara el envío del
+original (GROQ_IMAGEN_LADO_MAX=0, comportamiento anterior) con el
+preprocesado (`groq_utils.preprocesar_imagen`): bytes enviados en el
+request (base64), tiempo de preprocesamiento y latencia de punta a punta
+contra un `/openai/v1/chat/completions` falso local. El servidor falso
+demora la respuesta lo que tardaría subir el request con `--mbps` de
+ancho de banda, que es lo que domina en producción. No usa la API real ni
+la base de datos.
+"""
+import io
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from PIL import Image, ImageFilter
+
+from ... import groq_utils
+
+RESPUESTA = json.dumps({
+    'id': 'bench', 'object': 'chat.completion', 'created': 0, 'model': groq_utils.MODEL_VISION,
+    'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {
+        'role': 'assistant',
+        'content': json.dumps({'producto': 'Caja', 'precio_estimado': 0, 'categoria': 'Otros', 'descripcion': 'x'}),
+    }}],
+    'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2},
+}).encode()
+
+
+def _handler(mbps):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            largo = int(self.headers.get('Content-Length') or 0)
+            self.rfile.read(largo)
+            # Simula la subida por un enlace de `mbps`
+            time.sleep(largo * 8 / (mbps * 1_000_000))
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(RESPUESTA)))
+            self.end_headers()
+            self.wfile.write(RESPUESTA)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def foto_sintetica(lado: int) -> bytes:
+    """JPEG 4:3 de lado mayor `lado`, con textura parecida a una foto."""
+    ancho, alto = lado, lado * 3 // 4
+    canales = [
+        Image.linear_gradient('L').resize((ancho, alto)).rotate(angulo, expand=False)
+        for angulo in (0, 90, 180)
+    ]
+    base = Image.merge('RGB', canales)
+    ruido = Image.effect_noise((ancho, alto), 48).convert('RGB')
+    imagen = Image.blend(base, ruido, 0.35).filter(ImageFilter.GaussianBlur(1))
+    salida = io.BytesIO()
+    imagen.save(salida, 'JPEG', quality=95)
+    return salida.getvalue()
+
+
+class Command(BaseCommand):
+    help = 'Mide bytes enviados y latencia de Groq Vision con y sin preprocesamiento de imagen.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lados', type=int, nargs='+', default=[640, 1280, 2048, 3024, 4032])
+        parser.add_argument('--repeticiones', type=int, default=5)
+        parser.add_argument('--mbps', type=float, default=20.0, help='Ancho de banda de subida simulado')
+
+    def handle(self, *args, **opts):
+        servidor = ThreadingHTTPServer(('127.0.0.1', 0), _handler(opts['mbps']))
+        servidor.daemon_threads = True
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{servidor.server_address[1]}'
+        cliente = groq_utils.cliente_compartido('bench', url)
+        self.stdout.write(
+            f'Lado máx. {groq_utils.GROQ_IMAGEN_LADO_MAX} px, {groq_utils.GROQ_IMAGEN_FORMATO} '
+            f'calidad {groq_utils.GROQ_IMAGEN_CALIDAD}, enlace {opts["mbps"]:g} Mbps'
+        )
+        try:
+            with mock.patch.object(groq_utils, 'get_groq_client_vision', return_value=cliente):
+                # Calentamiento: abre la conexión keep-alive
+                groq_utils.analyze_product_image_v2(foto_sintetica(64), max_retries=0)
+                for lado in opts['lados']:
+                    imagen = foto_sintetica(lado)
+                    original = self._medir(imagen, opts['repeticiones'], lado_max=0)
+                    preprocesada = self._medir(imagen, opts['repeticiones'])
+                    self.stdout.write(
+                        f'{lado:>5} px ({len(imagen) / 1024:,.0f} KB): '
+                        f'original {original["kb"]:,.0f} KB {original["ms"]:,.0f} ms | '
+                        f'preprocesada {preprocesada["kb"]:,.0f} KB {preprocesada["ms"]:,.0f} ms '
+                        f'(preproc. {preprocesada["preproceso_ms"]:,.1f} ms) | '
+                        f'{original["ms"] / preprocesada["ms"]:.1f}x'
+                    )
+        finally:
+            servidor.shutdown()
+
+    def _medir(self, imagen, repeticiones, lado_max=None):
+        """Mediana de latencia de `analyze_product_image_v2` y bytes del request con la configuración dada."""
+        lado_max = groq_utils.GROQ_IMAGEN_LADO_MAX if lado_max is None else lado_max
+        with mock.patch.object(groq_utils, 'GROQ_IMAGEN_LADO_MAX', lado_max):
+            inicio = time.perf_counter()
+            mensajes, _ = groq_utils._preparar_imagen_v2(imagen)
+            preproceso = time.perf_counter() - inicio
+            enviados = len(json.dumps(mensajes))
+            tiempos = []
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                groq_utils.analyze_product_image_v2(imagen, max_retries=0)
+                tiempos.append(time.perf_counter() - inicio)
+        return {
+            'kb': enviados / 1024,
+            'ms': statistics.median(tiempos) * 1000,
+            'preproceso_ms': preproceso * 1000,
+        }
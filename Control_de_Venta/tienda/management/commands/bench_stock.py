@@ -0,0 +1,109 @@
+"""
+Benchmark de checkout concurrente sobre un único producto "caliente".
+
+Uso:
+    python manage.py bench_stock --hilos 8 --ventas 200 --stock 1000
+    python manage.py bench_stock --modo bloqueo   # lectura + SELECT FOR UPDATE (referencia)
+    python manage.py bench_stock --slots 8        # modo caliente: stock repartido en 8 slots
+
+Cada hilo registra ventas de 1 unidad contra el mismo producto con el
+mismo camino que `POST /api/ventas/checkout/` (`resolver_productos` +
+`ventas.crear_venta`: reservas, descuento condicional, líneas, libro de
+movimientos y, tras el commit, el resumen diario). Al final se informa el throughput y se
+verifica que no haya sobreventa: vendidas + stock final == stock inicial.
+Los datos de prueba se eliminan al terminar.
+
+Para comparar el modo caliente contra la fila única, correr el mismo
+escenario con y sin `--slots` sobre PostgreSQL: SQLite serializa todas las
+escrituras a nivel de archivo, así que ahí no se nota la diferencia.
+"""
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from ...models import Cliente, Producto, Venta, VentaDetalle
+from ...stock import StockInsuficiente, activar_modo_caliente
+from ...ventas import crear_venta, resolver_productos
+
+
+class Command(BaseCommand):
+    help = 'Mide throughput de checkout concurrente sobre un producto caliente.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hilos', type=int, default=8)
+        parser.add_argument('--ventas', type=int, default=200, help='Ventas por hilo')
+        parser.add_argument('--stock', type=int, default=1000, help='Stock inicial del producto')
+        parser.add_argument('--modo', choices=['condicional', 'bloqueo'], default='condicional')
+        parser.add_argument('--slots', type=int, default=0, help='Repartir el stock en N slots (modo caliente)')
+
+    def handle(self, *args, **opts):
+        sufijo = str(int(time.time() * 1000))
+        producto = Producto.objects.create(
+            nombre='Producto benchmark', codigo=f'BENCH-{sufijo}', cantidad=opts['stock'], precio=1000,
+        )
+        cliente = Cliente.objects.create(rut=f'{sufijo[-8:]}-0')
+        if opts['slots']:
+            activar_modo_caliente(producto.pk, opts['slots'])
+        checkout = self._checkout_condicional if opts['modo'] == 'condicional' else self._checkout_bloqueo
+
+        resultados = {'ok': 0, 'sin_stock': 0, 'errores': 0}
+        lock = threading.Lock()
+
+        def trabajador():
+            local = {'ok': 0, 'sin_stock': 0, 'errores': 0}
+            try:
+                for _ in range(opts['ventas']):
+                    try:
+                        checkout(producto, cliente)
+                        local['ok'] += 1
+                    except StockInsuficiente:
+                        local['sin_stock'] += 1
+                    except Exception:
+                        local['errores'] += 1
+            finally:
+                connection.close()
+                with lock:
+                    for k, v in local.items():
+                        resultados[k] += v
+
+        hilos = [threading.Thread(target=trabajador) for _ in range(opts['hilos'])]
+        inicio = time.perf_counter()
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+        duracion = time.perf_counter() - inicio
+
+        producto = Producto.objects.prefetch_related('slots').get(pk=producto.pk)
+        stock_final = producto.stock_actual
+        vendidas = VentaDetalle.objects.filter(producto=producto).count()
+        total = opts['hilos'] * opts['ventas']
+        self.stdout.write(f"modo={opts['modo']} slots={opts['slots']} hilos={opts['hilos']} intentos={total} duracion={duracion:.2f}s")
+        self.stdout.write(f"checkouts/s={resultados['ok'] / duracion:.1f} ok={resultados['ok']} "
+                          f"sin_stock={resultados['sin_stock']} errores={resultados['errores']}")
+        consistente = vendidas + stock_final == opts['stock'] and stock_final >= 0
+        estilo = self.style.SUCCESS if consistente else self.style.ERROR
+        self.stdout.write(estilo(f"vendidas={vendidas} stock_final={stock_final} consistente={consistente}"))
+
+        Venta.objects.filter(cliente=cliente).delete()
+        producto.delete()
+        cliente.delete()
+
+    @staticmethod
+    def _checkout_condicional(producto, cliente):
+        # Como la vista: el producto se relee por venta (stock y slots vigentes)
+        crear_venta(cliente, resolver_productos([{'producto': producto.pk, 'cantidad': 1}]))
+
+    @staticmethod
+    def _checkout_bloqueo(producto, cliente):
+        # Patrón anterior con bloqueo de fila: lee, valida en Python y guarda
+        with transaction.atomic():
+            prod = Producto.objects.select_for_update().get(pk=producto.pk)
+            if prod.cantidad < 1:
+                raise StockInsuficiente(prod.pk, 1)
+            venta = Venta.objects.create(cliente=cliente)
+            VentaDetalle.objects.create(venta=venta, producto=prod, cantidad=1, precio_unitario=prod.precio)
+            prod.cantidad -= 1
+            prod.save()
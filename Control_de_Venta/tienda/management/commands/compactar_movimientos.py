@@ -0,0 +1,31 @@
+"""
+Compacta el libro de movimientos de stock.
+
+Uso (programar a diario, p. ej. con cron o un job de Railway):
+    python manage.py compactar_movimientos --dias 90
+    python manage.py compactar_movimientos --verificar
+"""
+from django.core.management.base import BaseCommand
+
+from ...stock import compactar_movimientos, verificar_saldos
+
+
+class Command(BaseCommand):
+    help = 'Resume los movimientos de stock antiguos en un saldo por producto.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=90, help='Conservar el detalle de los últimos N días')
+        parser.add_argument('--lote', type=int, default=500, help='Productos por transacción')
+        parser.add_argument('--verificar', action='store_true', help='Solo comparar saldo materializado vs. libro')
+
+    def handle(self, *args, **opts):
+        if opts['verificar']:
+            descuadres = verificar_saldos()
+            for pid, saldo, libro in descuadres:
+                self.stdout.write(self.style.WARNING(f"producto={pid} saldo={saldo} libro={libro}"))
+            estilo = self.style.SUCCESS if not descuadres else self.style.ERROR
+            self.stdout.write(estilo(f"Productos descuadrados: {len(descuadres)}"))
+            return
+
+        eliminados = compactar_movimientos(dias=opts['dias'], lote=opts['lote'])
+        self.stdout.write(self.style.SUCCESS(f"Movimientos compactados: {eliminados}"))
@@ -0,0 +1,27 @@
+"""
+Reconstruye desde cero la matriz de co-ocurrencia de productos (ParProductos).
+
+Uso (después de migrar, o si se sospecha un descuadre):
+    python manage.py reconstruir_canasta
+    python manage.py reconstruir_canasta --ventas-por-lote 20000
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...canasta import reconstruir
+
+
+class Command(BaseCommand):
+    help = 'Recalcula los pares de productos comprados juntos desde las líneas de venta.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ventas-por-lote', type=int, default=5000,
+                            help='Rango de ids de venta agrupado por sentencia')
+
+    def handle(self, *args, **opts):
+        inicio = time.perf_counter()
+        pares = reconstruir(lote=opts['ventas_por_lote'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Matriz reconstruida: {pares} pares en {time.perf_counter() - inicio:.2f}s"
+        ))
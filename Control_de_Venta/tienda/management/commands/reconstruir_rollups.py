@@ -0,0 +1,54 @@
+"""
+Reconstruye los resúmenes diarios de ventas desde cero.
+
+Uso (después de migrar, o si se sospecha un descuadre):
+    python manage.py reconstruir_rollups                  # toda la historia
+    python manage.py reconstruir_rollups --desde 2025-01-01 --hasta 2025-12-31
+    python manage.py reconstruir_rollups --dias-por-lote 7
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from ...models import Venta
+from ...rollups import reconstruir, resumir_pendientes
+
+
+class Command(BaseCommand):
+    help = 'Recalcula VentaDiaria, ProductoDiario y CategoriaDiaria por lotes de días.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', help='Primer día (YYYY-MM-DD); por defecto la venta más antigua')
+        parser.add_argument('--hasta', help='Último día (YYYY-MM-DD); por defecto la venta más reciente')
+        parser.add_argument('--dias-por-lote', type=int, default=31, help='Días por transacción')
+
+    def handle(self, *args, **opts):
+        rango = Venta.objects.aggregate(min=Min('fecha'), max=Max('fecha'))
+        desde = self._fecha(opts['desde']) or (rango['min'] and timezone.localdate(rango['min']))
+        hasta = self._fecha(opts['hasta']) or (rango['max'] and timezone.localdate(rango['max']))
+        if desde is None or hasta is None:
+            self.stdout.write('No hay ventas registradas.')
+            return
+
+        filas = 0
+        inicio = desde
+        while inicio <= hasta:
+            fin = min(inicio + timedelta(days=opts['dias_por_lote'] - 1), hasta)
+            filas += reconstruir(inicio, fin)
+            self.stdout.write(f"{inicio} .. {fin}")
+            inicio = fin + timedelta(days=1)
+        # La reconstrucción cuenta las ventas resumidas; sumar las pendientes
+        resumir_pendientes()
+        self.stdout.write(self.style.SUCCESS(f"Resúmenes reconstruidos: {filas} filas de producto/día"))
+
+    @staticmethod
+    def _fecha(valor):
+        if not valor:
+            return None
+        fecha = parse_date(valor)
+        if fecha is None:
+            raise CommandError(f"Fecha inválida: {valor}")
+        return fecha
@@ -0,0 +1,22 @@
+"""
+Suma a los resúmenes diarios las ventas confirmadas que quedaron pendientes.
+
+Cada venta se resume sola al confirmarse; este comando recoge las que un
+proceso no alcanzó a resumir (caída tras el commit) o que se saltaron por
+estar su día bloqueado. Uso (programar cada pocos minutos):
+    python manage.py resumir_ventas
+"""
+from django.core.management.base import BaseCommand
+
+from ...rollups import resumir_pendientes
+
+
+class Command(BaseCommand):
+    help = 'Resume las ventas pendientes en VentaDiaria, ProductoDiario, CategoriaDiaria y la canasta.'
+
+    def handle(self, *args, **opts):
+        total = 0
+        # Cada pasada salta lo bloqueado: repetir mientras avance
+        while (resumidas := resumir_pendientes()):
+            total += resumidas
+        self.stdout.write(self.style.SUCCESS(f"Ventas resumidas: {total}"))
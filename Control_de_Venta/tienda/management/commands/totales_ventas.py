@@ -0,0 +1,65 @@
+"""
+Recalcula y verifica los totales desnormalizados de las ventas.
+
+Uso:
+    python manage.py totales_ventas              # recalcular todo por lotes
+    python manage.py totales_ventas --verificar  # solo informar descuadres
+    python manage.py totales_ventas --lote 5000
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Sum
+
+from ...models import Venta, VentaDetalle
+from ...ventas import recalcular_totales
+
+
+class Command(BaseCommand):
+    help = 'Recalcula (o verifica) Venta.total y Venta.items desde los detalles, por lotes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=1000, help='Ventas por transacción')
+        parser.add_argument('--verificar', action='store_true', help='Solo comparar sin escribir')
+
+    def handle(self, *args, **opts):
+        lote = opts['lote']
+        procesadas = 0
+        descuadres = 0
+        ultimo = 0
+        # Recorrer por rangos de pk para que cada lote use el índice primario
+        while True:
+            ids = list(
+                Venta.objects.filter(pk__gt=ultimo).order_by('pk').values_list('pk', flat=True)[:lote]
+            )
+            if not ids:
+                break
+            ultimo = ids[-1]
+            if opts['verificar']:
+                descuadres += self._verificar(ids)
+            else:
+                with transaction.atomic():
+                    recalcular_totales(Venta.objects.filter(pk__in=ids))
+            procesadas += len(ids)
+
+        if opts['verificar']:
+            estilo = self.style.SUCCESS if not descuadres else self.style.ERROR
+            self.stdout.write(estilo(f"Ventas revisadas: {procesadas} descuadradas: {descuadres}"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Ventas recalculadas: {procesadas}"))
+
+    def _verificar(self, ids):
+        calculados = {
+            r['venta_id']: (r['total'] or 0, r['items'] or 0)
+            for r in VentaDetalle.objects.filter(venta_id__in=ids).values('venta_id').annotate(
+                total=Sum(F('cantidad') * F('precio_unitario')), items=Sum('cantidad'),
+            )
+        }
+        descuadres = 0
+        for pk, total, items in Venta.objects.filter(pk__in=ids).values_list('pk', 'total', 'items'):
+            esperado = calculados.get(pk, (0, 0))
+            if (total, items) != esperado:
+                descuadres += 1
+                self.stdout.write(self.style.WARNING(
+                    f"venta={pk} total={total} items={items} esperado_total={esperado[0]} esperado_items={esperado[1]}"
+                ))
+        return descuadres
@@ -0,0 +1,222 @@
+"""
+Soporte del header `Idempotency-Key` para las escrituras de la API.
+
+La app móvil reintenta los POST tras un timeout. Si el primer intento sí
+llegó, el reintento creaba otro Producto, Venta o ChatMessage (y otra
+llamada a Groq). Con este middleware, el cliente manda la misma
+`Idempotency-Key` en cada reintento y:
+
+- la primera respuesta (2xx/4xx) se guarda en caché durante
+  `IDEMPOTENCY_TTL` segundos y los reintentos la reciben tal cual, con el
+  header `Idempotent-Replayed: true`;
+- si el reintento llega mientras el original sigue en curso, espera su
+  resultado (hasta `IDEMPOTENCY_ESPERA` segundos) en vez de ejecutarse de
+  nuevo; si se agota la espera responde 409. El candado del original se
+  renueva mientras la vista corre (una llamada a Groq con reintentos puede
+  tardar minutos), así que vence solo si el proceso muere;
+- reutilizar la clave con otro cuerpo responde 422.
+
+La clave se aísla por credenciales, método y ruta, para que dos usuarios no
+compartan respuestas. Usa el caché `default` (Redis si `REDIS_URL` está
+definido, compartido entre workers).
+
+`WhiteNoiseAsyncMiddleware` adapta WhiteNoise a la cadena asíncrona, para
+que las vistas async no terminen corriendo en un hilo.
+"""
+import asyncio
+import hashlib
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+METODOS = ('POST', 'PUT', 'PATCH', 'DELETE')
+# Respuestas que dependen de la sesión o del momento: no se reproducen
+NO_CACHEAR = (401, 403, 429)
+
+
+class IdempotencyKeyMiddleware:
+    # Síncrono y asíncrono: un middleware solo síncrono haría que Django
+    # corriera las vistas async (ver ai_views.py) dentro de un hilo
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.ttl = getattr(settings, 'IDEMPOTENCY_TTL', 24 * 3600)
+        self.espera = getattr(settings, 'IDEMPOTENCY_ESPERA', 10)
+        self.prefijo = getattr(settings, 'IDEMPOTENCY_PREFIJO', '/api/')
+        # Vida del candado sin renovar: lo que tarda en liberarse si el proceso muere
+        self.vida_candado = self.espera + 30
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _alcance(self, request):
+        """(clave de caché, huella del cuerpo), None si no aplica o una respuesta de error."""
+        clave = request.headers.get('Idempotency-Key')
+        if not clave or request.method not in METODOS or not request.path.startswith(self.prefijo):
+            return None
+        if len(clave) > 255:
+            return JsonResponse({'error': 'Idempotency-Key demasiado larga (máx. 255)'}, status=400)
+        return self._clave_cache(request, clave), hashlib.sha256(request.body).hexdigest()
+
+    @staticmethod
+    def _respuesta_guardada(huella, response):
+        return {
+            'huella': huella,
+            'status': response.status_code,
+            'content_type': response.get('Content-Type'),
+            'contenido': response.content,
+        }
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        alcance = self._alcance(request)
+        if alcance is None:
+            return self.get_response(request)
+        if isinstance(alcance, HttpResponse):
+            return alcance
+        base, huella = alcance
+
+        guardada = cache.get(base)
+        if guardada is not None:
+            return self._reproducir(guardada, huella)
+
+        # Solo el primer request con la clave se ejecuta; los duplicados en
+        # vuelo esperan su resultado
+        candado = f'{base}:candado'
+        if not cache.add(candado, huella, timeout=self.vida_candado):
+            limite = time.monotonic() + self.espera
+            while time.monotonic() < limite:
+                time.sleep(0.1)
+                guardada = cache.get(base)
+                if guardada is not None:
+                    return self._reproducir(guardada, huella)
+                if cache.get(candado) is None:
+                    # El original terminó sin respuesta cacheable: ejecutar este
+                    break
+            else:
+                return self._en_curso()
+
+        fin = threading.Event()
+        threading.Thread(target=self._renovar, args=(candado, fin), daemon=True).start()
+        try:
+            response = self.get_response(request)
+            if self._cacheable(response):
+                cache.set(base, self._respuesta_guardada(huella, response), timeout=self.ttl)
+            return response
+        finally:
+            fin.set()
+            cache.delete(candado)
+
+    def _renovar(self, candado, fin):
+        """Extiende el candado cada tercio de su vida hasta que termine la vista."""
+        while not fin.wait(self.vida_candado / 3):
+            cache.touch(candado, self.vida_candado)
+
+    async def _arenovar(self, candado):
+        """Como `_renovar`, como tarea del event loop."""
+        while True:
+            await asyncio.sleep(self.vida_candado / 3)
+            await cache.atouch(candado, self.vida_candado)
+
+    async def __acall__(self, request):
+        """Mismo flujo que `__call__` con el caché asíncrono: las esperas no ocupan hilos."""
+        alcance = self._alcance(request)
+        if alcance is None:
+            return await self.get_response(request)
+        if isinstance(alcance, HttpResponse):
+            return alcance
+        base, huella = alcance
+
+        guardada = await cache.aget(base)
+        if guardada is not None:
+            return self._reproducir(guardada, huella)
+
+        candado = f'{base}:candado'
+        if not await cache.aadd(candado, huella, timeout=self.vida_candado):
+            limite = time.monotonic() + self.espera
+            while time.monotonic() < limite:
+                await asyncio.sleep(0.1)
+                guardada = await cache.aget(base)
+                if guardada is not None:
+                    return self._reproducir(guardada, huella)
+                if await cache.aget(candado) is None:
+                    break
+            else:
+                return self._en_curso()
+
+        renovacion = asyncio.create_task(self._arenovar(candado))
+        try:
+            response = await self.get_response(request)
+            if self._cacheable(response):
+                await cache.aset(base, self._respuesta_guardada(huella, response), timeout=self.ttl)
+            return response
+        finally:
+            renovacion.cancel()
+            await cache.adelete(candado)
+
+    @staticmethod
+    def _en_curso():
+        return JsonResponse({'error': 'Ya hay una solicitud en curso con esta Idempotency-Key'}, status=409)
+
+    @staticmethod
+    def _clave_cache(request, clave):
+        credenciales = request.headers.get('Authorization') or request.session.session_key or ''
+        alcance = '|'.join((credenciales, request.method, request.path, clave))
+        return 'idempotencia:' + hashlib.sha256(alcance.encode()).hexdigest()
+
+    @staticmethod
+    def _cacheable(response):
+        return (
+            not response.streaming
+            and response.status_code < 500
+            and response.status_code not in NO_CACHEAR
+        )
+
+    @staticmethod
+    def _reproducir(guardada, huella):
+        if guardada['huella'] != huella:
+            return JsonResponse(
+                {'error': 'La Idempotency-Key ya se usó con un cuerpo distinto'}, status=422
+            )
+        response = HttpResponse(guardada['contenido'], status=guardada['status'],
+                                content_type=guardada['content_type'])
+        response['Idempotent-Replayed'] = 'true'
+        return response
+
+
+class WhiteNoiseAsyncMiddleware(WhiteNoiseMiddleware):
+    """WhiteNoise apto para la cadena asíncrona de middleware.
+
+    El original es solo síncrono: con él en MIDDLEWARE, Django envuelve toda
+    la petición (también las vistas async) en un hilo. Aquí la búsqueda del
+    archivo es un acceso a diccionario (o al disco con autorefresh, en un
+    hilo) y las demás peticiones siguen en el event loop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-16 22:49
+
+from django.db import migrations, models
+
+
+def corregir_stock_negativo(apps, schema_editor):
+    # Filas sobrevendidas antes del descuento condicional impedirían crear el CHECK
+    Producto = apps.get_model('tienda', 'Producto')
+    Producto.objects.filter(cantidad__lt=0).update(cantidad=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0007_producto_descripcion'),
+    ]
+
+    operations = [
+        migrations.RunPython(corregir_stock_negativo, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='producto',
+            constraint=models.CheckConstraint(condition=models.Q(('cantidad__gte', 0)), name='producto_cantidad_no_negativa'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.6 on 2026-10-16 22:52
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def saldo_inicial(apps, schema_editor):
+    # Punto de partida del libro: un saldo por producto igual al stock actual
+    Producto = apps.get_model('tienda', 'Producto')
+    MovimientoStock = apps.get_model('tienda', 'MovimientoStock')
+    MovimientoStock.objects.bulk_create(
+        [
+            MovimientoStock(producto_id=pid, tipo='saldo', cantidad=cantidad)
+            for pid, cantidad in Producto.objects.values_list('pk', 'cantidad').iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0009_venta_clave_idempotencia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovimientoStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('venta', 'Venta'), ('devolucion', 'Devolución'), ('reposicion', 'Reposición'), ('ajuste', 'Ajuste'), ('saldo', 'Saldo compactado')], max_length=12)),
+                ('cantidad', models.IntegerField()),
+                ('fecha', models.DateTimeField(default=django.utils.timezone.now)),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movimientos', to='tienda.producto')),
+                ('venta', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movimientos', to='tienda.venta')),
+            ],
+            options={
+                'verbose_name': 'Movimiento de stock',
+                'verbose_name_plural': 'Movimientos de stock',
+                'indexes': [models.Index(fields=['producto', 'fecha'], name='movstock_producto_fecha'), models.Index(fields=['fecha'], name='movstock_fecha')],
+            },
+        ),
+        migrations.RunPython(saldo_inicial, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-16 22:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0010_movimientostock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='slots_stock',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='StockSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.PositiveSmallIntegerField()),
+                ('cantidad', models.IntegerField(default=0)),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slots', to='tienda.producto')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('producto', 'slot'), name='stockslot_producto_slot'), models.CheckConstraint(condition=models.Q(('cantidad__gte', 0)), name='stockslot_cantidad_no_negativa')],
+            },
+        ),
+    ]
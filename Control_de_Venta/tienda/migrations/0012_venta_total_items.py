@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-16 22:59
+
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def calcular_totales(apps, schema_editor):
+    # Un UPDATE con subconsultas correlacionadas; el comando `totales_ventas`
+    # permite repetirlo por lotes en bases grandes
+    Venta = apps.get_model('tienda', 'Venta')
+    VentaDetalle = apps.get_model('tienda', 'VentaDetalle')
+    por_venta = VentaDetalle.objects.filter(venta=OuterRef('pk')).values('venta')
+    Venta.objects.update(
+        total=Coalesce(
+            Subquery(por_venta.annotate(s=Sum(F('cantidad') * F('precio_unitario'))).values('s')),
+            Value(0), output_field=DecimalField(max_digits=12, decimal_places=2),
+        ),
+        items=Coalesce(Subquery(por_venta.annotate(s=Sum('cantidad')).values('s')), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0011_stockslot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='venta',
+            name='items',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='venta',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.RunPython(calcular_totales, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0013_venta_fecha_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VentaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(unique=True)),
+                ('ventas', models.PositiveIntegerField(default=0)),
+                ('unidades', models.PositiveIntegerField(default=0)),
+                ('ingresos', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('lineas', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Venta diaria',
+                'verbose_name_plural': 'Ventas diarias',
+                'ordering': ['fecha'],
+            },
+        ),
+        migrations.CreateModel(
+            name='CategoriaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('unidades', models.PositiveIntegerField(default=0)),
+                ('ingresos', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('lineas', models.PositiveIntegerField(default=0)),
+                ('categoria', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='diarias', to='tienda.categoria')),
+            ],
+            options={
+                'verbose_name': 'Categoría diaria',
+                'verbose_name_plural': 'Categorías diarias',
+                'constraints': [models.UniqueConstraint(fields=('fecha', 'categoria'), name='categoriadiaria_fecha_categoria')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductoDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('unidades', models.PositiveIntegerField(default=0)),
+                ('ingresos', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('lineas', models.PositiveIntegerField(default=0)),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='diarios', to='tienda.producto')),
+            ],
+            options={
+                'verbose_name': 'Producto diario',
+                'verbose_name_plural': 'Productos diarios',
+                'indexes': [models.Index(fields=['producto', 'fecha'], name='productodiario_producto_fecha')],
+                'constraints': [models.UniqueConstraint(fields=('fecha', 'producto'), name='productodiario_fecha_producto')],
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:20
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def marcar_stock_bajo(apps, schema_editor):
+    # Estado inicial de stock_bajo, sin notificaciones
+    Producto = apps.get_model('tienda', 'Producto')
+    StockSlot = apps.get_model('tienda', 'StockSlot')
+    en_slots = StockSlot.objects.filter(producto=OuterRef('pk')).values('producto').annotate(
+        s=Sum('cantidad')
+    ).values('s')
+    Producto.objects.annotate(
+        stock=F('cantidad') + Coalesce(Subquery(en_slots), Value(0)),
+        umbral=Coalesce('stock_minimo', 'categoria__stock_minimo', Value(10)),
+    ).filter(stock__lt=F('umbral')).update(stock_bajo=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0014_rollups_diarios'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='categoria',
+            name='stock_minimo',
+            field=models.PositiveIntegerField(default=10),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='stock_minimo',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='stock_bajo',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(condition=Q(stock_bajo=True), fields=['stock_bajo'], name='producto_stock_bajo'),
+        ),
+        migrations.RunPython(marcar_stock_bajo, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0015_stock_minimo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParProductos',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ventas', models.PositiveIntegerField(default=0)),
+                ('producto_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pares', to='tienda.producto')),
+                ('producto_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='tienda.producto')),
+            ],
+            options={
+                'verbose_name': 'Par de productos',
+                'verbose_name_plural': 'Pares de productos',
+                'constraints': [models.UniqueConstraint(fields=('producto_a', 'producto_b'), name='parproductos_a_b')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0016_parproductos'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='imageanalysis',
+            name='image',
+            field=models.ImageField(blank=True, upload_to='ia_uploads/'),
+        ),
+        migrations.AddField(
+            model_name='imageanalysis',
+            name='sha256',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='imageanalysis',
+            name='phash',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.6 on 2026-10-17 01:10
+
+from django.db import migrations, models
+
+
+def mover_cache(apps, schema_editor):
+    # Las filas del caché de imágenes (con huellas, sin archivo) pasan a HuellaImagen
+    ImageAnalysis = apps.get_model('tienda', 'ImageAnalysis')
+    HuellaImagen = apps.get_model('tienda', 'HuellaImagen')
+    cache = ImageAnalysis.objects.exclude(sha256='').order_by('id')
+    HuellaImagen.objects.bulk_create(
+        [
+            HuellaImagen(sha256=a.sha256, phash=a.phash, analysis_result=a.analysis_result)
+            for a in cache.iterator()
+        ],
+        batch_size=1000,
+    )
+    cache.filter(image='').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0017_imageanalysis_huellas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HuellaImagen',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(db_index=True, max_length=64)),
+                ('phash', models.CharField(blank=True, max_length=16)),
+                ('analysis_result', models.JSONField()),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(mover_cache, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='imageanalysis',
+            name='sha256',
+        ),
+        migrations.RemoveField(
+            model_name='imageanalysis',
+            name='phash',
+        ),
+        migrations.AlterField(
+            model_name='imageanalysis',
+            name='image',
+            field=models.ImageField(upload_to='ia_uploads/'),
+        ),
+    ]
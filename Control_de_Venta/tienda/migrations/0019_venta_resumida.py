@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-17 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0018_huellaimagen'),
+    ]
+
+    operations = [
+        # Las ventas existentes ya están en los resúmenes (o entran al correr
+        # reconstruir_rollups): se marcan resumidas para no sumarlas dos veces
+        migrations.AddField(
+            model_name='venta',
+            name='resumida',
+            field=models.BooleanField(default=True, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='venta',
+            name='resumida',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='venta',
+            index=models.Index(condition=models.Q(('resumida', False)), fields=['fecha'], name='venta_pendiente_resumen'),
+        ),
+    ]
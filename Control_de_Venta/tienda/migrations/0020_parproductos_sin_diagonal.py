@@ -0,0 +1,21 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:15
+
+from django.db import migrations
+from django.db.models import F
+
+
+def borrar_diagonal(apps, schema_editor):
+    # Las ventas por producto salen ahora de ProductoDiario
+    ParProductos = apps.get_model('tienda', 'ParProductos')
+    ParProductos.objects.filter(producto_a=F('producto_b')).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0019_venta_resumida'),
+    ]
+
+    operations = [
+        migrations.RunPython(borrar_diagonal, migrations.RunPython.noop),
+    ]
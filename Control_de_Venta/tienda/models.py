@@ -3,6 +3,7 @@
 from django.db import models, transaction
 from django.core.validators import RegexValidator
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 
 
 # Modelo que representa a un cliente
@@ -28,6 +29,8 @@ class Categoria(models.Model):
     nombre = models.CharField(max_length=100, unique=True)
     descripcion = models.TextField(blank=True, null=True)
     activa = models.BooleanField(default=True)
+    # Umbral de stock bajo de los productos de la categoría sin umbral propio
+    stock_minimo = models.PositiveIntegerField(default=10)
 
     class Meta:
         verbose_name = 'Categoría'
@@ -38,6 +41,10 @@ class Categoria(models.Model):
         return self.nombre
 
 
+# Umbral de stock bajo de los productos sin categoría
+STOCK_MINIMO_DEFECTO = 10
+
+
 # Modelo que representa un producto en inventario
 class Producto(models.Model):
     nombre = models.CharField(max_length=100)  
@@ -46,21 +53,78 @@ class Producto(models.Model):
     precio = models.DecimalField(max_digits=10, decimal_places=2)
     categoria = models.ForeignKey(Categoria, on_delete=models.SET_NULL, null=True, blank=True, related_name='productos')
     descripcion = models.TextField(blank=True, null=True)
+    # Modo "producto caliente": > 0 reparte el stock en N slots de StockSlot
+    slots_stock = models.PositiveSmallIntegerField(default=0)
+    # Umbral de stock bajo; vacío hereda el de la categoría (ver stock.umbral_stock)
+    stock_minimo = models.PositiveIntegerField(null=True, blank=True)
+    # stock_actual < stock_minimo; lo mantiene stock.revisar_umbrales
+    stock_bajo = models.BooleanField(default=False, editable=False)
+
+    class Meta:
+        constraints = [
+            # Respaldo en BD del descuento condicional de stock (ver stock.py)
+            models.CheckConstraint(condition=models.Q(cantidad__gte=0), name='producto_cantidad_no_negativa'),
+        ]
+        indexes = [
+            # Índice parcial: solo contiene los pocos productos bajo su umbral
+            models.Index(fields=['stock_bajo'], name='producto_stock_bajo', condition=models.Q(stock_bajo=True)),
+        ]
+
+    @property
+    def stock_actual(self):
+        """Stock total: `cantidad` más la suma de los slots si el producto está en modo caliente."""
+        if not self.slots_stock:
+            return self.cantidad
+        return self.cantidad + sum(s.cantidad for s in self.slots.all())
 
     def __str__(self):
         return f"{self.nombre} ({self.codigo})"
 
 
+class StockSlot(models.Model):
+    """Fracción del stock de un producto caliente.
+
+    Con el modo caliente activo, cada venta descuenta de un slot al azar que
+    todavía tenga stock, de modo que los checkouts concurrentes no compiten
+    por la misma fila. El stock total es la suma de los slots.
+    """
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='slots')
+    slot = models.PositiveSmallIntegerField()
+    cantidad = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['producto', 'slot'], name='stockslot_producto_slot'),
+            models.CheckConstraint(condition=models.Q(cantidad__gte=0), name='stockslot_cantidad_no_negativa'),
+        ]
+
+    def __str__(self):
+        return f"{self.producto_id}#{self.slot}: {self.cantidad}"
+
+
 # Modelo que representa una venta realizada
 class Venta(models.Model):
     """Cabecera de la venta."""
     cliente = models.ForeignKey(Cliente, on_delete=models.CASCADE)
-    fecha = models.DateTimeField(auto_now_add=True)
+    # default en vez de auto_now_add para respetar la hora real de ventas sincronizadas offline
+    fecha = models.DateTimeField(default=timezone.now, editable=False)
     stock_actualizado = models.BooleanField(default=False)
+    # Clave generada por el POS offline; evita duplicar ventas en reintentos de sincronización
+    clave_idempotencia = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    # Totales desnormalizados: se mantienen en la misma transacción que escribe
+    # los detalles (ver `ventas.totales_lineas` / `ventas.recalcular_totales`)
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    items = models.PositiveIntegerField(default=0, editable=False)
+    # Ya sumada a los resúmenes diarios y a la canasta (ver `rollups.resumir_pendientes`)
+    resumida = models.BooleanField(default=False, editable=False)
 
-    def total(self):
-        """Suma los totales de los detalles."""
-        return sum(d.cantidad * d.precio_unitario for d in self.detalles.all())
+    class Meta:
+        indexes = [
+            # Filtro por rango de fechas y paginación keyset (fecha, id) del resumen
+            models.Index(fields=['-fecha', '-id'], name='venta_fecha_id'),
+            # Solo las pendientes de resumir: el índice queda casi vacío
+            models.Index(fields=['fecha'], condition=models.Q(resumida=False), name='venta_pendiente_resumen'),
+        ]
 
     def __str__(self):
         return f"{self.fecha.strftime('%Y-%m-%d %H:%M')} - {self.cliente.rut}"
@@ -77,10 +141,11 @@ class VentaDetalle(models.Model):
         verbose_name_plural = 'Detalles de venta'
 
     def clean(self):
-        # Validar stock disponible al crear/actualizar el detalle
+        # Validar stock disponible al crear/actualizar el detalle (slots incluidos)
         if self.pk is None:
-            if self.producto.cantidad < self.cantidad:
-                raise ValidationError(f"Stock insuficiente para {self.producto.nombre} (disponible: {self.producto.cantidad})")
+            disponible = self.producto.stock_actual
+            if disponible < self.cantidad:
+                raise ValidationError(f"Stock insuficiente para {self.producto.nombre} (disponible: {disponible})")
 
     def save(self, *args, **kwargs):
         # Si no se recibe precio_unitario, tomar el precio actual del producto
@@ -89,6 +154,137 @@ class VentaDetalle(models.Model):
         super().save(*args, **kwargs)
 
 
+class VentaDiaria(models.Model):
+    """Resumen diario de ventas, mantenido por `rollups.py`.
+
+    Las analíticas leen estas filas (una por día) en vez de recorrer todas
+    las líneas de venta del periodo.
+    """
+    fecha = models.DateField(unique=True)
+    ventas = models.PositiveIntegerField(default=0)
+    unidades = models.PositiveIntegerField(default=0)
+    ingresos = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    lineas = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Venta diaria'
+        verbose_name_plural = 'Ventas diarias'
+        ordering = ['fecha']
+
+    def __str__(self):
+        return f"{self.fecha}: {self.ingresos}"
+
+
+class ProductoDiario(models.Model):
+    """Unidades, ingresos y líneas vendidas de un producto en un día."""
+    fecha = models.DateField()
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='diarios')
+    unidades = models.PositiveIntegerField(default=0)
+    ingresos = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    lineas = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Producto diario'
+        verbose_name_plural = 'Productos diarios'
+        constraints = [
+            models.UniqueConstraint(fields=['fecha', 'producto'], name='productodiario_fecha_producto'),
+        ]
+        indexes = [
+            models.Index(fields=['producto', 'fecha'], name='productodiario_producto_fecha'),
+        ]
+
+    def __str__(self):
+        return f"{self.fecha} {self.producto_id}: {self.unidades}"
+
+
+class CategoriaDiaria(models.Model):
+    """Unidades, ingresos y líneas vendidas de una categoría en un día.
+
+    Los productos sin categoría solo cuentan en `VentaDiaria`.
+    """
+    fecha = models.DateField()
+    categoria = models.ForeignKey(Categoria, on_delete=models.CASCADE, related_name='diarias')
+    unidades = models.PositiveIntegerField(default=0)
+    ingresos = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    lineas = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Categoría diaria'
+        verbose_name_plural = 'Categorías diarias'
+        constraints = [
+            models.UniqueConstraint(fields=['fecha', 'categoria'], name='categoriadiaria_fecha_categoria'),
+        ]
+
+    def __str__(self):
+        return f"{self.fecha} {self.categoria_id}: {self.unidades}"
+
+
+class ParProductos(models.Model):
+    """Cantidad de ventas que incluyen a ambos productos, mantenida por `canasta.py`.
+
+    Matriz de co-ocurrencia dispersa: solo existen los pares de productos
+    distintos comprados juntos alguna vez, en ambas direcciones (a, b) y
+    (b, a). Sin diagonal: las ventas por producto salen de `ProductoDiario`.
+    """
+    producto_a = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='pares')
+    producto_b = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='+')
+    ventas = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Par de productos'
+        verbose_name_plural = 'Pares de productos'
+        constraints = [
+            # También sirve la consulta "qué se compra con a" (rango por producto_a)
+            models.UniqueConstraint(fields=['producto_a', 'producto_b'], name='parproductos_a_b'),
+        ]
+
+    def __str__(self):
+        return f"{self.producto_a_id}+{self.producto_b_id}: {self.ventas}"
+
+
+class MovimientoStock(models.Model):
+    """Libro de movimientos de stock (solo inserciones).
+
+    Cada venta, devolución, reposición o ajuste agrega una fila con el delta
+    con signo. `Producto.cantidad` es el saldo materializado y se mantiene con
+    el mismo delta en la misma transacción, por lo que leer el stock actual
+    sigue siendo O(1). El job `compactar_movimientos` resume los movimientos
+    antiguos en una fila de tipo "saldo" por producto.
+
+    Es un registro de auditoría: el saldo se sigue escribiendo en la fila del
+    producto (ver `stock.py`), así que no reduce la contención de escritura.
+    """
+    VENTA = 'venta'
+    DEVOLUCION = 'devolucion'
+    REPOSICION = 'reposicion'
+    AJUSTE = 'ajuste'
+    SALDO = 'saldo'
+    TIPOS = [
+        (VENTA, 'Venta'),
+        (DEVOLUCION, 'Devolución'),
+        (REPOSICION, 'Reposición'),
+        (AJUSTE, 'Ajuste'),
+        (SALDO, 'Saldo compactado'),
+    ]
+
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='movimientos')
+    tipo = models.CharField(max_length=12, choices=TIPOS)
+    cantidad = models.IntegerField()  # delta con signo: negativo descuenta
+    fecha = models.DateTimeField(default=timezone.now)
+    venta = models.ForeignKey(Venta, on_delete=models.SET_NULL, null=True, blank=True, related_name='movimientos')
+
+    class Meta:
+        verbose_name = 'Movimiento de stock'
+        verbose_name_plural = 'Movimientos de stock'
+        indexes = [
+            models.Index(fields=['producto', 'fecha'], name='movstock_producto_fecha'),
+            models.Index(fields=['fecha'], name='movstock_fecha'),
+        ]
+
+    def __str__(self):
+        return f"{self.producto_id} {self.tipo} {self.cantidad:+d}"
+
+
 class ChatMessage(models.Model):
     """Historial de mensajes IA con usuario."""
     user = models.ForeignKey('auth.User', on_delete=models.CASCADE, related_name='chat_messages')
@@ -117,4 +313,18 @@ class ImageAnalysis(models.Model):
     producto_created = models.ForeignKey(Producto, on_delete=models.SET_NULL, null=True, blank=True)
 
     def __str__(self):
-        return f"{self.user.username} - {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
\ No newline at end of file
+        return f"{self.user.username} - {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
+
+
+class HuellaImagen(models.Model):
+    """Caché de análisis de Groq Vision por contenido de la imagen (`imagen_cache.py`).
+
+    Sin archivo ni usuario: no es historial y no aparece en /api/images/.
+    """
+    sha256 = models.CharField(max_length=64, db_index=True)  # Píxeles normalizados
+    phash = models.CharField(max_length=16, blank=True)  # dHash de 64 bits en hex
+    analysis_result = models.JSONField()  # Resultado del análisis Groq
+    creado = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256[:12]} - {self.creado.strftime('%Y-%m-%d %H:%M')}"
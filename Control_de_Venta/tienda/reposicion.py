@@ -0,0 +1,97 @@
+"""
+Métricas de reposición de stock para todo el catálogo.
+
+Se leen dos conjuntos planos (productos con su stock y la matriz de ventas
+diarias desde `ProductoDiario`) y el resto se calcula con operaciones
+vectoriales de numpy, sin consultas ni bucles por producto:
+
+    velocidad        = vendidos en los últimos `dias` / dias
+    pronostico       = SES o Croston según el producto (ver `forecast.py`)
+    punto_reorden    = pronostico * plazo + stock_seguridad
+    dias_cobertura   = stock / pronostico           (inf si no hay demanda)
+    fecha_quiebre    = hoy + dias_cobertura
+    cantidad_reorden = punto_reorden + pronostico * cobertura - stock
+
+Los productos con stock en o bajo su punto de reorden se consideran "en
+atención", ordenados por urgencia.
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .forecast import matriz_diaria, politica_reposicion, pronosticar
+from .models import Producto, StockSlot
+
+
+def metricas_reposicion(dias: int = 30, plazo: int = 7, cobertura: int = 14,
+                        historia: int = 180, nivel_servicio: float = 0.95):
+    """Calcula las métricas de reposición de todos los productos.
+
+    `plazo` son los días que tarda en llegar un pedido, `cobertura` los días
+    de venta que debe cubrir cada reposición e `historia` los días de ventas
+    con que se ajusta el pronóstico. Retorna un dict de arrays alineados.
+    """
+    en_slots = (
+        StockSlot.objects.filter(producto=OuterRef('pk')).values('producto')
+        .annotate(s=Sum('cantidad')).values('s')
+    )
+    filas = list(
+        Producto.objects.annotate(en_slots=Coalesce(Subquery(en_slots), Value(0)))
+        .order_by('pk').values_list('pk', 'nombre', 'codigo', 'precio', 'cantidad', 'en_slots')
+    )
+    ids = np.fromiter((f[0] for f in filas), dtype=np.int64, count=len(filas))
+    stock = np.fromiter((f[4] + f[5] for f in filas), dtype=np.float64, count=len(filas))
+
+    Y = matriz_diaria(ids, max(historia, dias))
+    vendidos = Y[-dias:].sum(axis=0, dtype=np.float64)
+    pronostico = pronosticar(Y)
+    politica = politica_reposicion(
+        pronostico['pronostico'], pronostico['sigma'], stock,
+        plazo=plazo, cobertura=cobertura, nivel_servicio=nivel_servicio,
+    )
+
+    return {
+        'id': ids,
+        'nombre': [f[1] for f in filas],
+        'codigo': [f[2] for f in filas],
+        'precio': [f[3] for f in filas],
+        'stock': stock,
+        'vendidos': vendidos,
+        'velocidad': vendidos / dias,
+        **pronostico,
+        **politica,
+    }
+
+
+def productos_en_atencion(metricas, top: int = 20):
+    """Retorna hasta `top` filas que requieren reposición, la más urgente primero.
+
+    La urgencia es la menor cobertura en días; a igual cobertura, el mayor
+    pronóstico de demanda.
+    """
+    indices = np.flatnonzero(metricas['atencion'])
+    orden = np.lexsort((-metricas['pronostico'][indices], metricas['dias_cobertura'][indices]))
+    hoy = timezone.localdate()
+    filas = []
+    for i in indices[orden][:top]:
+        cobertura = float(metricas['dias_cobertura'][i])
+        filas.append({
+            'id': int(metricas['id'][i]),
+            'nombre': metricas['nombre'][i],
+            'codigo': metricas['codigo'][i],
+            'precio': str(metricas['precio'][i]),
+            'stock_actual': int(metricas['stock'][i]),
+            'vendidos_periodo': int(metricas['vendidos'][i]),
+            'velocidad_diaria': round(float(metricas['velocidad'][i]), 2),
+            'pronostico_diario': round(float(metricas['pronostico'][i]), 2),
+            'metodo': 'croston' if metricas['intermitente'][i] else 'ses',
+            'stock_seguridad': round(float(metricas['stock_seguridad'][i]), 1),
+            'punto_reorden': round(float(metricas['punto_reorden'][i]), 1),
+            'dias_cobertura': round(cobertura, 1),
+            'fecha_quiebre': str(hoy + timedelta(days=int(cobertura))),
+            'cantidad_reorden': int(metricas['cantidad_reorden'][i]),
+        })
+    return filas
@@ -0,0 +1,450 @@
+"""
+Reservas de stock con vencimiento (carritos de la app móvil).
+
+Una reserva retiene unidades de uno o más productos durante un TTL. El stock
+disponible para terceros es:
+
+    disponible = stock_actual - unidades retenidas por reservas vigentes
+
+Las retenciones no se escriben en la BD: viven en un backend intercambiable,
+en memoria del proceso (desarrollo, un solo worker) o en Redis cuando
+`REDIS_URL` está definido (varios workers). Ambos mantienen el total retenido
+por producto y un índice de vencimientos, y barren las reservas vencidas en
+lotes acotados al inicio de cada operación; `barrer_reservas` permite además
+barrerlas desde un cron.
+
+Cada reserva guarda el id del usuario que la creó; solo ese usuario puede
+consultarla, liberarla o convertirla en venta (ver `ReservaViewSet`).
+
+Convertir una reserva en venta la consume antes de descontar
+(`consumir_reserva`, atómico en ambos backends): de dos checkouts
+concurrentes con la misma reserva solo uno la obtiene. La venta descuenta
+stock con el UPDATE condicional de siempre (`stock.descontar_stock_lote`)
+y, si falla, la reserva se restaura (`restaurar_reserva`).
+
+Todas las rutas que descuentan stock por una venta (checkout, sincronización
+offline, admin y líneas sueltas de la API) respetan lo retenido por las
+reservas vigentes con `verificar_disponible` o restando `retenido`.
+"""
+import heapq
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+from .stock import StockInsuficiente
+
+# Reservas vencidas que se barren como máximo por operación
+LOTE_BARRIDO = 100
+
+
+class StockNoDisponible(StockInsuficiente):
+    """El stock físico alcanza, pero parte está retenida por otras reservas."""
+
+    def __init__(self, producto, cantidad, disponible):
+        self.producto_id = producto.pk
+        self.cantidad = cantidad
+        self.disponible = disponible
+        super(StockInsuficiente, self).__init__(
+            f"Stock insuficiente para {producto.nombre} (disponible: {max(disponible, 0)}, "
+            f"reservado en otros carritos: {producto.stock_actual - disponible})"
+        )
+
+
+class ReservaNoDisponible(ValidationError):
+    """La reserva venció, no existe, es de otro usuario o ya se convirtió en venta."""
+
+    def __init__(self, reserva_id):
+        self.reserva_id = reserva_id
+        super().__init__('Reserva inexistente o vencida')
+
+
+class ReservasEnMemoria:
+    """Backend en memoria del proceso. No se comparte entre workers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reservas = {}                 # id -> (expira, {producto_id: cantidad}, usuario_id)
+        self._retenido = defaultdict(int)   # producto_id -> unidades retenidas
+        self._vencimientos = []             # heap de (expira, id)
+
+    def _barrer(self, ahora, lote):
+        barridas = 0
+        while self._vencimientos and self._vencimientos[0][0] <= ahora and barridas < lote:
+            expira, reserva_id = heapq.heappop(self._vencimientos)
+            reserva = self._reservas.get(reserva_id)
+            # La entrada del heap puede ser de una reserva ya liberada
+            if reserva is None or reserva[0] != expira:
+                continue
+            self._quitar(reserva_id)
+            barridas += 1
+        return barridas
+
+    def _quitar(self, reserva_id):
+        _, items, _ = self._reservas.pop(reserva_id)
+        for pid, n in items.items():
+            self._retenido[pid] -= n
+            if self._retenido[pid] <= 0:
+                del self._retenido[pid]
+        return items
+
+    def reservar(self, reserva_id, items, stock, expira, usuario_id):
+        """Retiene `items` si alcanza `stock - retenido`; si no, retorna el producto que falla."""
+        with self._lock:
+            self._barrer(time.time(), LOTE_BARRIDO)
+            for pid, n in items.items():
+                if self._retenido.get(pid, 0) + n > stock[pid]:
+                    return pid
+            self._agregar(reserva_id, items, expira, usuario_id)
+            return None
+
+    def _agregar(self, reserva_id, items, expira, usuario_id):
+        self._reservas[reserva_id] = (expira, dict(items), usuario_id)
+        heapq.heappush(self._vencimientos, (expira, reserva_id))
+        for pid, n in items.items():
+            self._retenido[pid] += n
+
+    def obtener(self, reserva_id):
+        with self._lock:
+            reserva = self._reservas.get(reserva_id)
+            if reserva is None or reserva[0] <= time.time():
+                return None
+            return reserva[0], dict(reserva[1]), reserva[2]
+
+    def liberar(self, reserva_id):
+        with self._lock:
+            if reserva_id not in self._reservas:
+                return None
+            return self._quitar(reserva_id)
+
+    def consumir(self, reserva_id, usuario_id):
+        """Quita la reserva vigente de `usuario_id` y retorna (expira, items), o None."""
+        with self._lock:
+            reserva = self._reservas.get(reserva_id)
+            if reserva is None or reserva[0] <= time.time() or reserva[2] != usuario_id:
+                return None
+            return reserva[0], self._quitar(reserva_id)
+
+    def restaurar(self, reserva_id, items, expira, usuario_id):
+        """Vuelve a retener una reserva consumida, sin revisar stock (ya estaba retenida)."""
+        with self._lock:
+            if reserva_id not in self._reservas and expira > time.time():
+                self._agregar(reserva_id, items, expira, usuario_id)
+
+    def retenido(self, producto_ids):
+        with self._lock:
+            self._barrer(time.time(), LOTE_BARRIDO)
+            return {pid: self._retenido.get(pid, 0) for pid in producto_ids}
+
+    def barrer(self, lote):
+        with self._lock:
+            return self._barrer(time.time(), lote)
+
+
+# Barre hasta `lote` reservas vencidas: descuenta sus unidades del total retenido
+_LUA_BARRER = """
+local function barrer(p, ahora, lote)
+    local ids = redis.call('ZRANGEBYSCORE', p .. ':vence', '-inf', ahora, 'LIMIT', 0, lote)
+    for _, id in ipairs(ids) do
+        local items = redis.call('HGETALL', p .. ':r:' .. id)
+        for i = 1, #items, 2 do
+            if redis.call('HINCRBY', p .. ':retenido', items[i], -tonumber(items[i + 1])) <= 0 then
+                redis.call('HDEL', p .. ':retenido', items[i])
+            end
+        end
+        redis.call('DEL', p .. ':r:' .. id, p .. ':u:' .. id)
+        redis.call('ZREM', p .. ':vence', id)
+    end
+    return #ids
+end
+"""
+
+# ARGV: prefijo, ahora, lote, id, expira, usuario, luego tríos (producto, cantidad, stock)
+_LUA_RESERVAR = _LUA_BARRER + """
+local p = ARGV[1]
+barrer(p, ARGV[2], tonumber(ARGV[3]))
+for i = 7, #ARGV, 3 do
+    local retenido = tonumber(redis.call('HGET', p .. ':retenido', ARGV[i]) or '0')
+    if retenido + tonumber(ARGV[i + 1]) > tonumber(ARGV[i + 2]) then
+        return ARGV[i]
+    end
+end
+for i = 7, #ARGV, 3 do
+    redis.call('HINCRBY', p .. ':retenido', ARGV[i], ARGV[i + 1])
+    redis.call('HSET', p .. ':r:' .. ARGV[4], ARGV[i], ARGV[i + 1])
+end
+redis.call('SET', p .. ':u:' .. ARGV[4], ARGV[6])
+redis.call('ZADD', p .. ':vence', ARGV[5], ARGV[4])
+return false
+"""
+
+# Quita una reserva y descuenta sus unidades del total retenido; retorna sus items (lista plana)
+_LUA_QUITAR = """
+local function quitar(p, id)
+    local items = redis.call('HGETALL', p .. ':r:' .. id)
+    for i = 1, #items, 2 do
+        if redis.call('HINCRBY', p .. ':retenido', items[i], -tonumber(items[i + 1])) <= 0 then
+            redis.call('HDEL', p .. ':retenido', items[i])
+        end
+    end
+    redis.call('DEL', p .. ':r:' .. id, p .. ':u:' .. id)
+    redis.call('ZREM', p .. ':vence', id)
+    return items
+end
+"""
+
+# ARGV: prefijo, id. Retorna los items liberados (lista plana) o vacío
+_LUA_LIBERAR = _LUA_QUITAR + """
+return quitar(ARGV[1], ARGV[2])
+"""
+
+# ARGV: prefijo, id, ahora, usuario. Retorna {vencimiento, producto, cantidad, ...} o nil si
+# la reserva no está vigente o es de otro usuario: el GETDEL de la reserva completa
+_LUA_CONSUMIR = _LUA_QUITAR + """
+local p = ARGV[1]
+local vence = redis.call('ZSCORE', p .. ':vence', ARGV[2])
+if not vence or tonumber(vence) <= tonumber(ARGV[3]) then
+    return false
+end
+if (redis.call('GET', p .. ':u:' .. ARGV[2]) or '') ~= ARGV[4] then
+    return false
+end
+local r = {vence}
+for _, v in ipairs(quitar(p, ARGV[2])) do
+    r[#r + 1] = v
+end
+return r
+"""
+
+# ARGV: prefijo, id, expira, usuario, luego pares (producto, cantidad)
+_LUA_RESTAURAR = """
+local p = ARGV[1]
+if redis.call('EXISTS', p .. ':r:' .. ARGV[2]) == 1 then
+    return false
+end
+for i = 5, #ARGV, 2 do
+    redis.call('HINCRBY', p .. ':retenido', ARGV[i], ARGV[i + 1])
+    redis.call('HSET', p .. ':r:' .. ARGV[2], ARGV[i], ARGV[i + 1])
+end
+redis.call('SET', p .. ':u:' .. ARGV[2], ARGV[4])
+redis.call('ZADD', p .. ':vence', ARGV[3], ARGV[2])
+return false
+"""
+
+# ARGV: prefijo, ahora, lote, productos...
+_LUA_RETENIDO = _LUA_BARRER + """
+local p = ARGV[1]
+barrer(p, ARGV[2], tonumber(ARGV[3]))
+local r = {}
+for i = 4, #ARGV do
+    r[#r + 1] = redis.call('HGET', p .. ':retenido', ARGV[i]) or '0'
+end
+return r
+"""
+
+_LUA_SOLO_BARRER = _LUA_BARRER + """
+return barrer(ARGV[1], ARGV[2], tonumber(ARGV[3]))
+"""
+
+
+class ReservasRedis:
+    """Backend compartido entre workers. Cada operación es un script Lua atómico.
+
+    Claves: `<prefijo>:retenido` (hash producto -> unidades),
+    `<prefijo>:vence` (zset id -> vencimiento), `<prefijo>:r:<id>` (hash
+    producto -> unidades de esa reserva) y `<prefijo>:u:<id>` (id del
+    usuario dueño).
+    """
+
+    def __init__(self, url, prefijo='tienda:reservas'):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._prefijo = prefijo
+        self._reservar = self._redis.register_script(_LUA_RESERVAR)
+        self._liberar = self._redis.register_script(_LUA_LIBERAR)
+        self._consumir = self._redis.register_script(_LUA_CONSUMIR)
+        self._restaurar = self._redis.register_script(_LUA_RESTAURAR)
+        self._retenido = self._redis.register_script(_LUA_RETENIDO)
+        self._barrer = self._redis.register_script(_LUA_SOLO_BARRER)
+
+    def reservar(self, reserva_id, items, stock, expira, usuario_id):
+        args = [self._prefijo, time.time(), LOTE_BARRIDO, reserva_id, expira, usuario_id or '']
+        for pid, n in items.items():
+            args += [pid, n, stock[pid]]
+        falla = self._reservar(args=args)
+        return int(falla) if falla else None
+
+    def obtener(self, reserva_id):
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.zscore(f'{self._prefijo}:vence', reserva_id)
+        pipe.hgetall(f'{self._prefijo}:r:{reserva_id}')
+        pipe.get(f'{self._prefijo}:u:{reserva_id}')
+        expira, items, usuario = pipe.execute()
+        if expira is None or expira <= time.time() or not items:
+            return None
+        return expira, {int(pid): int(n) for pid, n in items.items()}, int(usuario) if usuario else None
+
+    def liberar(self, reserva_id):
+        plano = self._liberar(args=[self._prefijo, reserva_id])
+        if not plano:
+            return None
+        return {int(plano[i]): int(plano[i + 1]) for i in range(0, len(plano), 2)}
+
+    def consumir(self, reserva_id, usuario_id):
+        plano = self._consumir(args=[self._prefijo, reserva_id, time.time(), usuario_id or ''])
+        if not plano:
+            return None
+        return float(plano[0]), {int(plano[i]): int(plano[i + 1]) for i in range(1, len(plano), 2)}
+
+    def restaurar(self, reserva_id, items, expira, usuario_id):
+        if expira <= time.time():
+            return
+        args = [self._prefijo, reserva_id, expira, usuario_id or '']
+        for pid, n in items.items():
+            args += [pid, n]
+        self._restaurar(args=args)
+
+    def retenido(self, producto_ids):
+        producto_ids = list(producto_ids)
+        if not producto_ids:
+            return {}
+        valores = self._retenido(args=[self._prefijo, time.time(), LOTE_BARRIDO, *producto_ids])
+        return {pid: int(v) for pid, v in zip(producto_ids, valores)}
+
+    def barrer(self, lote):
+        return int(self._barrer(args=[self._prefijo, time.time(), lote]))
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Backend configurado: Redis si hay `REDIS_URL`, si no en memoria."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                url = getattr(settings, 'REDIS_URL', None)
+                _backend = ReservasRedis(url) if url else ReservasEnMemoria()
+    return _backend
+
+
+def set_backend(backend):
+    """Reemplaza el backend (tests o un sustituto local). Retorna el anterior."""
+    global _backend
+    anterior, _backend = _backend, backend
+    return anterior
+
+
+def _agrupar(lineas):
+    cantidades = {}
+    for producto, cantidad in lineas:
+        cantidades[producto.pk] = cantidades.get(producto.pk, 0) + cantidad
+    return cantidades
+
+
+def reservar(lineas, ttl: int = None, usuario=None):
+    """Crea una reserva para `lineas` [(producto, cantidad)] a nombre de `usuario`.
+
+    Los productos deben venir con `slots` precargados si están en modo
+    caliente. Levanta `StockNoDisponible` si algún producto no alcanza
+    descontando lo ya retenido. Retorna {"id", "expira", "items", "usuario"}
+    (`usuario` es el id).
+    """
+    ttl = ttl or settings.RESERVAS_TTL
+    cantidades = _agrupar(lineas)
+    productos = {p.pk: p for p, _ in lineas}
+    stock = {pid: p.stock_actual for pid, p in productos.items()}
+    reserva_id = uuid.uuid4().hex
+    expira = time.time() + ttl
+    usuario_id = usuario.pk if usuario is not None else None
+    falla = get_backend().reservar(reserva_id, cantidades, stock, expira, usuario_id)
+    if falla is not None:
+        retenido = get_backend().retenido([falla])[falla]
+        raise StockNoDisponible(productos[falla], cantidades[falla], stock[falla] - retenido)
+    return {'id': reserva_id, 'expira': expira, 'items': cantidades, 'usuario': usuario_id}
+
+
+def obtener_reserva(reserva_id: str, usuario=None):
+    """Retorna {"id", "expira", "items", "usuario"} de una reserva vigente, o None.
+
+    Con `usuario`, una reserva de otro usuario también retorna None.
+    """
+    reserva = get_backend().obtener(reserva_id)
+    if reserva is None:
+        return None
+    expira, items, usuario_id = reserva
+    if usuario is not None and usuario_id != usuario.pk:
+        return None
+    return {'id': reserva_id, 'expira': expira, 'items': items, 'usuario': usuario_id}
+
+
+def liberar_reserva(reserva_id: str):
+    """Libera una reserva. Retorna sus items, o None si no existía o ya venció."""
+    return get_backend().liberar(reserva_id)
+
+
+def consumir_reserva(reserva_id: str, usuario_id):
+    """Quita atómicamente la reserva vigente de `usuario_id` para convertirla en venta.
+
+    Retorna {"id", "expira", "items", "usuario"}, o None si no existe, venció,
+    es de otro usuario o ya la consumió otro checkout.
+    """
+    consumida = get_backend().consumir(reserva_id, usuario_id)
+    if consumida is None:
+        return None
+    expira, items = consumida
+    return {'id': reserva_id, 'expira': expira, 'items': items, 'usuario': usuario_id}
+
+
+def restaurar_reserva(reserva) -> None:
+    """Vuelve a retener una reserva consumida cuya venta falló (si no venció entretanto)."""
+    get_backend().restaurar(reserva['id'], reserva['items'], reserva['expira'], reserva['usuario'])
+
+
+def disponibilidad(productos):
+    """Retorna {producto_id: (stock, reservado, disponible)} para `productos`."""
+    productos = list(productos)
+    retenido = get_backend().retenido([p.pk for p in productos])
+    resultado = {}
+    for p in productos:
+        stock = p.stock_actual
+        resultado[p.pk] = (stock, retenido[p.pk], stock - retenido[p.pk])
+    return resultado
+
+
+def verificar_disponible(lineas) -> None:
+    """Chequeo consultivo previo a un descuento: no vender lo retenido por reservas.
+
+    `lineas` son (producto, cantidad) con las unidades que se van a
+    descontar. No bloquea nada; la garantía de no sobreventa la sigue dando
+    el UPDATE condicional. La reserva propia de un checkout ya se consumió
+    (`consumir_reserva`), así que no cuenta como retenida. Levanta
+    `StockNoDisponible`.
+    """
+    cantidades = _agrupar(lineas)
+    if not cantidades:
+        return
+    retenido = get_backend().retenido(cantidades)
+    for producto, _ in lineas:
+        ajeno = retenido[producto.pk]
+        if ajeno <= 0:
+            continue
+        disponible = producto.stock_actual - ajeno
+        if disponible < cantidades[producto.pk]:
+            raise StockNoDisponible(producto, cantidades[producto.pk], disponible)
+
+
+def barrer_reservas(lote: int = 500) -> int:
+    """Barre reservas vencidas en lotes de `lote` hasta vaciar. Retorna cuántas."""
+    total = 0
+    while True:
+        barridas = get_backend().barrer(lote)
+        total += barridas
+        if barridas < lote:
+            return total
@@ -0,0 +1,203 @@
+"""
+Analítica de clientes: puntajes RFM y cohortes de adquisición.
+
+RFM (recencia, frecuencia, monto) sale de una sola consulta agrupada por
+cliente sobre `Venta` (usa el `total` materializado, sin unir las líneas),
+con los quintiles calculados en la BD:
+
+    NTILE(5) OVER (ORDER BY MAX(fecha))    -- R: 5 = compró más recientemente
+    NTILE(5) OVER (ORDER BY COUNT(id))     -- F: 5 = más compras
+    NTILE(5) OVER (ORDER BY SUM(total))    -- M: 5 = más gasto
+
+Las cohortes agrupan a cada cliente por el mes de su primera compra y
+cuentan cuántos vuelven a comprar en cada mes siguiente:
+
+    SELECT cohorte, mes, COUNT(*) FROM (
+        SELECT cliente_id, mes, MIN(mes) OVER (PARTITION BY cliente_id) AS cohorte
+        FROM (SELECT DISTINCT cliente_id, <mes de fecha> AS mes FROM tienda_venta ...)
+    ) GROUP BY cohorte, mes
+
+Si el motor no soporta funciones de ventana (SQLite < 3.25) se usa el mismo
+cálculo en Python sobre las filas agregadas. El volumen que llega a Python
+es una fila por cliente (RFM) o por cliente y mes (cohortes), leída con
+`.iterator()`; la vista guarda el resultado en el caché de analíticas.
+"""
+import heapq
+from collections import Counter, defaultdict
+from datetime import date, datetime, time, timedelta
+
+from django.db import connection
+from django.db.models import Count, F, Max, Sum, Window
+from django.db.models.functions import Ntile, TruncMonth
+from django.utils import timezone
+
+from .models import Venta
+from .ventas import filtrar_periodo
+
+SEGMENTOS = ('campeones', 'leales', 'nuevos', 'potenciales', 'en_riesgo', 'hibernando')
+
+
+def segmento(r: int, f: int) -> str:
+    """Segmento del cliente según sus puntajes de recencia y frecuencia (1-5)."""
+    if r >= 4 and f >= 4:
+        return 'campeones'
+    if r >= 3 and f >= 3:
+        return 'leales'
+    if r >= 4:
+        return 'nuevos'
+    if r == 3:
+        return 'potenciales'
+    if f >= 3:
+        return 'en_riesgo'
+    return 'hibernando'
+
+
+def _ntile(filas, clave, n: int = 5):
+    """Equivalente a NTILE(n) OVER (ORDER BY clave, cliente_id) para listas en memoria."""
+    orden = sorted(range(len(filas)), key=lambda i: (clave(filas[i]), filas[i][0]))
+    total = len(filas)
+    base, resto = divmod(total, n)
+    puntajes = [0] * total
+    pos = 0
+    for grupo in range(1, n + 1):
+        tamano = base + (1 if grupo <= resto else 0)
+        for i in orden[pos:pos + tamano]:
+            puntajes[i] = grupo
+        pos += tamano
+    return puntajes
+
+
+def _filas_rfm(ventas):
+    """(cliente_id, rut, ultima, frecuencia, monto, r, f, m) por cliente."""
+    agregados = ventas.values('cliente_id', 'cliente__rut').annotate(
+        ultima=Max('fecha'), frecuencia=Count('id'), monto=Sum('total'),
+    ).order_by()
+    campos = ('cliente_id', 'cliente__rut', 'ultima', 'frecuencia', 'monto')
+    if connection.features.supports_over_clause:
+        desempate = F('cliente_id').asc()
+        return agregados.annotate(
+            r=Window(Ntile(5), order_by=[F('ultima').asc(), desempate]),
+            f=Window(Ntile(5), order_by=[F('frecuencia').asc(), desempate]),
+            m=Window(Ntile(5), order_by=[F('monto').asc(), desempate]),
+        ).values_list(*campos, 'r', 'f', 'm').iterator(chunk_size=5000)
+    filas = list(agregados.values_list(*campos))
+    puntajes = zip(
+        _ntile(filas, lambda x: x[2]), _ntile(filas, lambda x: x[3]), _ntile(filas, lambda x: x[4]),
+    )
+    return (fila + p for fila, p in zip(filas, puntajes))
+
+
+def resumen_rfm(ventas, hasta=None, top: int = 20) -> dict:
+    """Segmentos RFM de los clientes con compras en `ventas`.
+
+    Retorna la cantidad de clientes y el monto por segmento, la matriz de
+    clientes por (R, F) y los `top` clientes de mayor monto con sus
+    puntajes. `hasta` es la fecha de referencia para la recencia en días.
+    """
+    hasta = hasta or timezone.now()
+    segmentos = {s: {'clientes': 0, 'monto': 0} for s in SEGMENTOS}
+    matriz = [[0] * 5 for _ in range(5)]
+    mejores = []  # heap de los `top` de mayor monto
+    total_clientes = 0
+    for cliente_id, rut, ultima, frecuencia, monto, r, f, m in _filas_rfm(ventas):
+        total_clientes += 1
+        s = segmentos[segmento(r, f)]
+        s['clientes'] += 1
+        s['monto'] += monto or 0
+        matriz[r - 1][f - 1] += 1
+        fila = (monto or 0, cliente_id, rut, ultima, frecuencia, r, f, m)
+        if len(mejores) < top:
+            heapq.heappush(mejores, fila)
+        elif fila > mejores[0]:
+            heapq.heapreplace(mejores, fila)
+    mejores.sort(reverse=True)
+    return {
+        'clientes': total_clientes,
+        'segmentos': segmentos,
+        # matriz_rf[r-1][f-1]: clientes con recencia r y frecuencia f
+        'matriz_rf': matriz,
+        'top_clientes': [
+            {
+                'cliente': cliente_id, 'rut': rut, 'recencia_dias': (hasta - ultima).days,
+                'frecuencia': frecuencia, 'monto': monto, 'r': r, 'f': f, 'm': m,
+                'segmento': segmento(r, f),
+            }
+            for monto, cliente_id, rut, ultima, frecuencia, r, f, m in mejores
+        ],
+    }
+
+
+def _mes(valor) -> date:
+    # Fuera del ORM el mes llega como datetime (PostgreSQL) o texto (SQLite)
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    return date.fromisoformat(str(valor)[:10])
+
+
+def _indice_mes(mes: date) -> int:
+    return mes.year * 12 + mes.month - 1
+
+
+def _conteos_cohortes(ventas):
+    """{(cohorte, mes): clientes activos} con cohorte = mes de la primera compra."""
+    meses_cliente = ventas.annotate(mes=TruncMonth('fecha')).values('cliente_id', 'mes').distinct().order_by()
+    if connection.features.supports_over_clause:
+        sql, params = meses_cliente.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT cohorte, mes, COUNT(*) FROM ('
+                ' SELECT cliente_id, mes, MIN(mes) OVER (PARTITION BY cliente_id) AS cohorte'
+                f' FROM ({sql}) meses'
+                ') c GROUP BY cohorte, mes',
+                params,
+            )
+            return {(_mes(c), _mes(m)): n for c, m, n in cursor.fetchall()}
+    conteos = Counter()
+    cohorte_de = {}
+    for cliente_id, mes in meses_cliente.order_by('cliente_id', 'mes').values_list('cliente_id', 'mes').iterator():
+        cohorte = cohorte_de.setdefault(cliente_id, _mes(mes))
+        conteos[(cohorte, _mes(mes))] += 1
+    return conteos
+
+
+def cohortes(ventas, desde, hasta) -> list:
+    """Matriz de retención mensual de las cohortes adquiridas entre `desde` y `hasta`.
+
+    `ventas` debe incluir el historial anterior a `desde` para que la
+    primera compra de cada cliente sea la real; se cortan después de
+    `hasta`. Cada fila trae el tamaño de la cohorte y, por cada mes desde la
+    adquisición, los clientes activos y la fracción retenida.
+    """
+    primer_mes = _indice_mes(desde.replace(day=1))
+    ultimo_mes = _indice_mes(hasta.replace(day=1))
+    por_cohorte = defaultdict(dict)
+    for (cohorte, mes), n in _conteos_cohortes(ventas).items():
+        if primer_mes <= _indice_mes(cohorte) <= ultimo_mes and _indice_mes(mes) <= ultimo_mes:
+            por_cohorte[cohorte][_indice_mes(mes) - _indice_mes(cohorte)] = n
+    filas = []
+    for cohorte in sorted(por_cohorte):
+        activos = por_cohorte[cohorte]
+        tamano = activos.get(0, 0)
+        meses = ultimo_mes - _indice_mes(cohorte) + 1
+        filas.append({
+            'cohorte': cohorte.strftime('%Y-%m'),
+            'clientes': tamano,
+            'activos': [activos.get(k, 0) for k in range(meses)],
+            'retencion': [round(activos.get(k, 0) / tamano, 4) if tamano else 0 for k in range(meses)],
+        })
+    return filas
+
+
+def analitica_clientes(fecha_inicio, fecha_fin, top: int = 20) -> dict:
+    """RFM del periodo [fecha_inicio, fecha_fin] y cohortes adquiridas en él (fechas `date`)."""
+    periodo = filtrar_periodo(Venta.objects.all(), fecha_inicio, fecha_fin)
+    historial = filtrar_periodo(Venta.objects.all(), None, fecha_fin)
+    fin = min(timezone.now(), timezone.make_aware(datetime.combine(fecha_fin + timedelta(days=1), time.min)))
+    return {
+        'fecha_inicio': str(fecha_inicio),
+        'fecha_fin': str(fecha_fin),
+        'rfm': resumen_rfm(periodo, hasta=fin, top=top),
+        'cohortes': cohortes(historial, fecha_inicio, fecha_fin),
+    }
@@ -0,0 +1,309 @@
+"""
+Resúmenes diarios de ventas (VentaDiaria, ProductoDiario, CategoriaDiaria).
+
+Las ventas nuevas no tocan los resúmenes dentro de su transacción: nacen
+con `Venta.resumida = False` y, al confirmarse, `resumir_pendientes` las
+suma en una transacción propia y corta. Así el checkout no bloquea la fila
+del día ni las de (día, producto), y dos ventas concurrentes solo compiten
+por el stock. La fila de `VentaDiaria` hace de candado del día para los
+que escriben resúmenes (`resumir_pendientes`, `ajustar_lineas` y
+`reconstruir`), siempre en orden de fecha, y `Venta.resumida` solo cambia
+con ese candado tomado: una venta cuenta en los resúmenes si y solo si
+está marcada, nunca dos veces.
+
+`resumir_pendientes` toma los días con `SKIP LOCKED`: si otro proceso está
+resumiendo el mismo día no espera, y sus ventas quedan para la siguiente
+pasada (la próxima venta confirmada o el comando `resumir_ventas`, que
+conviene programar cada pocos minutos por si un proceso cae entre el
+commit y el resumen). Las ventas marcadas se cuentan con dos consultas
+agrupadas, igual que en `reconstruir`.
+
+Agregar, editar o quitar líneas de una venta ya resumida
+(`ajustar_lineas`) suma la diferencia bajo el candado del día; si la venta
+todavía no se resumió no hay nada que ajustar: se contará con sus líneas
+finales. Las eliminaciones de ventas completas y las ediciones desde el
+admin marcan el día como sucio y se recalcula completo al confirmar.
+`reconstruir` (y el comando `reconstruir_rollups`) rehace cualquier rango
+desde cero con las ventas ya resumidas.
+
+Al resumir ventas se suman también sus pares de productos a la matriz de
+`canasta.py` (en la misma transacción, así canasta y resúmenes cuentan las
+mismas ventas) y, al confirmar, el ranking de `leaderboard.py`; una
+reconstrucción reinicia el ranking.
+"""
+import threading
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import canasta, leaderboard
+from .analytics_cache import invalidar
+from .models import CategoriaDiaria, ProductoDiario, Venta, VentaDetalle, VentaDiaria
+
+_local = threading.local()
+
+
+def resumir_al_confirmar() -> None:
+    """Resume las ventas nuevas de la transacción actual cuando se confirme.
+
+    La llama la señal de creación de `Venta` (y las altas en bloque, que no
+    emiten señales). N llamadas en la misma transacción cuestan una sola
+    pasada de `resumir_pendientes`.
+    """
+    _local.resumir = True
+    # robust: la venta ya está confirmada; si el resumen falla queda pendiente
+    transaction.on_commit(_resumir_marcadas, robust=True)
+
+
+def _resumir_marcadas():
+    if _local.__dict__.pop('resumir', False):
+        resumir_pendientes()
+
+
+def resumir_pendientes() -> int:
+    """Suma a los resúmenes las ventas confirmadas sin resumir. Retorna cuántas.
+
+    Salta los días (y las ventas) que otra transacción tiene bloqueados; esas
+    quedan para la próxima pasada.
+    """
+    pendientes = Venta.objects.filter(resumida=False).annotate(dia=TruncDate('fecha'))
+    dias = sorted(pendientes.values_list('dia', flat=True).distinct().order_by())
+    if not dias:
+        return 0
+
+    with transaction.atomic():
+        filas_dia = _bloquear_dias(dias, saltar_bloqueados=True)
+        if not filas_dia:
+            return 0
+        inicio, fin = _rango(min(filas_dia), max(filas_dia))
+        ids = list(
+            pendientes.filter(fecha__gte=inicio, fecha__lt=fin, dia__in=list(filas_dia))
+            .select_for_update(skip_locked=True).values_list('pk', flat=True)
+        )
+        if not ids:
+            return 0
+        Venta.objects.filter(pk__in=ids).update(resumida=True)
+        sumas = _Sumas.leer(Venta.objects.filter(pk__in=ids))
+        sumas.aplicar(filas_dia)
+        canasta.acumular_ventas(ids)
+        invalidar()
+    transaction.on_commit(lambda: leaderboard.acumular(sumas.por_producto))
+    return len(ids)
+
+
+def ajustar_lineas(quitadas=(), agregadas=()) -> None:
+    """Aplica a los resúmenes el cambio de líneas de ventas ya resumidas.
+
+    `quitadas` y `agregadas` son listas de (venta, producto, cantidad,
+    precio_unitario): al editar una línea se pasa la versión anterior en
+    `quitadas` y la nueva en `agregadas`; al crearla o borrarla, solo una de
+    las dos. Con el candado de los días tomado se suma la diferencia de las
+    ventas ya resumidas y se borran las filas de producto y categoría que
+    quedan sin líneas; las ventas pendientes se saltan. Llamar dentro de la
+    transacción que modifica las líneas; la canasta de `canasta.py` la
+    maneja `canasta.marcar_venta`.
+    """
+    cambios = [(venta, linea, 1) for venta, *linea in agregadas] + [(venta, linea, -1) for venta, *linea in quitadas]
+    dias = sorted({timezone.localdate(venta.fecha) for venta, *_ in cambios})
+    if not dias:
+        return
+
+    with transaction.atomic():
+        # Las ventas pendientes no tienen fila del día, o esta no las cuenta
+        filas_dia = _bloquear_dias(dias, crear=False)
+        resumidas = set(
+            Venta.objects.filter(pk__in={venta.pk for venta, *_ in cambios}, resumida=True)
+            .values_list('pk', flat=True)
+        )
+        diferencia = _Sumas()
+        for venta, (producto, cantidad, precio_unitario), signo in cambios:
+            if venta.pk in resumidas:
+                diferencia.linea(timezone.localdate(venta.fecha), producto, cantidad, precio_unitario, signo)
+        if not diferencia.por_dia:
+            return
+        diferencia.aplicar(filas_dia)
+        invalidar()
+    transaction.on_commit(lambda: leaderboard.acumular(diferencia.por_producto))
+
+
+class _Sumas:
+    """Totales (o diferencias) por día, por (día, producto) y por (día, categoría)."""
+
+    def __init__(self):
+        self.por_dia, self.por_producto, self.por_categoria = {}, {}, {}
+
+    def dia(self, dia):
+        # ventas, unidades, ingresos, lineas
+        return self.por_dia.setdefault(dia, [0, 0, Decimal('0'), 0])
+
+    def linea(self, dia, producto, cantidad, precio_unitario, signo=1):
+        # Un precio nulo no suma ingresos, como en el Sum() de `leer`
+        self._sumar(dia, producto.pk, producto.categoria_id, signo * cantidad,
+                    signo * (precio_unitario or Decimal('0')) * cantidad, signo)
+
+    def _sumar(self, dia, producto_id, categoria_id, unidades, ingresos, lineas):
+        d = self.dia(dia)
+        d[1] += unidades
+        d[2] += ingresos
+        d[3] += lineas
+        filas = [self.por_producto.setdefault((dia, producto_id), [0, Decimal('0'), 0])]
+        if categoria_id:
+            filas.append(self.por_categoria.setdefault((dia, categoria_id), [0, Decimal('0'), 0]))
+        for fila in filas:
+            fila[0] += unidades
+            fila[1] += ingresos
+            fila[2] += lineas
+
+    @classmethod
+    def leer(cls, ventas):
+        """Totales de las ventas del queryset `ventas`, con dos consultas agrupadas."""
+        sumas = cls()
+        por_dia = ventas.annotate(dia=TruncDate('fecha')).values('dia').annotate(n=Count('id')).order_by()
+        for dia, n in por_dia.values_list('dia', 'n'):
+            sumas.dia(dia)[0] += n
+        lineas = (
+            VentaDetalle.objects.filter(venta__in=ventas)
+            .annotate(dia=TruncDate('venta__fecha'))
+            .values('dia', 'producto_id', 'producto__categoria_id')
+            .annotate(
+                unidades=Sum('cantidad'),
+                ingresos=Sum(F('cantidad') * F('precio_unitario')),
+                lineas=Count('id'),
+            ).order_by()
+        )
+        for r in lineas:
+            sumas._sumar(r['dia'], r['producto_id'], r['producto__categoria_id'],
+                         r['unidades'], r['ingresos'] or Decimal('0'), r['lineas'])
+        return sumas
+
+    def aplicar(self, filas_dia):
+        """Suma las diferencias a los resúmenes. `filas_dia` son las filas del día ya bloqueadas.
+
+        Lee las filas de producto y categoría afectadas, las actualiza en
+        memoria y las escribe en bloque: el candado del día las protege.
+        """
+        for dia, (ventas, unidades, ingresos, lineas) in self.por_dia.items():
+            fila = filas_dia[dia]
+            fila.ventas += ventas
+            fila.unidades += unidades
+            fila.ingresos += ingresos
+            fila.lineas += lineas
+        VentaDiaria.objects.bulk_update([filas_dia[dia] for dia in self.por_dia],
+                                        ['ventas', 'unidades', 'ingresos', 'lineas'])
+        for modelo, campo, diferencias in (
+            (ProductoDiario, 'producto_id', self.por_producto),
+            (CategoriaDiaria, 'categoria_id', self.por_categoria),
+        ):
+            if not diferencias:
+                continue
+            existentes = {
+                (fila.fecha, getattr(fila, campo)): fila
+                for fila in modelo.objects.filter(fecha__in={dia for dia, _ in diferencias},
+                                                  **{f'{campo}__in': {clave for _, clave in diferencias}})
+            }
+            nuevas, cambiadas, vacias = [], [], []
+            for (dia, clave), (unidades, ingresos, lineas) in diferencias.items():
+                fila = existentes.get((dia, clave)) or modelo(fecha=dia, **{campo: clave})
+                fila.unidades += unidades
+                fila.ingresos += ingresos
+                fila.lineas += lineas
+                if fila.lineas <= 0:
+                    if fila.pk:
+                        vacias.append(fila.pk)
+                elif fila.pk:
+                    cambiadas.append(fila)
+                else:
+                    nuevas.append(fila)
+            modelo.objects.bulk_create(nuevas)
+            modelo.objects.bulk_update(cambiadas, ['unidades', 'ingresos', 'lineas'])
+            modelo.objects.filter(pk__in=vacias).delete()
+
+
+def marcar_dia(fecha) -> None:
+    """Marca el día de `fecha` para recalcularlo al confirmar la transacción.
+
+    Para eliminaciones de ventas ya resumidas y ediciones desde el admin.
+    El primer callback que corre tras el commit reconstruye todos los días
+    marcados y los siguientes no hacen nada, así N marcas del mismo día
+    cuestan una sola reconstrucción.
+    """
+    pendientes = _local.__dict__.setdefault('dias', set())
+    pendientes.add(timezone.localdate(fecha))
+    transaction.on_commit(_reconstruir_pendientes)
+
+
+def _reconstruir_pendientes():
+    dias = _local.__dict__.pop('dias', None) or set()
+    for dia in sorted(dias):
+        reconstruir(dia, dia)
+
+
+def _rango(desde, hasta):
+    inicio = timezone.make_aware(datetime.combine(desde, time.min))
+    fin = timezone.make_aware(datetime.combine(hasta + timedelta(days=1), time.min))
+    return inicio, fin
+
+
+def reconstruir(desde, hasta) -> int:
+    """Recalcula desde cero los resúmenes de los días [desde, hasta].
+
+    Todo en una transacción: bloquea las filas de `VentaDiaria` del rango
+    (creándolas vacías si faltan), relee las ventas ya resumidas con dos
+    consultas agrupadas y reemplaza las filas. Las pendientes las suma
+    después `resumir_pendientes`. Retorna la cantidad de filas de producto
+    escritas.
+    """
+    dias = [desde + timedelta(days=n) for n in range((hasta - desde).days + 1)]
+    with transaction.atomic():
+        filas_dia = _bloquear_dias(dias)
+        escritas = _recalcular(desde, hasta, filas_dia)
+        invalidar()
+    # El ranking incremental ya no coincide con los resúmenes: recargarlo
+    transaction.on_commit(leaderboard.reiniciar)
+    return escritas
+
+
+def _bloquear_dias(dias, crear=True, saltar_bloqueados=False) -> dict:
+    """Filas de `VentaDiaria` de `dias` bloqueadas (SELECT ... FOR UPDATE, en orden), por fecha.
+
+    `crear` inserta vacías las que falten; `saltar_bloqueados` omite las que
+    otra transacción tiene tomadas en vez de esperarlas.
+    """
+    if crear:
+        VentaDiaria.objects.bulk_create([VentaDiaria(fecha=dia) for dia in dias], ignore_conflicts=True,
+                                        batch_size=1000)
+    return {
+        fila.fecha: fila
+        for fila in VentaDiaria.objects.select_for_update(skip_locked=saltar_bloqueados)
+        .filter(fecha__in=dias).order_by('fecha')
+    }
+
+
+def _recalcular(desde, hasta, filas_dia) -> int:
+    inicio, fin = _rango(desde, hasta)
+    sumas = _Sumas.leer(Venta.objects.filter(fecha__gte=inicio, fecha__lt=fin, resumida=True))
+
+    for fila in filas_dia.values():
+        fila.ventas, fila.unidades, fila.ingresos, fila.lineas = sumas.por_dia.get(fila.fecha, (0, 0, Decimal('0'), 0))
+    productos = [
+        ProductoDiario(fecha=dia, producto_id=pid, unidades=u, ingresos=i, lineas=n)
+        for (dia, pid), (u, i, n) in sumas.por_producto.items()
+    ]
+    categorias = [
+        CategoriaDiaria(fecha=dia, categoria_id=cid, unidades=u, ingresos=i, lineas=n)
+        for (dia, cid), (u, i, n) in sumas.por_categoria.items()
+    ]
+
+    # Las filas del día se actualizan en su lugar (siguen bloqueadas); los días sin ventas no quedan
+    con_datos = [f for f in filas_dia.values() if f.ventas or f.lineas]
+    VentaDiaria.objects.bulk_update(con_datos, ['ventas', 'unidades', 'ingresos', 'lineas'], batch_size=1000)
+    VentaDiaria.objects.filter(pk__in=[f.pk for f in filas_dia.values() if not (f.ventas or f.lineas)]).delete()
+    for modelo in (ProductoDiario, CategoriaDiaria):
+        modelo.objects.filter(fecha__gte=desde, fecha__lte=hasta).delete()
+    ProductoDiario.objects.bulk_create(productos, batch_size=1000)
+    CategoriaDiaria.objects.bulk_create(categorias, batch_size=1000)
+    return len(productos)
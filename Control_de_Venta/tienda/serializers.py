@@ -1,6 +1,9 @@
 from django.contrib.auth.models import Group, User
+from django.db import transaction
 from rest_framework import serializers
 from .models import Cliente, Producto, Venta, VentaDetalle, ChatMessage, ImageAnalysis, Categoria
+from .stock import fijar_stock, guardar_sin_stock
+from .ventas import normalizar_rut
 
 class ClienteSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
@@ -10,7 +13,7 @@ class ClienteSerializer(serializers.HyperlinkedModelSerializer):
 class CategoriaSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Categoria
-        fields = ["url", "id", "nombre", "descripcion", "activa"]
+        fields = ["url", "id", "nombre", "descripcion", "activa", "stock_minimo"]
 
 class ProductoSerializer(serializers.HyperlinkedModelSerializer):
     categoria = serializers.PrimaryKeyRelatedField(queryset=Categoria.objects.all(), required=False, allow_null=True)
@@ -18,8 +21,10 @@ class ProductoSerializer(serializers.HyperlinkedModelSerializer):
     # Alias de solo lectura para compatibilidad con app móvil
     name = serializers.CharField(source='nombre', read_only=True)
     code = serializers.CharField(source='codigo', read_only=True)
-    stock = serializers.IntegerField(source='cantidad', read_only=True)
+    stock = serializers.IntegerField(source='stock_actual', read_only=True)
     price = serializers.SerializerMethodField()
+    # null: se hereda el umbral de la categoría
+    stock_minimo = serializers.IntegerField(min_value=0, required=False, allow_null=True)
     
     class Meta:
         model = Producto
@@ -27,10 +32,29 @@ class ProductoSerializer(serializers.HyperlinkedModelSerializer):
             "url", "id",
             # Campos originales
             "nombre", "codigo", "cantidad", "precio", "categoria", "categoria_nombre", "descripcion",
+            "stock_minimo", "stock_bajo",
             # Aliases para clientes móviles
             "name", "code", "stock", "price",
         ]
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # En modo caliente `cantidad` en BD es solo la parte no repartida en slots
+        data['cantidad'] = instance.stock_actual
+        return data
+
+    def update(self, instance, validated_data):
+        # El stock se fija con el servicio (ajuste en el libro), nunca con save() directo
+        cantidad = validated_data.pop('cantidad', None)
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        with transaction.atomic():
+            guardar_sin_stock(instance)
+            if cantidad is not None:
+                fijar_stock(instance.pk, cantidad)
+        instance.refresh_from_db(fields=['cantidad', 'stock_bajo'])
+        return instance
+
     def get_price(self, obj):
         # Mantener el mismo formato que "precio" (string con 2 decimales)
         try:
@@ -48,7 +72,54 @@ class VentaSerializer(serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = Venta
-        fields = ["url", "cliente", "fecha", "stock_actualizado", "detalles"]
+        fields = ["url", "cliente", "fecha", "stock_actualizado", "total", "items", "detalles"]
+        read_only_fields = ["total", "items"]
+
+
+class CheckoutLineaSerializer(serializers.Serializer):
+    """Línea de checkout: producto por id o por código, y cantidad."""
+    producto = serializers.IntegerField(required=False)
+    codigo = serializers.CharField(required=False, allow_blank=False)
+    cantidad = serializers.IntegerField(min_value=1)
+
+    def validate(self, attrs):
+        if not attrs.get('producto') and not attrs.get('codigo'):
+            raise serializers.ValidationError('Cada línea requiere "producto" (id) o "codigo".')
+        return attrs
+
+
+class CheckoutSerializer(serializers.Serializer):
+    """Venta multi-línea: RUT del cliente y N líneas, o una reserva a convertir."""
+    rut = serializers.CharField(max_length=12)
+    lineas = CheckoutLineaSerializer(many=True, allow_empty=False, required=False)
+    reserva = serializers.CharField(max_length=32, required=False)
+
+    def validate_rut(self, value):
+        rut = normalizar_rut(value)
+        if not rut:
+            raise serializers.ValidationError(
+                'RUT inválido. Use 10 dígitos seguidos o formato 8 dígitos-VD (ej. 22760900-7).'
+            )
+        return rut
+
+    def validate(self, attrs):
+        if not attrs.get('lineas') and not attrs.get('reserva'):
+            raise serializers.ValidationError('Se requiere "lineas" o "reserva".')
+        return attrs
+
+
+class VentaSyncSerializer(CheckoutSerializer):
+    """Venta registrada offline por un POS, con su clave de idempotencia."""
+    lineas = CheckoutLineaSerializer(many=True, allow_empty=False)
+    reserva = None
+    clave = serializers.CharField(max_length=64)
+    fecha = serializers.DateTimeField(required=False)
+
+
+class ReservaSerializer(serializers.Serializer):
+    """Reserva de stock con vencimiento: N líneas y TTL opcional en segundos."""
+    lineas = CheckoutLineaSerializer(many=True, allow_empty=False)
+    ttl = serializers.IntegerField(min_value=30, max_value=24 * 3600, required=False)
 
 
 class UserSerializer(serializers.HyperlinkedModelSerializer):
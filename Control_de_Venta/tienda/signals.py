@@ -1,8 +1,14 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
 
-from .models import Producto, Venta
+from .analytics_cache import invalidar
+from .canasta import marcar_venta
+from .chat_cache import invalidar_catalogo
+from .models import Categoria, MovimientoStock, Producto, Venta, VentaDetalle
 from .notifications import send_notification
+from .rollups import marcar_dia, resumir_al_confirmar
+from .stock import revisar_umbrales
 
 
 @receiver(post_save, sender=Producto)
@@ -20,6 +26,29 @@ def notify_producto_created(sender, instance: Producto, created: bool, **kwargs)
         )
 
 
+@receiver(post_save, sender=Producto)
+def registrar_saldo_inicial(sender, instance: Producto, created: bool, **kwargs):
+    # El stock con que nace un producto es su primer saldo en el libro de movimientos
+    if created and instance.cantidad:
+        MovimientoStock.objects.create(producto=instance, tipo=MovimientoStock.SALDO, cantidad=instance.cantidad)
+
+
+@receiver(post_save, sender=Producto)
+def marcar_stock_bajo_inicial(sender, instance: Producto, created: bool, **kwargs):
+    # Un producto que nace bajo su umbral queda marcado sin aviso: no cruzó el umbral
+    if created:
+        instance.stock_bajo = instance.pk in revisar_umbrales([instance.pk], notificar=False)
+
+
+@receiver(post_save, sender=Categoria)
+def revisar_umbrales_categoria(sender, instance: Categoria, created: bool, **kwargs):
+    # Los productos sin umbral propio heredan el de la categoría
+    if not created:
+        revisar_umbrales(
+            instance.productos.filter(stock_minimo__isnull=True).values_list('pk', flat=True)
+        )
+
+
 @receiver(post_save, sender=Venta)
 def notify_venta_created(sender, instance: Venta, created: bool, **kwargs):
     if created:
@@ -27,12 +56,51 @@ def notify_venta_created(sender, instance: Venta, created: bool, **kwargs):
             cliente_nombre = getattr(instance.cliente, "nombre", "Cliente") if hasattr(instance, "cliente") else "Cliente"
         except Exception:
             cliente_nombre = "Cliente"
-        total = getattr(instance, "total", None)
         payload = {
             "type": "venta_created",
             "title": "Nueva venta registrada",
             "cliente": cliente_nombre,
+            "total": float(instance.total),
+            "items": instance.items,
         }
-        if total is not None:
-            payload["total"] = float(total)
-        send_notification(payload)
+        # Notificar solo si la venta se confirma (un checkout sin stock la revierte)
+        transaction.on_commit(lambda: send_notification(payload))
+
+
+@receiver(post_save, sender=Venta)
+def resumir_venta_nueva(sender, instance: Venta, created: bool, **kwargs):
+    # Fuera de la transacción de la venta: los resúmenes se suman al confirmar
+    if created:
+        resumir_al_confirmar()
+
+
+@receiver(pre_delete, sender=Venta)
+def descontar_canasta_venta_eliminada(sender, instance: Venta, **kwargs):
+    # Antes del borrado en cascada de las líneas: se necesita la canasta que se resta
+    marcar_venta(instance.pk)
+
+
+@receiver(post_delete, sender=Venta)
+def recalcular_dia_venta_eliminada(sender, instance: Venta, **kwargs):
+    # Los resúmenes pueden incluir la venta: recalcular su día al confirmar
+    marcar_dia(instance.fecha)
+
+
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+@receiver(post_save, sender=Venta)
+@receiver(post_delete, sender=Venta)
+@receiver(post_save, sender=VentaDetalle)
+@receiver(post_delete, sender=VentaDetalle)
+def invalidar_analiticas(sender, **kwargs):
+    # Las escrituras en bloque (sincronización, resúmenes) invalidan por su cuenta
+    invalidar()
+
+
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+@receiver(post_save, sender=Categoria)
+@receiver(post_delete, sender=Categoria)
+def invalidar_chat(sender, **kwargs):
+    # Las respuestas cacheadas del chat citan nombres, precios y categorías
+    invalidar_catalogo()
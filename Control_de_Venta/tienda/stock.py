@@ -0,0 +1,455 @@
+"""
+Servicio de mutación de stock.
+
+Todas las rutas de escritura (vista web, admin y API) descuentan o devuelven
+stock a través de estas funciones. El descuento se hace con un único UPDATE
+condicional:
+
+    UPDATE tienda_producto SET cantidad = cantidad - n
+    WHERE id = ? AND cantidad >= n
+
+de modo que no hay lectura previa en Python ni SELECT ... FOR UPDATE; el
+UPDATE igual bloquea la fila hasta el commit. Si ninguna fila cumple la
+condición, el stock no alcanzaba y se levanta `StockInsuficiente`. El CHECK
+`producto_cantidad_no_negativa` en la BD actúa como respaldo ante cualquier
+escritura que no pase por aquí.
+
+Cada mutación agrega además su fila en el libro `MovimientoStock` dentro de
+la misma transacción, así `Producto.cantidad` (saldo materializado) y la
+suma de los movimientos coinciden siempre. El libro es historial y
+auditoría, no la vía de escritura: la venta sigue necesitando el UPDATE
+condicional sobre el saldo para no vender de más, así que el INSERT se suma
+a ese UPDATE y no quita la contención sobre la fila del producto.
+
+Esa contención se reparte con el modo caliente (`Producto.slots_stock > 0`):
+el stock vive en `StockSlot`, el descuento elige un slot al azar y el saldo
+es la suma de `cantidad` y los slots.
+
+Al confirmar cada mutación `revisar_umbrales` actualiza `Producto.stock_bajo`
+y, si el producto acaba de quedar bajo su `stock_minimo`, envía una
+notificación `stock_bajo` por WebSocket una sola vez (hasta que se
+reponga). La revisión corre fuera de la transacción de la venta
+(`revisar_al_confirmar`): su lectura de stock y umbral y el UPDATE de
+`stock_bajo` no alargan el bloqueo de la fila del producto. Solo ese
+cruce de umbral sube la versión del catálogo del caché del chat: las
+respuestas cacheadas citan el estado de stock bajo, no la cantidad exacta,
+así una venta común no descarta el caché.
+"""
+import random
+import threading
+from datetime import timedelta
+from functools import partial
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .chat_cache import invalidar_catalogo
+from .models import STOCK_MINIMO_DEFECTO, MovimientoStock, Producto, StockSlot
+from .notifications import send_notification
+
+_local = threading.local()
+
+
+class StockInsuficiente(ValidationError):
+    """Se levanta cuando el descuento condicional no encuentra stock suficiente."""
+
+    def __init__(self, producto_id, cantidad):
+        self.producto_id = producto_id
+        self.cantidad = cantidad
+        prod = Producto.objects.filter(pk=producto_id).prefetch_related('slots').first()
+        if prod:
+            mensaje = f"Stock insuficiente para {prod.nombre} (disponible: {prod.stock_actual})"
+        else:
+            mensaje = f"Producto {producto_id} no encontrado"
+        super().__init__(mensaje)
+
+
+def descontar_stock(producto_id: int, cantidad: int, tipo: str = MovimientoStock.VENTA, venta=None) -> None:
+    """Descuenta `cantidad` unidades con un UPDATE condicional.
+
+    Levanta `StockInsuficiente` si el producto no tiene stock suficiente.
+    Debe llamarse dentro de la misma transacción que registra la venta para
+    que un error posterior revierta también el descuento.
+    """
+    if cantidad <= 0:
+        return
+    with transaction.atomic():
+        filas = Producto.objects.filter(pk=producto_id, slots_stock=0, cantidad__gte=cantidad).update(
+            cantidad=F('cantidad') - cantidad
+        )
+        if filas == 0:
+            # Puede ser un producto en modo caliente: intentar en sus slots
+            slots = Producto.objects.filter(pk=producto_id).values_list('slots_stock', flat=True).first()
+            if not slots or not _descontar_en_slots(producto_id, cantidad):
+                raise StockInsuficiente(producto_id, cantidad)
+        MovimientoStock.objects.create(producto_id=producto_id, tipo=tipo, cantidad=-cantidad, venta=venta)
+        revisar_al_confirmar([producto_id])
+
+
+def devolver_stock(producto_id: int, cantidad: int, tipo: str = MovimientoStock.DEVOLUCION, venta=None) -> None:
+    """Devuelve `cantidad` unidades al producto (devoluciones, líneas eliminadas, reposiciones)."""
+    if cantidad <= 0:
+        return
+    with transaction.atomic():
+        # En modo caliente la devolución va a un slot al azar para no concentrar escrituras
+        slots = Producto.objects.filter(pk=producto_id).values_list('slots_stock', flat=True).first()
+        if slots:
+            StockSlot.objects.filter(producto_id=producto_id, slot=random.randrange(slots)).update(
+                cantidad=F('cantidad') + cantidad
+            )
+        else:
+            Producto.objects.filter(pk=producto_id).update(cantidad=F('cantidad') + cantidad)
+        MovimientoStock.objects.create(producto_id=producto_id, tipo=tipo, cantidad=cantidad, venta=venta)
+        revisar_al_confirmar([producto_id])
+
+
+def ajustar_stock(producto_id: int, delta: int, tipo: str = None, venta=None) -> None:
+    """Aplica un delta con signo: negativo descuenta, positivo devuelve.
+
+    Sin `tipo` explícito, un delta negativo se registra como venta y uno
+    positivo como devolución.
+    """
+    if delta < 0:
+        descontar_stock(producto_id, -delta, tipo=tipo or MovimientoStock.VENTA, venta=venta)
+    elif delta > 0:
+        devolver_stock(producto_id, delta, tipo=tipo or MovimientoStock.DEVOLUCION, venta=venta)
+
+
+def fijar_stock(producto_id: int, cantidad: int) -> None:
+    """Fija el stock a un valor absoluto (formulario de edición, admin, API).
+
+    Registra la diferencia como un movimiento de tipo ajuste para que el
+    libro siga cuadrando con el saldo.
+    """
+    if cantidad < 0:
+        raise ValidationError('La cantidad no puede ser negativa.')
+    with transaction.atomic():
+        fila = Producto.objects.select_for_update().filter(pk=producto_id).values_list('cantidad', 'slots_stock').first()
+        if fila is None:
+            return
+        actual, slots = fila
+        if slots:
+            # Modo caliente: repartir el nuevo total entre los slots
+            en_slots = list(StockSlot.objects.select_for_update().filter(producto_id=producto_id).order_by('slot'))
+            actual += sum(s.cantidad for s in en_slots)
+            if actual == cantidad:
+                return
+            for s, parte in zip(en_slots, _repartir(cantidad, len(en_slots))):
+                s.cantidad = parte
+            StockSlot.objects.bulk_update(en_slots, ['cantidad'])
+            Producto.objects.filter(pk=producto_id).update(cantidad=0)
+        else:
+            if actual == cantidad:
+                return
+            Producto.objects.filter(pk=producto_id).update(cantidad=cantidad)
+        MovimientoStock.objects.create(producto_id=producto_id, tipo=MovimientoStock.AJUSTE, cantidad=cantidad - actual)
+        revisar_al_confirmar([producto_id])
+
+
+def guardar_sin_stock(producto: Producto) -> None:
+    """Guarda los demás campos de un producto existente sin tocar `cantidad`.
+
+    Evita que un formulario abierto hace rato pise el stock descontado por
+    ventas concurrentes; los cambios de stock van por `fijar_stock`. Si
+    cambió `stock_minimo`, el estado de stock bajo se revisa al confirmar.
+    """
+    campos = [
+        f.attname for f in Producto._meta.concrete_fields
+        if not f.primary_key and f.name not in ('cantidad', 'slots_stock', 'stock_bajo')
+    ]
+    with transaction.atomic():
+        producto.save(update_fields=campos)
+        revisar_al_confirmar([producto.pk])
+
+
+def stock_con_slots(productos):
+    """Anota `stock` (cantidad más la suma de los slots) sobre un queryset de productos."""
+    en_slots = (
+        StockSlot.objects.filter(producto=OuterRef('pk')).values('producto')
+        .annotate(s=Sum('cantidad')).values('s')
+    )
+    return productos.annotate(stock=F('cantidad') + Coalesce(Subquery(en_slots), Value(0)))
+
+
+def umbral_stock():
+    """Expresión del umbral efectivo: el del producto, el de su categoría o el por defecto."""
+    return Coalesce('stock_minimo', 'categoria__stock_minimo', Value(STOCK_MINIMO_DEFECTO))
+
+
+def revisar_al_confirmar(producto_ids) -> None:
+    """Revisa los umbrales de `producto_ids` cuando se confirme la transacción.
+
+    Las mutaciones de stock la llaman en vez de `revisar_umbrales`. N
+    llamadas en la misma transacción cuestan una sola revisión.
+    """
+    _local.__dict__.setdefault('umbrales', set()).update(producto_ids)
+    # robust: el stock ya está confirmado; un error aquí no debe romper la venta
+    transaction.on_commit(_revisar_pendientes, robust=True)
+
+
+def _revisar_pendientes():
+    producto_ids = _local.__dict__.pop('umbrales', None)
+    if producto_ids:
+        revisar_umbrales(producto_ids)
+
+
+def revisar_umbrales(producto_ids, notificar: bool = True) -> set:
+    """Actualiza `stock_bajo` de los productos y avisa los que cruzaron su umbral.
+
+    Una lectura de (stock, umbral, estado) por llamada; solo se escriben los
+    productos cuyo estado cambia. El paso a stock bajo es un UPDATE
+    condicional sobre `stock_bajo=False`: entre revisiones concurrentes solo
+    una lo gana, así la notificación sale una vez (y al confirmar, si se
+    llama dentro de una transacción).
+    Volver a quedar en o sobre el umbral rearma el aviso. Retorna los ids
+    que quedaron bajo su umbral.
+
+    Si algún producto cruzó su umbral (en cualquier sentido) invalida las
+    respuestas del chat, que citan ese estado (`chat_cache`).
+    """
+    filas = list(
+        stock_con_slots(Producto.objects.filter(pk__in=set(producto_ids)))
+        .annotate(umbral=umbral_stock())
+        .values_list('pk', 'nombre', 'codigo', 'stock', 'umbral', 'stock_bajo')
+    )
+    repuestos = [pk for pk, _, _, stock, minimo, bajo in filas if bajo and stock >= minimo]
+    cruzaron = bool(repuestos)
+    if repuestos:
+        Producto.objects.filter(pk__in=repuestos).update(stock_bajo=False)
+    for pk, nombre, codigo, stock, minimo, bajo in filas:
+        if bajo or stock >= minimo:
+            continue
+        if not Producto.objects.filter(pk=pk, stock_bajo=False).update(stock_bajo=True):
+            continue
+        cruzaron = True
+        if notificar:
+            transaction.on_commit(partial(send_notification, {
+                "type": "stock_bajo",
+                "title": "Stock bajo",
+                "producto": nombre,
+                "codigo": codigo,
+                "stock": stock,
+                "stock_minimo": minimo,
+            }))
+    if cruzaron:
+        invalidar_catalogo()
+    return {pk for pk, _, _, stock, minimo, _ in filas if stock < minimo}
+
+
+def _repartir(total: int, partes: int):
+    """Reparte `total` en `partes` enteros lo más parejos posible."""
+    base, resto = divmod(total, partes)
+    return [base + (1 if i < resto else 0) for i in range(partes)]
+
+
+def _descontar_en_slots(producto_id: int, cantidad: int) -> bool:
+    """Descuenta de los slots de un producto caliente. Retorna False si no alcanza.
+
+    Camino rápido: UPDATE condicional sobre un slot al azar que tenga stock,
+    probando los demás si otro checkout lo vació antes. Camino lento, solo
+    cuando ningún slot alcanza por sí solo (fin de stock): bloquear la fila
+    base y los slots y drenarlos en orden.
+    """
+    candidatos = [
+        slot for slot, disponible in
+        StockSlot.objects.filter(producto_id=producto_id).values_list('slot', 'cantidad')
+        if disponible >= cantidad
+    ]
+    random.shuffle(candidatos)
+    for slot in candidatos:
+        if StockSlot.objects.filter(producto_id=producto_id, slot=slot, cantidad__gte=cantidad).update(
+            cantidad=F('cantidad') - cantidad
+        ):
+            return True
+
+    base = Producto.objects.select_for_update().get(pk=producto_id)
+    en_slots = list(StockSlot.objects.select_for_update().filter(producto_id=producto_id).order_by('slot'))
+    if base.cantidad + sum(s.cantidad for s in en_slots) < cantidad:
+        return False
+    pendiente = cantidad
+    for s in en_slots:
+        tomado = min(s.cantidad, pendiente)
+        s.cantidad -= tomado
+        pendiente -= tomado
+    StockSlot.objects.bulk_update(en_slots, ['cantidad'])
+    if pendiente:
+        Producto.objects.filter(pk=producto_id).update(cantidad=F('cantidad') - pendiente)
+    return True
+
+
+def activar_modo_caliente(producto_id: int, slots: int) -> None:
+    """Reparte el stock del producto en `slots` contadores; 0 vuelve al modo normal.
+
+    El total no cambia, así que no se registra movimiento en el libro.
+    """
+    with transaction.atomic():
+        producto = Producto.objects.select_for_update().get(pk=producto_id)
+        en_slots = list(StockSlot.objects.select_for_update().filter(producto_id=producto_id))
+        total = producto.cantidad + sum(s.cantidad for s in en_slots)
+        StockSlot.objects.filter(producto_id=producto_id).delete()
+        if slots > 0:
+            StockSlot.objects.bulk_create([
+                StockSlot(producto_id=producto_id, slot=i, cantidad=parte)
+                for i, parte in enumerate(_repartir(total, slots))
+            ])
+            Producto.objects.filter(pk=producto_id).update(cantidad=0, slots_stock=slots)
+        else:
+            Producto.objects.filter(pk=producto_id).update(cantidad=total, slots_stock=0)
+
+
+def descontar_stock_lote(cantidades: dict, venta=None, movimientos=None) -> None:
+    """Descuenta varios productos en un único UPDATE condicional.
+
+    `cantidades` mapea producto_id -> unidades. La sentencia es:
+
+        UPDATE ... SET cantidad = cantidad - CASE id WHEN .. THEN .. END
+        WHERE (id = a AND cantidad >= na) OR (id = b AND cantidad >= nb) ...
+
+    Si alguna fila no cumple su condición se revierte el lote completo y se
+    levanta `StockInsuficiente` con el primer producto sin stock. Los
+    productos en modo caliente se descuentan aparte en sus slots.
+
+    Por defecto se inserta un movimiento de venta por producto; quien
+    necesite más detalle (p. ej. un movimiento por venta al sincronizar)
+    puede pasar su propia lista en `movimientos`.
+    """
+    cantidades = {pid: n for pid, n in cantidades.items() if n > 0}
+    if not cantidades:
+        return
+    if movimientos is None:
+        movimientos = [
+            MovimientoStock(producto_id=pid, tipo=MovimientoStock.VENTA, cantidad=-n, venta=venta)
+            for pid, n in cantidades.items()
+        ]
+    if len(cantidades) == 1 and len(movimientos) == 1:
+        mov = movimientos[0]
+        descontar_stock(mov.producto_id, -mov.cantidad, tipo=mov.tipo, venta=mov.venta)
+        return
+
+    with transaction.atomic():
+        _descontar_lote(cantidades)
+        MovimientoStock.objects.bulk_create(movimientos, batch_size=1000)
+        revisar_al_confirmar(cantidades)
+
+
+def _descontar_lote(cantidades: dict) -> None:
+    calientes = set(
+        Producto.objects.filter(pk__in=cantidades, slots_stock__gt=0).values_list('pk', flat=True)
+    )
+    for pid in calientes:
+        if not _descontar_en_slots(pid, cantidades[pid]):
+            raise StockInsuficiente(pid, cantidades[pid])
+    cantidades = {pid: n for pid, n in cantidades.items() if pid not in calientes}
+    if not cantidades:
+        return
+
+    condicion = Q()
+    for pid, n in cantidades.items():
+        condicion |= Q(pk=pid, cantidad__gte=n)
+    delta = Case(
+        *[When(pk=pid, then=Value(n)) for pid, n in cantidades.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    with transaction.atomic():
+        filas = Producto.objects.filter(condicion).update(cantidad=F('cantidad') - delta)
+        if filas == len(cantidades):
+            return
+        transaction.set_rollback(True)
+
+    # Alguna fila no cumplió la condición: identificar cuál para el mensaje
+    disponibles = dict(Producto.objects.filter(pk__in=cantidades).values_list('pk', 'cantidad'))
+    for pid, n in cantidades.items():
+        if disponibles.get(pid, 0) < n:
+            raise StockInsuficiente(pid, n)
+    # El stock cambió entre el UPDATE y la lectura (venta concurrente)
+    pid, n = next(iter(cantidades.items()))
+    raise StockInsuficiente(pid, n)
+
+
+def devolver_stock_lote(cantidades: dict, tipo: str = MovimientoStock.DEVOLUCION, venta=None) -> None:
+    """Devuelve stock a varios productos con un único UPDATE.
+
+    Contraparte de `descontar_stock_lote` para devoluciones en bloque (p. ej.
+    líneas eliminadas o reducidas en el admin). Los productos en modo
+    caliente reciben la devolución en un slot al azar.
+    """
+    cantidades = {pid: n for pid, n in cantidades.items() if n > 0}
+    if not cantidades:
+        return
+    with transaction.atomic():
+        calientes = dict(
+            Producto.objects.filter(pk__in=cantidades, slots_stock__gt=0).values_list('pk', 'slots_stock')
+        )
+        for pid, slots in calientes.items():
+            StockSlot.objects.filter(producto_id=pid, slot=random.randrange(slots)).update(
+                cantidad=F('cantidad') + cantidades[pid]
+            )
+        normales = {pid: n for pid, n in cantidades.items() if pid not in calientes}
+        if normales:
+            Producto.objects.filter(pk__in=normales).update(cantidad=F('cantidad') + Case(
+                *[When(pk=pid, then=Value(n)) for pid, n in normales.items()],
+                default=Value(0),
+                output_field=IntegerField(),
+            ))
+        MovimientoStock.objects.bulk_create([
+            MovimientoStock(producto_id=pid, tipo=tipo, cantidad=n, venta=venta)
+            for pid, n in cantidades.items()
+        ])
+        revisar_al_confirmar(cantidades)
+
+
+def compactar_movimientos(dias: int = 90, lote: int = 500) -> int:
+    """Resume los movimientos anteriores a `dias` en una fila "saldo" por producto.
+
+    Procesa `lote` productos por transacción para no retener bloqueos largos.
+    El saldo queda fechado en el corte, de modo que la suma del libro no
+    cambia. Retorna la cantidad de movimientos eliminados.
+    """
+    corte = timezone.now() - timedelta(days=dias)
+    antiguos = MovimientoStock.objects.filter(fecha__lt=corte)
+    producto_ids = list(
+        antiguos.values('producto_id').annotate(n=Count('id')).filter(n__gt=1).values_list('producto_id', flat=True)
+    )
+    eliminados = 0
+    for i in range(0, len(producto_ids), lote):
+        ids = producto_ids[i:i + lote]
+        with transaction.atomic():
+            saldos = dict(
+                antiguos.filter(producto_id__in=ids).values('producto_id')
+                .annotate(total=Sum('cantidad')).values_list('producto_id', 'total')
+            )
+            borrados, _ = antiguos.filter(producto_id__in=ids).delete()
+            eliminados += borrados
+            MovimientoStock.objects.bulk_create([
+                MovimientoStock(producto_id=pid, tipo=MovimientoStock.SALDO, cantidad=total, fecha=corte)
+                for pid, total in saldos.items()
+            ])
+    return eliminados - len(producto_ids)
+
+
+def verificar_saldos(producto_ids=None):
+    """Compara el saldo materializado (cantidad + slots) con la suma del libro.
+
+    Retorna una lista de (producto_id, saldo_materializado, suma_movimientos)
+    para los productos que no cuadran.
+    """
+    qs = Producto.objects.all()
+    if producto_ids is not None:
+        qs = qs.filter(pk__in=producto_ids)
+    sumas = dict(
+        MovimientoStock.objects.filter(producto__in=qs).values('producto_id')
+        .annotate(total=Sum('cantidad')).values_list('producto_id', 'total')
+    )
+    en_slots = dict(
+        StockSlot.objects.filter(producto__in=qs).values('producto_id')
+        .annotate(total=Sum('cantidad')).values_list('producto_id', 'total')
+    )
+    saldos = (
+        (pid, cantidad + en_slots.get(pid, 0))
+        for pid, cantidad in qs.values_list('pk', 'cantidad').iterator()
+    )
+    return [(pid, saldo, sumas.get(pid, 0)) for pid, saldo in saldos if sumas.get(pid, 0) != saldo]
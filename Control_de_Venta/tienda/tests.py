@@ -1,3 +1,1241 @@
-from django.test import TestCase
+import base64
+import csv
+import io
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import F, Sum
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from django.http import JsonResponse
+from django.urls import resolve, reverse
+import numpy as np
+from openpyxl import load_workbook
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import canasta, chat_cache, groq_utils, imagen_cache, leaderboard, reservas
+from .forecast import politica_reposicion, pronosticar
+from .middleware import IdempotencyKeyMiddleware
+from .models import (
+    Categoria, CategoriaDiaria, ChatMessage, Cliente, MovimientoStock, ParProductos, Producto, ProductoDiario,
+    StockSlot, Venta, VentaDetalle, VentaDiaria,
+)
+from .reposicion import metricas_reposicion, productos_en_atencion
+from .rfm import resumen_rfm, segmento
+from .rollups import reconstruir, resumir_pendientes
+from . import ventas as ventas_servicio
+from .ventas import crear_venta, sincronizar_ventas
+from .stock import (
+    StockInsuficiente, activar_modo_caliente, ajustar_stock, compactar_movimientos, descontar_stock,
+    descontar_stock_lote, devolver_stock, fijar_stock, verificar_saldos,
+)
+from .views import ChatMessageViewSet
+
+
+class VentaAdminSaveFormsetTests(TestCase):
+    """El guardado de una venta en el admin no debe crecer con sus líneas."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+        cls.cliente = Cliente.objects.create(rut='12345678-9')
+
+    def _venta_con_lineas(self, n):
+        productos = Producto.objects.bulk_create([
+            Producto(nombre=f'Producto {n}-{i}', codigo=f'P{n}-{i}', cantidad=100, precio=1000)
+            for i in range(n)
+        ])
+        MovimientoStock.objects.bulk_create([
+            MovimientoStock(producto=p, tipo=MovimientoStock.SALDO, cantidad=p.cantidad) for p in productos
+        ])
+        venta = Venta.objects.create(cliente=self.cliente)
+        VentaDetalle.objects.bulk_create([
+            VentaDetalle(venta=venta, producto=p, cantidad=2, precio_unitario=p.precio) for p in productos
+        ])
+        return venta
+
+    def _datos_editando_lineas(self, venta):
+        """POST del formulario de cambio: sube en 1 cada línea y elimina la última."""
+        detalles = list(venta.detalles.order_by('pk'))
+        data = {
+            'cliente': venta.cliente_id,
+            'clave_idempotencia': '',
+            'detalles-TOTAL_FORMS': len(detalles),
+            'detalles-INITIAL_FORMS': len(detalles),
+            'detalles-MIN_NUM_FORMS': 0,
+            'detalles-MAX_NUM_FORMS': 1000,
+        }
+        for i, d in enumerate(detalles):
+            data.update({
+                f'detalles-{i}-id': d.pk,
+                f'detalles-{i}-venta': venta.pk,
+                f'detalles-{i}-producto': d.producto_id,
+                f'detalles-{i}-cantidad': d.cantidad + 1,
+                f'detalles-{i}-precio_unitario': d.precio_unitario,
+            })
+        data[f'detalles-{len(detalles) - 1}-DELETE'] = 'on'
+        return data
+
+    def _consultas_save_formset(self, venta):
+        """Cuenta solo las consultas de `VentaAdmin.save_formset`.
+
+        La validación de cada formulario (FK del producto, id de la línea) es
+        propia de Django y queda fuera de la medición.
+        """
+        request = RequestFactory().post('/')
+        request.user = self.admin
+        model_admin = admin.site._registry[Venta]
+        data = self._datos_editando_lineas(venta)
+        form = model_admin.get_form(request, venta, change=True)(data, instance=venta)
+        self.assertTrue(form.is_valid(), form.errors)
+        inline = model_admin.get_inline_instances(request, venta)[0]
+        formset = inline.get_formset(request, venta)(data, instance=venta, prefix='detalles')
+        self.assertTrue(formset.is_valid(), formset.errors)
+        with CaptureQueriesContext(connection) as ctx:
+            model_admin.save_formset(request, form, formset, change=True)
+        return len(ctx)
+
+    def test_cantidad_de_consultas_constante(self):
+        chica = self._venta_con_lineas(5)
+        grande = self._venta_con_lineas(20)
+        self.assertEqual(self._consultas_save_formset(chica), self._consultas_save_formset(grande))
+
+    def test_stock_totales_y_libro(self):
+        venta = self._venta_con_lineas(5)
+        self.client.force_login(self.admin)
+        url = reverse('admin:tienda_venta_change', args=[venta.pk])
+        respuesta = self.client.post(url, self._datos_editando_lineas(venta))
+        self.assertEqual(respuesta.status_code, 302)
+
+        venta.refresh_from_db()
+        self.assertEqual(venta.detalles.count(), 4)
+        self.assertEqual(venta.items, 4 * 3)
+        self.assertEqual(venta.total, 4 * 3 * 1000)
+        # 4 líneas subieron de 2 a 3 (descuenta 1) y la eliminada devolvió sus 2
+        stocks = sorted(Producto.objects.filter(ventadetalle__venta=venta).values_list('cantidad', flat=True))
+        self.assertEqual(stocks, [99, 99, 99, 99])
+        self.assertEqual(verificar_saldos(), [])
+
+
+class CheckoutConsultasTests(TestCase):
+    """Un checkout no debe crecer en consultas con sus líneas."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente = Cliente.objects.create(rut='12345678-9')
+        cls.usuario = User.objects.create_user('cajero', password='clave')
+        cls.productos = Producto.objects.bulk_create([
+            Producto(nombre=f'Producto {i}', codigo=f'P-{i:03}', cantidad=100, precio=1000) for i in range(30)
+        ])
+        MovimientoStock.objects.bulk_create([
+            MovimientoStock(producto=p, tipo=MovimientoStock.SALDO, cantidad=p.cantidad) for p in cls.productos
+        ])
+
+    def _lineas(self, n):
+        return [{'producto': p.pk, 'cantidad': 2} for p in self.productos[:n]]
+
+    def _crear_venta(self, n, consultas):
+        lineas = ventas_servicio.resolver_productos(self._lineas(n))
+        with self.assertNumQueries(consultas):
+            venta = crear_venta(self.cliente, lineas)
+        self.assertEqual(venta.detalles.count(), n)
+
+    def test_crear_venta_constante(self):
+        # Una línea va por `descontar_stock`; desde dos, el lote suma la
+        # consulta de productos en modo caliente y su savepoint, sin importar cuántas
+        self._crear_venta(1, 8)
+        self._crear_venta(2, 11)
+        self._crear_venta(30, 11)
+        self.assertEqual(verificar_saldos(), [])
+
+    def test_checkout_api_constante(self):
+        Cliente.objects.create(rut='22760900-7')
+        api = APIClient()
+        api.force_authenticate(self.usuario)
+        consultas = []
+        for n in (2, 30):
+            with CaptureQueriesContext(connection) as ctx:
+                respuesta = api.post(reverse('venta-checkout'), {'rut': '22760900-7', 'lineas': self._lineas(n)},
+                                     format='json')
+            self.assertEqual(respuesta.status_code, 201)
+            self.assertEqual(respuesta.json()['items'], 2 * n)
+            consultas.append(len(ctx))
+        self.assertEqual(consultas[0], consultas[1])
+        self.assertEqual(verificar_saldos(), [])
+
+
+class DescuentoStockTests(TestCase):
+    """Invariantes del descuento condicional: nunca stock negativo y el libro siempre cuadra."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente = Cliente.objects.create(rut='12345678-9')
+        cls.usuario = User.objects.create_user('cajero', password='clave')
+
+    def setUp(self):
+        self.mouse = Producto.objects.create(nombre='Mouse', codigo='MOU-01', cantidad=5, precio=1000)
+        self.cable = Producto.objects.create(nombre='Cable', codigo='CAB-01', cantidad=2, precio=300)
+
+    def assertStock(self, producto, cantidad):
+        self.assertEqual(Producto.objects.prefetch_related('slots').get(pk=producto.pk).stock_actual, cantidad)
+        self.assertEqual(verificar_saldos(), [])
+
+    def test_descuento_condicional(self):
+        descontar_stock(self.mouse.pk, 3)
+        with self.assertRaisesMessage(StockInsuficiente, 'disponible: 2'):
+            descontar_stock(self.mouse.pk, 3)
+        self.assertStock(self.mouse, 2)
+
+    def test_lote_es_todo_o_nada(self):
+        with self.assertRaises(StockInsuficiente) as ctx:
+            descontar_stock_lote({self.mouse.pk: 2, self.cable.pk: 3})
+        self.assertEqual(ctx.exception.producto_id, self.cable.pk)
+        self.assertStock(self.mouse, 5)
+        self.assertStock(self.cable, 2)
+
+    def test_checkout_sin_stock_no_deja_rastro(self):
+        api = APIClient()
+        api.force_authenticate(self.usuario)
+        respuesta = api.post(reverse('venta-checkout'), {'rut': '22760900-7', 'lineas': [
+            {'codigo': 'MOU-01', 'cantidad': 2}, {'codigo': 'CAB-01', 'cantidad': 3},
+        ]}, format='json')
+        self.assertEqual(respuesta.status_code, 409)
+        self.assertFalse(Venta.objects.exists())
+        self.assertStock(self.mouse, 5)
+        self.assertStock(self.cable, 2)
+
+        respuesta = api.post(reverse('venta-checkout'), {'rut': '22760900-7', 'lineas': [
+            {'codigo': 'MOU-01', 'cantidad': 2}, {'producto': self.cable.pk, 'cantidad': 2},
+        ]}, format='json')
+        self.assertEqual(respuesta.status_code, 201)
+        self.assertEqual((respuesta.json()['items'], respuesta.json()['total']), (4, '2600.00'))
+        self.assertStock(self.mouse, 3)
+        self.assertStock(self.cable, 0)
+
+    def test_registrar_venta_sin_stock(self):
+        self.client.force_login(self.usuario)
+        respuesta = self.client.post(reverse('registrar_venta'), {'rut': '22760900-7', 'codigo': 'MOU-01', 'cantidad': 6})
+        self.assertContains(respuesta, 'Stock insuficiente')
+        self.assertFalse(Venta.objects.exists())
+        self.assertStock(self.mouse, 5)
+
+    def test_modo_caliente_reparte_y_drena_los_slots(self):
+        activar_modo_caliente(self.mouse.pk, 4)
+        self.assertEqual(sorted(StockSlot.objects.filter(producto=self.mouse).values_list('cantidad', flat=True)),
+                         [1, 1, 1, 2])
+        # Ningún slot tiene 4 unidades: el descuento drena varios slots
+        descontar_stock(self.mouse.pk, 4)
+        with self.assertRaisesMessage(StockInsuficiente, 'disponible: 1'):
+            descontar_stock(self.mouse.pk, 2)
+        descontar_stock(self.mouse.pk, 1)
+        with self.assertRaises(StockInsuficiente):
+            descontar_stock(self.mouse.pk, 1)
+        self.assertStock(self.mouse, 0)
+        self.assertFalse(StockSlot.objects.filter(producto=self.mouse, cantidad__lt=0).exists())
+        activar_modo_caliente(self.mouse.pk, 0)
+        self.assertStock(self.mouse, 0)
+
+
+class LibroMovimientosTests(TestCase):
+    """El libro es auditoría: su suma debe cuadrar con el saldo tras cada tipo de mutación."""
+
+    def setUp(self):
+        self.cliente = Cliente.objects.create(rut='12345678-9')
+        self.producto = Producto.objects.create(nombre='Mouse', codigo='MOU-01', cantidad=20, precio=1000)
+
+    def _por_tipo(self):
+        return dict(
+            MovimientoStock.objects.filter(producto=self.producto).values('tipo')
+            .annotate(total=Sum('cantidad')).values_list('tipo', 'total')
+        )
+
+    def assertCuadra(self, saldo):
+        producto = Producto.objects.prefetch_related('slots').get(pk=self.producto.pk)
+        self.assertEqual(producto.stock_actual, saldo)
+        self.assertEqual(sum(self._por_tipo().values()), saldo)
+        self.assertEqual(verificar_saldos(), [])
+
+    def test_ventas_devoluciones_y_ajustes_cuadran(self):
+        crear_venta(self.cliente, [(self.producto, 5)])                               # 15
+        devolver_stock(self.producto.pk, 2)                                           # 17
+        devolver_stock(self.producto.pk, 10, tipo=MovimientoStock.REPOSICION)         # 27
+        ajustar_stock(self.producto.pk, -3, tipo=MovimientoStock.AJUSTE)              # 24
+        fijar_stock(self.producto.pk, 30)                                             # 30
+        self.assertCuadra(30)
+        self.assertEqual(self._por_tipo(), {
+            MovimientoStock.SALDO: 20, MovimientoStock.VENTA: -5, MovimientoStock.DEVOLUCION: 2,
+            MovimientoStock.REPOSICION: 10, MovimientoStock.AJUSTE: 3,
+        })
+
+        # Modo caliente: el reparto no es un movimiento, las mutaciones en slots sí
+        activar_modo_caliente(self.producto.pk, 3)
+        self.assertCuadra(30)
+        descontar_stock(self.producto.pk, 4)
+        devolver_stock(self.producto.pk, 1)
+        fijar_stock(self.producto.pk, 12)
+        self.assertCuadra(12)
+        with self.assertRaises(StockInsuficiente):
+            crear_venta(self.cliente, [(self.producto, 13)])
+        self.assertCuadra(12)
+
+        # La compactación resume el historial sin cambiar la suma
+        MovimientoStock.objects.update(fecha=timezone.now() - timedelta(days=1))
+        self.assertGreater(compactar_movimientos(dias=0), 0)
+        self.assertEqual(MovimientoStock.objects.filter(producto=self.producto).count(), 1)
+        self.assertCuadra(12)
+
+
+class ModoCalienteLecturasTests(TestCase):
+    """Con el modo caliente `cantidad` queda en 0: el stock se lee con los slots."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente = Cliente.objects.create(rut='12345678-9')
+        cls.producto = Producto.objects.create(nombre='Pendrive Caliente', codigo='HOT-001', cantidad=12, precio=5000)
+        activar_modo_caliente(cls.producto.pk, 4)
+        cls.producto.refresh_from_db()
+
+    def test_clean_del_detalle_cuenta_los_slots(self):
+        venta = Venta.objects.create(cliente=self.cliente)
+        VentaDetalle(venta=venta, producto=self.producto, cantidad=5, precio_unitario=5000).clean()
+        with self.assertRaisesMessage(ValidationError, 'disponible: 12'):
+            VentaDetalle(venta=venta, producto=self.producto, cantidad=13, precio_unitario=5000).clean()
+
+    def test_chat_responde_el_stock_de_los_slots(self):
+        respuesta = ChatMessageViewSet._try_inventory_answer('¿Hay stock de HOT-001?')
+        self.assertEqual(respuesta, 'Stock disponible: 12 unidades.')
+        contexto = ChatMessageViewSet._build_context('producto', 'pendrive')
+        catalogo = json.loads(contexto.split('Catalogo:\n', 1)[1])
+        # Con `cantidad` en 0 quedaría bajo el umbral por defecto (10)
+        self.assertFalse(catalogo[0]['stock_bajo'])
+
+
+class VersionCatalogoTests(TestCase):
+    """Una venta solo invalida el caché del chat si el producto cruza su umbral."""
+
+    def test_solo_el_cruce_de_umbral_sube_la_version(self):
+        producto = Producto.objects.create(nombre='Teclado', codigo='TEC-01', cantidad=15, precio=9000)
+        inicial = chat_cache.version_catalogo()
+        with self.captureOnCommitCallbacks(execute=True):
+            descontar_stock(producto.pk, 3)
+        self.assertEqual(chat_cache.version_catalogo(), inicial)
+        with self.captureOnCommitCallbacks(execute=True):
+            descontar_stock(producto.pk, 3)
+        self.assertGreater(chat_cache.version_catalogo(), inicial)
+
+
+class ChatAsincronoTests(TestCase):
+    """POST /api/chat/ va a la vista asíncrona y el ViewSet usa el mismo flujo."""
+
+    pregunta = {'user_message': 'Recomienda un regalo para mi hermana', 'context_type': 'general'}
+
+    def setUp(self):
+        caches['chat'].clear()
+        self.usuario = User.objects.create_user('cajera', password='clave')
+        token = RefreshToken.for_user(self.usuario).access_token
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    @mock.patch('Control_de_Venta.tienda.ai_views.chat_with_groq_async', new_callable=mock.AsyncMock)
+    def test_post_de_la_coleccion_usa_la_vista_asincrona(self, groq):
+        groq.return_value = 'Un libro de cocina.'
+        url = reverse('chatmessage-list')
+        self.assertEqual(resolve(url).func.__name__, 'vista')
+        respuesta = self.client.post(url, self.pregunta, content_type='application/json', **self.auth)
+        self.assertEqual(respuesta.status_code, 201)
+        self.assertEqual(respuesta['X-Cache'], 'MISS')
+        self.assertEqual(respuesta.json()['ai_response'], 'Un libro de cocina.')
+        # Sin credenciales no llega a Groq
+        self.assertEqual(self.client.post(url, self.pregunta, content_type='application/json').status_code, 401)
+
+        # El ViewSet (sufijo de formato del router) comparte caché e historial
+        api = APIClient()
+        api.force_authenticate(self.usuario)
+        respuesta = api.post('/api/chat.json', self.pregunta, format='json')
+        self.assertEqual(respuesta.status_code, 201)
+        self.assertEqual(respuesta['X-Cache'], 'HIT')
+        groq.assert_awaited_once()
+
+        listado = self.client.get(url, **self.auth)
+        self.assertEqual(listado.status_code, 200)
+        self.assertEqual(listado.json()['count'], 2)
+        self.assertEqual(ChatMessage.objects.filter(user=self.usuario).count(), 2)
+
+    @mock.patch('Control_de_Venta.tienda.ai_views.chat_with_groq_async', new_callable=mock.AsyncMock)
+    def test_groq_caido_no_guarda_el_mensaje(self, groq):
+        groq.return_value = 'Error: servicio no disponible'
+        api = APIClient()
+        api.force_authenticate(self.usuario)
+        respuesta = api.post('/api/chat.json', self.pregunta, format='json')
+        self.assertEqual(respuesta.status_code, 503)
+        self.assertEqual(respuesta.json()['code'], 'GROQ_UNAVAILABLE')
+        self.assertFalse(ChatMessage.objects.exists())
+
+class TrendsCacheTests(TestCase):
+    """La clave de `trends` incluye el rango resuelto, no solo los parámetros."""
+
+    def setUp(self):
+        caches['analytics'].clear()
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('analista', password='clave'))
+
+    @mock.patch('Control_de_Venta.tienda.views.analyze_sales_trends', return_value='Sin novedades.')
+    def test_cambio_de_dia_no_reutiliza_el_periodo_anterior(self, groq):
+        hoy = timezone.localdate()
+        url = reverse('analytics-trends') + '?days=7'
+        with mock.patch('Control_de_Venta.tienda.views.localdate', return_value=hoy):
+            self.assertEqual(self.api.get(url)['X-Cache'], 'MISS')
+            self.assertEqual(self.api.get(url)['X-Cache'], 'HIT')
+        with mock.patch('Control_de_Venta.tienda.views.localdate', return_value=hoy + timedelta(days=1)):
+            respuesta = self.api.get(url)
+        self.assertEqual(respuesta['X-Cache'], 'MISS')
+        self.assertEqual(respuesta.json()['analytics_data']['fecha_analisis'], str(hoy + timedelta(days=1)))
+        self.assertEqual(groq.call_count, 2)
+
+class UmbralesStockTests(TestCase):
+    """`stock_bajo` se revisa tras el commit y en ambos sentidos."""
+
+    def setUp(self):
+        self.cliente = Cliente.objects.create(rut='12345678-9')
+        self.producto = Producto.objects.create(nombre='Mouse', codigo='MOU-01', cantidad=12, precio=1000,
+                                                stock_minimo=10)
+
+    def _bajo(self):
+        return Producto.objects.values_list('stock_bajo', flat=True).get(pk=self.producto.pk)
+
+    @mock.patch('Control_de_Venta.tienda.stock.send_notification')
+    def test_cruza_en_ambos_sentidos_fuera_de_la_venta(self, notificar):
+        with self.captureOnCommitCallbacks() as callbacks, CaptureQueriesContext(connection) as consultas:
+            crear_venta(self.cliente, [(self.producto, 3)])
+        # Nada de la revisión de umbrales dentro de la transacción del checkout
+        self.assertFalse([c['sql'] for c in consultas.captured_queries if 'stock_bajo' in c['sql']])
+        self.assertFalse(self._bajo())
+        with self.captureOnCommitCallbacks(execute=True):
+            for callback in callbacks:
+                callback()
+        self.assertTrue(self._bajo())
+        self.assertEqual(notificar.call_count, 1)
+        self.assertEqual(notificar.call_args.args[0]['stock'], 9)
+
+        # Seguir bajo el umbral no repite el aviso; reponer lo rearma
+        with self.captureOnCommitCallbacks(execute=True):
+            descontar_stock(self.producto.pk, 1)
+        self.assertEqual(notificar.call_count, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            devolver_stock(self.producto.pk, 5, tipo=MovimientoStock.REPOSICION)
+        self.assertFalse(self._bajo())
+        with self.captureOnCommitCallbacks(execute=True):
+            fijar_stock(self.producto.pk, 2)
+        self.assertTrue(self._bajo())
+        self.assertEqual(notificar.call_count, 2)
+
+    def test_low_stock_alert_usa_el_indice_parcial(self):
+        Producto.objects.bulk_create([
+            Producto(nombre=f'Relleno {i}', codigo=f'REL-{i:03d}', cantidad=100, precio=100) for i in range(200)
+        ])
+        with self.captureOnCommitCallbacks(execute=True):
+            descontar_stock(self.producto.pk, 5)
+        api = APIClient()
+        api.force_authenticate(User.objects.create_user('cajero', password='clave'))
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = api.get(reverse('analytics-low-stock-alert'))
+        self.assertEqual([p['codigo'] for p in respuesta.json()['productos']], ['MOU-01'])
+        sql = next(c['sql'] for c in consultas.captured_queries if 'stock_bajo' in c['sql'])
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            plan = ' '.join(str(fila[-1]) for fila in cursor.fetchall())
+        self.assertIn('producto_stock_bajo', plan)
+
+
+class ImagenCacheTests(TestCase):
+    """El caché de análisis de imágenes no aparece en el historial del usuario."""
+
+    def test_cache_fuera_del_historial(self):
+        salida = io.BytesIO()
+        Image.new('RGB', (32, 24), 'red').save(salida, 'PNG')
+        huellas = imagen_cache.huellas(salida.getvalue())
+        imagen_cache.guardar(huellas, {'producto': 'Bebida', 'precio_estimado': 990})
+        self.assertEqual(imagen_cache.buscar(salida.getvalue())[1:], (
+            {'producto': 'Bebida', 'precio_estimado': 990}, imagen_cache.EXACTO,
+        ))
+        api = APIClient()
+        api.force_authenticate(User.objects.create_user('cajero', password='clave'))
+        self.assertEqual(api.get(reverse('images-list')).json()['count'], 0)
+
+
+class SincronizarVentasTests(TestCase):
+    """Sincronización offline: reintentos agotados no deben terminar en error 500."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.producto = Producto.objects.create(nombre='Bebida', codigo='BEB-01', cantidad=5, precio=990)
+
+    def _venta(self, clave, cantidad):
+        return {'clave': clave, 'rut': '12345678-9', 'lineas': [{'producto': self.producto.pk, 'cantidad': cantidad}]}
+
+    def test_lote_en_conflicto_se_procesa_de_a_una(self):
+        original = ventas_servicio._sincronizar_lote
+
+        def lote_en_conflicto(lote):
+            # Simula otro request que consume el stock en cada intento del lote completo
+            if len(lote) > 1:
+                raise StockInsuficiente(self.producto.pk, 1)
+            return original(lote)
+
+        with mock.patch.object(ventas_servicio, '_sincronizar_lote', side_effect=lote_en_conflicto):
+            resultados = sincronizar_ventas([self._venta('a', 3), self._venta('b', 3)])
+        self.assertEqual([r['estado'] for r in resultados], ['creada', 'rechazada'])
+        self.assertIn('Stock insuficiente', resultados[1]['error'])
+        self.producto.refresh_from_db()
+        self.assertEqual(self.producto.cantidad, 2)
+        self.assertEqual(verificar_saldos(), [])
+
+    def test_reenvio_es_duplicado(self):
+        creada = sincronizar_ventas([self._venta('a', 1)])[0]
+        self.assertEqual(sincronizar_ventas([self._venta('a', 1)])[0], {
+            'clave': 'a', 'estado': 'duplicada', 'venta': creada['venta'],
+        })
+
+
+class ResumenVentasTests(TestCase):
+    """Cursor keyset de `pagina_ventas` y totales del periodo tras editar líneas."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente = Cliente.objects.create(rut='12345678-9')
+        cls.usuario = User.objects.create_user('cajero', password='clave')
+        cls.mouse = Producto.objects.create(nombre='Mouse', codigo='MOU-01', cantidad=50, precio=1000)
+        cls.cable = Producto.objects.create(nombre='Cable', codigo='CAB-01', cantidad=50, precio=300)
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(self.usuario)
+
+    def _resumen(self, **params):
+        respuesta = self.api.get(reverse('venta-resumen'), params)
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta.json()
+
+    def test_cursor_recorre_ventas_con_la_misma_fecha(self):
+        ventas = [Venta.objects.create(cliente=self.cliente) for _ in range(7)]
+        # Cinco ventas en el mismo instante: el orden lo desempata el id
+        fecha = timezone.now().replace(microsecond=0)
+        Venta.objects.filter(pk__in=[v.pk for v in ventas[:5]]).update(fecha=fecha)
+        Venta.objects.filter(pk__in=[v.pk for v in ventas[5:]]).update(fecha=fecha - timedelta(minutes=1))
+        esperado = list(Venta.objects.order_by('-fecha', '-pk').values_list('pk', flat=True))
+
+        vistos, cursor = [], None
+        while True:
+            datos = self._resumen(tamano=2, **({'cursor': cursor} if cursor else {}))
+            vistos += [v['id'] for v in datos['resultados']]
+            cursor = datos['siguiente']
+            if cursor is None:
+                break
+        self.assertEqual(vistos, esperado)
+        self.assertEqual(datos['ventas'], 7)
+
+    def test_cursor_invalido(self):
+        respuesta = self.api.get(reverse('venta-resumen'), {'cursor': 'no-es-un-cursor'})
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertEqual(respuesta.json()['error'], 'Cursor inválido')
+        for cursor in ('%%%', base64.urlsafe_b64encode(b'sin separador').decode(),
+                       base64.urlsafe_b64encode(b'ayer|1').decode(), base64.urlsafe_b64encode(b'\xff\xfe').decode()):
+            with self.assertRaisesMessage(ValidationError, 'Cursor inválido'):
+                ventas_servicio.pagina_ventas(Venta.objects.all(), cursor)
+
+    def test_totales_tras_editar_y_eliminar_lineas(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            venta = crear_venta(self.cliente, [(self.mouse, 2), (self.cable, 3)])
+        datos = self._resumen()
+        self.assertEqual((datos['items'], float(datos['total'])), (5, 2900))
+
+        linea = venta.detalles.get(producto=self.cable)
+        url = reverse('ventadetalle-detail', args=[linea.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.api.patch(url, {'cantidad': 1}, format='json').status_code, 200)
+        venta.refresh_from_db()
+        self.assertEqual((venta.items, venta.total), (3, 2300))
+        datos = self._resumen()
+        self.assertEqual((datos['items'], float(datos['total'])), (3, 2300))
+        self.assertEqual(datos['resultados'][0]['items'], 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.api.delete(url).status_code, 204)
+        venta.refresh_from_db()
+        self.assertEqual((venta.items, venta.total), (2, 2000))
+        self.assertEqual(ventas_servicio.totales_periodo(Venta.objects.all()),
+                         {'total': 2000, 'ventas': 1, 'items': 2})
+        self.assertEqual(verificar_saldos(), [])
+
+class ExportacionesTests(TestCase):
+    """Exportaciones masivas: XLSX partido por el límite de Excel y listados CSV/NDJSON en streaming."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('contador', password='clave')
+        cls.cliente = Cliente.objects.create(rut='12345678-9')
+        cls.producto = Producto.objects.create(nombre='Mouse', codigo='MOU-01', cantidad=50, precio=1000)
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(self.usuario)
+
+    def test_xlsx_continua_en_otra_hoja_al_llegar_al_limite(self):
+        ventas = [crear_venta(self.cliente, [(self.producto, i)]) for i in range(1, 6)]
+        # Encabezado más dos filas por hoja
+        with mock.patch('Control_de_Venta.tienda.exports.MAX_FILAS', 3):
+            respuesta = self.api.get(reverse('venta-exportar'))
+        self.assertEqual(respuesta.status_code, 200)
+        libro = load_workbook(io.BytesIO(b''.join(respuesta.streaming_content)), read_only=True)
+        self.assertEqual(libro.sheetnames,
+                         ['Ventas', 'Ventas (2)', 'Ventas (3)', 'Detalle', 'Detalle (2)', 'Detalle (3)'])
+        ids = []
+        for nombre in ('Ventas', 'Ventas (2)', 'Ventas (3)'):
+            filas = list(libro[nombre].iter_rows(values_only=True))
+            self.assertEqual(filas[0], ('ID', 'Fecha', 'Cliente', 'Ítems', 'Total'))
+            self.assertLessEqual(len(filas), 3)
+            ids += [f[0] for f in filas[1:]]
+        self.assertEqual(ids, [v.pk for v in ventas])
+        cantidades = [f[4] for nombre in ('Detalle', 'Detalle (2)', 'Detalle (3)')
+                      for f in list(libro[nombre].iter_rows(values_only=True))[1:]]
+        self.assertEqual(cantidades, [1, 2, 3, 4, 5])
+
+    def test_xlsx_sin_filas_deja_el_encabezado(self):
+        respuesta = self.api.get(reverse('venta-exportar'))
+        libro = load_workbook(io.BytesIO(b''.join(respuesta.streaming_content)), read_only=True)
+        self.assertEqual(libro.sheetnames, ['Ventas', 'Detalle'])
+        self.assertEqual(list(libro['Ventas'].iter_rows(values_only=True)),
+                         [('ID', 'Fecha', 'Cliente', 'Ítems', 'Total')])
+
+    def _productos_extra(self):
+        # Más productos que PAGE_SIZE (10): la exportación no pagina
+        Producto.objects.bulk_create([
+            Producto(nombre=f'Cable {i:02}', codigo=f'CAB-{i:02}', cantidad=i, precio=300) for i in range(12)
+        ])
+        activar_modo_caliente(self.producto.pk, 4)
+
+    def test_csv_con_las_columnas_de_exportacion(self):
+        self._productos_extra()
+        respuesta = self.api.get(reverse('producto-list'), {'format': 'csv'})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertTrue(respuesta['Content-Type'].startswith('text/csv'))
+        self.assertIn('attachment; filename="producto_', respuesta['Content-Disposition'])
+        filas = list(csv.reader(io.StringIO(b''.join(respuesta.streaming_content).decode())))
+        self.assertEqual(filas[0],
+                         ['id', 'codigo', 'nombre', 'categoria_id', 'precio', 'cantidad', 'stock', 'descripcion'])
+        self.assertEqual(len(filas), 1 + 13)
+        mouse = next(f for f in filas if f[1] == 'MOU-01')
+        # En modo caliente `cantidad` queda en 0 y `stock` suma los slots; None va vacío
+        self.assertEqual(mouse, [str(self.producto.pk), 'MOU-01', 'Mouse', '', '1000.00', '0', '50', ''])
+
+    def test_ndjson_un_objeto_por_linea(self):
+        self._productos_extra()
+        respuesta = self.api.get(reverse('producto-list'), {'format': 'ndjson'})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertTrue(respuesta['Content-Type'].startswith('application/x-ndjson'))
+        lineas = b''.join(respuesta.streaming_content).decode().splitlines()
+        self.assertEqual(len(lineas), 13)
+        objetos = [json.loads(linea) for linea in lineas]
+        self.assertEqual(list(objetos[0]),
+                         ['id', 'codigo', 'nombre', 'categoria_id', 'precio', 'cantidad', 'stock', 'descripcion'])
+        mouse = next(o for o in objetos if o['codigo'] == 'MOU-01')
+        self.assertEqual((mouse['categoria_id'], mouse['precio'], mouse['cantidad'], mouse['stock']),
+                         (None, '1000.00', 0, 50))
+
+class IdempotencyCandadoTests(TestCase):
+    """El candado de una Idempotency-Key no vence mientras la vista original sigue corriendo."""
+
+    def test_candado_se_renueva_durante_la_vista(self):
+        vivo = []
+
+        def vista_lenta(request):
+            time.sleep(0.5)
+            vivo.append(cache.get(f'{middleware._clave_cache(request, "k1")}:candado') is not None)
+            return JsonResponse({'ok': True}, status=201)
+
+        middleware = IdempotencyKeyMiddleware(vista_lenta)
+        middleware.vida_candado = 0.2
+        request = RequestFactory().post('/api/ventas/', {}, HTTP_IDEMPOTENCY_KEY='k1', HTTP_AUTHORIZATION='Bearer x')
+        self.assertEqual(middleware(request).status_code, 201)
+        self.assertEqual(vivo, [True])
+
+
+class ReservasTests(TestCase):
+    """Una reserva solo la ve, libera o vende quien la creó."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.producto = Producto.objects.create(nombre='Audífonos', codigo='AUD-01', cantidad=4, precio=15000)
+        cls.duena = User.objects.create_user('duena', password='clave')
+        cls.otro = User.objects.create_user('otro', password='clave')
+
+    def setUp(self):
+        anterior = reservas.set_backend(reservas.ReservasEnMemoria())
+        self.addCleanup(reservas.set_backend, anterior)
+
+    def _api(self, usuario):
+        api = APIClient()
+        api.force_authenticate(usuario)
+        return api
+
+    def test_solo_la_duena_accede_a_la_reserva(self):
+        respuesta = self._api(self.duena).post(
+            reverse('reservas-list'), {'lineas': [{'producto': self.producto.pk, 'cantidad': 3}]}, format='json'
+        )
+        self.assertEqual(respuesta.status_code, 201)
+        detalle = reverse('reservas-detail', args=[respuesta.json()['id']])
+        otro = self._api(self.otro)
+        self.assertEqual(otro.get(detalle).status_code, 404)
+        self.assertEqual(otro.delete(detalle).status_code, 404)
+        checkout = otro.post(reverse('venta-checkout'), {'rut': '22760900-7', 'reserva': respuesta.json()['id']},
+                             format='json')
+        self.assertEqual(checkout.status_code, 410)
+        # Lo retenido sigue sin estar disponible para el otro usuario
+        checkout = otro.post(reverse('venta-checkout'), {
+            'rut': '22760900-7', 'lineas': [{'producto': self.producto.pk, 'cantidad': 2}],
+        }, format='json')
+        self.assertEqual(checkout.status_code, 409)
+
+        duena = self._api(self.duena)
+        self.assertEqual(duena.get(detalle).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            checkout = duena.post(reverse('venta-checkout'), {'rut': '22760900-7', 'reserva': respuesta.json()['id']},
+                                  format='json')
+        self.assertEqual(checkout.status_code, 201)
+        self.assertEqual(duena.get(detalle).status_code, 404)
+        self.producto.refresh_from_db()
+        self.assertEqual(self.producto.cantidad, 1)
+        self.assertEqual(verificar_saldos(), [])
+
+    def _producto(self):
+        return Producto.objects.prefetch_related('slots').get(pk=self.producto.pk)
+
+    def test_reserva_se_consume_una_sola_vez(self):
+        cliente = Cliente.objects.create(rut='22760900-7')
+        reserva = reservas.reservar([(self._producto(), 2)], usuario=self.duena)
+        crear_venta(cliente, [(self._producto(), 2)], reserva=reserva)
+        # Un segundo checkout con la misma reserva ya no la encuentra
+        with self.assertRaises(reservas.ReservaNoDisponible):
+            crear_venta(cliente, [(self._producto(), 2)], reserva=reserva)
+        self.assertEqual(self._producto().cantidad, 2)
+        self.assertEqual(Venta.objects.count(), 1)
+
+    def test_reserva_se_restaura_si_la_venta_falla(self):
+        cliente = Cliente.objects.create(rut='22760900-7')
+        reserva = reservas.reservar([(self._producto(), 3)], usuario=self.duena)
+        fijar_stock(self.producto.pk, 2)
+        with self.assertRaises(StockInsuficiente):
+            crear_venta(cliente, [(self._producto(), 3)], reserva=reserva)
+        self.assertIsNotNone(reservas.obtener_reserva(reserva['id'], self.duena))
+        self.assertEqual(reservas.get_backend().retenido([self.producto.pk])[self.producto.pk], 3)
+        self.assertEqual(Venta.objects.count(), 0)
+
+    def test_sincronizar_respeta_lo_retenido(self):
+        reservas.reservar([(self._producto(), 3)], usuario=self.duena)
+        resultado = sincronizar_ventas([
+            {'clave': 'pos-1', 'rut': '22760900-7', 'lineas': [{'producto': self.producto.pk, 'cantidad': 2}]},
+        ])[0]
+        self.assertEqual(resultado['estado'], 'rechazada')
+        self.assertIn('disponible: 1', resultado['error'])
+        self.assertEqual(self._producto().cantidad, 4)
+
+    def test_detalle_por_api_respeta_lo_retenido(self):
+        venta = Venta.objects.create(cliente=Cliente.objects.create(rut='22760900-7'))
+        reservas.reservar([(self._producto(), 3)], usuario=self.duena)
+        datos = {
+            'venta': 'http://testserver' + reverse('venta-detail', args=[venta.pk]),
+            'producto': 'http://testserver' + reverse('producto-detail', args=[self.producto.pk]),
+            'cantidad': 2,
+            'precio_unitario': 15000,
+        }
+        api = self._api(self.otro)
+        respuesta = api.post(reverse('ventadetalle-list'), datos, format='json')
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertIn('cantidad', respuesta.json())
+        # La unidad libre sí se puede vender, pero subirla a 2 toma lo retenido
+        datos['cantidad'] = 1
+        respuesta = api.post(reverse('ventadetalle-list'), datos, format='json')
+        self.assertEqual(respuesta.status_code, 201)
+        respuesta = api.patch(respuesta.json()['url'], {'cantidad': 2}, format='json')
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertEqual(self._producto().cantidad, 3)
+
+
+class RollupsTests(TestCase):
+    """Los resúmenes incrementales deben coincidir con una reconstrucción."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente = Cliente.objects.create(rut='12345678-9')
+        cls.categoria = Categoria.objects.create(nombre='Accesorios')
+        cls.mouse = Producto.objects.create(nombre='Mouse', codigo='MOU-01', cantidad=50, precio=1000,
+                                            categoria=cls.categoria)
+        cls.cable = Producto.objects.create(nombre='Cable', codigo='CAB-01', cantidad=50, precio=300)
+
+    def _resumenes(self):
+        return (
+            list(VentaDiaria.objects.order_by('fecha').values_list('fecha', 'ventas', 'unidades', 'ingresos', 'lineas')),
+            list(ProductoDiario.objects.order_by('fecha', 'producto_id')
+                 .values_list('fecha', 'producto_id', 'unidades', 'ingresos', 'lineas')),
+            list(CategoriaDiaria.objects.order_by('fecha', 'categoria_id')
+                 .values_list('fecha', 'categoria_id', 'unidades', 'ingresos', 'lineas')),
+        )
+
+    def assertCuadraConReconstruccion(self):
+        incremental = self._resumenes()
+        hoy = timezone.localdate()
+        reconstruir(hoy, hoy)
+        self.assertEqual(incremental, self._resumenes())
+
+    def test_ingresos_con_el_precio_de_la_linea(self):
+        # Línea con descuento: precio_unitario distinto del precio de lista
+        with self.captureOnCommitCallbacks(execute=True):
+            venta = Venta.objects.create(cliente=self.cliente)
+            VentaDetalle.objects.create(venta=venta, producto=self.mouse, cantidad=2, precio_unitario=800)
+            VentaDetalle.objects.create(venta=venta, producto=self.cable, cantidad=1, precio_unitario=300)
+        self.assertEqual(VentaDiaria.objects.get().ingresos, 1900)
+        self.assertCuadraConReconstruccion()
+
+    def test_checkout_no_toca_los_resumenes_en_su_transaccion(self):
+        # Ninguna fila compartida entre ventas (día, producto/día, pares) se escribe
+        # antes del commit: dos checkouts concurrentes solo compiten por el stock
+        with self.captureOnCommitCallbacks() as callbacks, CaptureQueriesContext(connection) as consultas:
+            venta = crear_venta(self.cliente, [(self.mouse, 3), (self.cable, 2)])
+        tablas = [m._meta.db_table for m in (VentaDiaria, ProductoDiario, CategoriaDiaria, ParProductos)]
+        for consulta in consultas.captured_queries:
+            self.assertFalse([t for t in tablas if t in consulta['sql']], consulta['sql'])
+        self.assertFalse(VentaDiaria.objects.exists())
+        self.assertFalse(Venta.objects.get(pk=venta.pk).resumida)
+
+        for callback in callbacks:
+            callback()
+        self.assertTrue(Venta.objects.get(pk=venta.pk).resumida)
+        self.assertEqual(VentaDiaria.objects.values_list('ventas', 'unidades', 'ingresos', 'lineas').get(),
+                         (1, 5, 3600, 2))
+        self.assertCuadraConReconstruccion()
+
+    def test_venta_pendiente_se_resume_una_sola_vez(self):
+        # Pendiente (el proceso cayó tras el commit): la reconstrucción no la cuenta
+        with self.captureOnCommitCallbacks():
+            crear_venta(self.cliente, [(self.mouse, 3)])
+        hoy = timezone.localdate()
+        reconstruir(hoy, hoy)
+        self.assertFalse(VentaDiaria.objects.exists())
+
+        self.assertEqual(resumir_pendientes(), 1)
+        self.assertEqual(resumir_pendientes(), 0)
+        self.assertEqual(VentaDiaria.objects.values_list('ventas', 'unidades').get(), (1, 3))
+        self.assertCuadraConReconstruccion()
+
+    def test_lineas_editadas_antes_de_resumir(self):
+        api = APIClient()
+        api.force_authenticate(User.objects.create_user('cajero', password='clave'))
+        with self.captureOnCommitCallbacks():
+            venta = crear_venta(self.cliente, [(self.mouse, 3), (self.cable, 2)])
+        linea_mouse = venta.detalles.get(producto=self.mouse)
+        with self.captureOnCommitCallbacks(execute=True):
+            respuesta = api.patch(reverse('ventadetalle-detail', args=[linea_mouse.pk]), {'cantidad': 1})
+        self.assertEqual(respuesta.status_code, 200)
+        # La edición no tenía nada que ajustar: el resumen usa las líneas finales
+        self.assertFalse(VentaDiaria.objects.exists())
+        resumir_pendientes()
+        self.assertEqual(VentaDiaria.objects.values_list('ventas', 'unidades', 'ingresos', 'lineas').get(),
+                         (1, 3, 1600, 2))
+        self.assertCuadraConReconstruccion()
+
+    def test_lineas_editadas_por_la_api_ajustan_el_dia(self):
+        api = APIClient()
+        api.force_authenticate(User.objects.create_user('cajero', password='clave'))
+        with self.captureOnCommitCallbacks(execute=True):
+            venta = crear_venta(self.cliente, [(self.mouse, 3), (self.cable, 2)])
+        linea_mouse = venta.detalles.get(producto=self.mouse)
+        linea_cable = venta.detalles.get(producto=self.cable)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            respuesta = api.patch(reverse('ventadetalle-detail', args=[linea_mouse.pk]), {'cantidad': 1})
+        self.assertEqual(respuesta.status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            respuesta = api.delete(reverse('ventadetalle-detail', args=[linea_cable.pk]))
+        self.assertEqual(respuesta.status_code, 204)
+        self.assertEqual(VentaDiaria.objects.values_list('ventas', 'unidades', 'ingresos', 'lineas').get(),
+                         (1, 1, 1000, 1))
+        self.assertFalse(ProductoDiario.objects.filter(producto=self.cable).exists())
+        self.assertCuadraConReconstruccion()
+
+    def test_venta_creada_por_la_api_cuenta_en_el_dia(self):
+        api = APIClient()
+        api.force_authenticate(User.objects.create_user('cajero', password='clave'))
+        with self.captureOnCommitCallbacks(execute=True):
+            respuesta = api.post(reverse('venta-list'), {
+                'cliente': reverse('cliente-detail', args=[self.cliente.pk]),
+            })
+        self.assertEqual(respuesta.status_code, 201)
+        venta = Venta.objects.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            respuesta = api.post(reverse('ventadetalle-list'), {
+                'venta': reverse('venta-detail', args=[venta.pk]),
+                'producto': reverse('producto-detail', args=[self.mouse.pk]),
+                'cantidad': 2,
+            })
+        self.assertEqual(respuesta.status_code, 201)
+        self.assertEqual(VentaDiaria.objects.values_list('ventas', 'unidades', 'ingresos', 'lineas').get(),
+                         (1, 2, 2000, 1))
+        self.assertCuadraConReconstruccion()
+
+    def test_reconstruir_no_deja_dias_vacios(self):
+        hoy = timezone.localdate()
+        reconstruir(hoy - timedelta(days=3), hoy)
+        self.assertFalse(VentaDiaria.objects.exists())
+
+
+class CanastaTests(TestCase):
+    """Métricas de co-ocurrencia y su mantenimiento al editar ventas."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente = Cliente.objects.create(rut='12345678-9')
+        cls.mouse = Producto.objects.create(nombre='Mouse', codigo='MOU-01', cantidad=50, precio=1000)
+        cls.teclado = Producto.objects.create(nombre='Teclado', codigo='TEC-01', cantidad=50, precio=2000)
+        cls.cable = Producto.objects.create(nombre='Cable', codigo='CAB-01', cantidad=50, precio=300)
+
+    def setUp(self):
+        # N = 4; mouse en 3, teclado en 3, cable en 1; mouse+teclado en 2, mouse+cable en 1
+        self.ventas = []
+        for canasta_venta in ([self.mouse, self.teclado], [self.mouse, self.teclado],
+                              [self.mouse, self.cable], [self.teclado]):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.ventas.append(crear_venta(self.cliente, [(p, 1) for p in canasta_venta]))
+
+    def _matriz(self):
+        return list(ParProductos.objects.order_by('producto_a_id', 'producto_b_id')
+                    .values_list('producto_a_id', 'producto_b_id', 'ventas'))
+
+    def assertCuadraConReconstruccion(self):
+        incremental = self._matriz()
+        canasta.reconstruir()
+        self.assertEqual(incremental, self._matriz())
+
+    def test_sin_diagonal(self):
+        self.assertFalse(ParProductos.objects.filter(producto_a=F('producto_b')).exists())
+        self.assertEqual(ParProductos.objects.count(), 4)
+        self.assertCuadraConReconstruccion()
+
+    def test_frecuentemente_juntos_confianza_y_lift(self):
+        data = canasta.frecuentemente_juntos(self.mouse.pk)
+        self.assertEqual((data['ventas'], data['total_ventas']), (3, 4))
+        teclado, cable = data['sugerencias']
+        self.assertEqual((teclado['producto'], teclado['ventas_juntos']), (self.teclado.pk, 2))
+        # confianza = 2/3, lift = 2·4 / (3·3), soporte = 2/4
+        self.assertEqual((teclado['confianza'], teclado['lift'], teclado['soporte']), (0.6667, 0.889, 0.5))
+        # lift = 1·4 / (3·1): el cable casi siempre va con el mouse
+        self.assertEqual((cable['confianza'], cable['lift']), (0.3333, 1.333))
+
+        por_lift = canasta.frecuentemente_juntos(self.mouse.pk, orden='lift')
+        self.assertEqual([s['producto'] for s in por_lift['sugerencias']], [self.cable.pk, self.teclado.pk])
+        self.assertEqual(canasta.frecuentemente_juntos(self.mouse.pk, minimo=2)['sugerencias'][0]['producto'],
+                         self.teclado.pk)
+        self.assertEqual(len(canasta.frecuentemente_juntos(self.mouse.pk, minimo=2)['sugerencias']), 1)
+
+    def test_pares_frecuentes(self):
+        pares = canasta.pares_frecuentes(10, minimo=1)
+        self.assertEqual([(p['producto_a'], p['producto_b'], p['ventas_juntos']) for p in pares],
+                         [('Mouse', 'Teclado', 2), ('Mouse', 'Cable', 1)])
+        self.assertEqual((pares[0]['confianza'], pares[0]['lift']), (0.6667, 0.889))
+        self.assertEqual(canasta.pares_frecuentes(10), pares[:1])
+
+    def test_edicion_y_eliminacion_reemplazan_la_canasta(self):
+        api = APIClient()
+        api.force_authenticate(User.objects.create_user('cajero', password='clave'))
+        linea_cable = self.ventas[2].detalles.get(producto=self.cable)
+        with self.captureOnCommitCallbacks(execute=True):
+            respuesta = api.delete(reverse('ventadetalle-detail', args=[linea_cable.pk]))
+        self.assertEqual(respuesta.status_code, 204)
+        self.assertFalse(ParProductos.objects.filter(producto_a=self.mouse, producto_b=self.cable).exists())
+        self.assertCuadraConReconstruccion()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ventas[0].delete()
+        self.assertEqual(ParProductos.objects.get(producto_a=self.mouse, producto_b=self.teclado).ventas, 1)
+        self.assertCuadraConReconstruccion()
+        data = canasta.frecuentemente_juntos(self.mouse.pk)
+        # mouse queda en 2 ventas de 3: confianza 1/2, lift 1·3 / (2·2)
+        self.assertEqual((data['ventas'], data['total_ventas']), (2, 3))
+        self.assertEqual((data['sugerencias'][0]['confianza'], data['sugerencias'][0]['lift']), (0.5, 0.75))
+
+
+class PronosticoTests(SimpleTestCase):
+    """SES para demanda regular, Croston-SBA para intermitente y cero sin ventas."""
+
+    def setUp(self):
+        Y = np.zeros((30, 4), dtype=np.float32)
+        Y[:, 0] = 5          # todos los días
+        Y[::5, 1] = 4        # cada 5 días
+        Y[20:, 3] = 2        # a diario desde el día 20 (producto nuevo)
+        self.r = pronosticar(Y)
+
+    def test_demanda_regular_usa_ses(self):
+        self.assertFalse(self.r['intermitente'][0])
+        self.assertAlmostEqual(self.r['pronostico'][0], 5)
+        self.assertAlmostEqual(self.r['sigma'][0], 0)
+
+    def test_demanda_intermitente_usa_croston(self):
+        self.assertTrue(self.r['intermitente'][1])
+        self.assertAlmostEqual(self.r['adi'][1], 5)
+        # Tamaño 4 cada 5 días, con la corrección SBA (1 - alpha/2)
+        self.assertAlmostEqual(self.r['pronostico'][1], 0.95 * 4 / 5)
+
+    def test_sin_ventas_pronostica_cero(self):
+        self.assertEqual(self.r['pronostico'][2], 0)
+        self.assertEqual(self.r['sigma'][2], 0)
+        self.assertEqual(self.r['adi'][2], np.inf)
+        politica = politica_reposicion(self.r['pronostico'], self.r['sigma'], np.array([0, 0, 0, 0.]))
+        self.assertFalse(politica['atencion'][2])
+        self.assertEqual(politica['cantidad_reorden'][2], 0)
+        self.assertEqual(politica['dias_cobertura'][2], np.inf)
+
+    def test_historia_previa_a_la_primera_venta_no_cuenta(self):
+        self.assertFalse(self.r['intermitente'][3])
+        self.assertAlmostEqual(self.r['adi'][3], 1)
+        self.assertAlmostEqual(self.r['pronostico'][3], 2)
+
+
+class ReposicionTests(TestCase):
+    """`productos_en_atencion`: menor cobertura primero; a igual cobertura, más demanda."""
+
+    def test_orden_de_urgencia(self):
+        hoy = timezone.localdate()
+        # (stock, unidades por día): coberturas 1, 2, 2, 5 y un producto sin ventas
+        datos = {'A': (5, 5), 'B': (10, 5), 'C': (4, 2), 'D': (10, 2), 'E': (0, 0)}
+        productos = {
+            nombre: Producto.objects.create(nombre=nombre, codigo=f'REP-{nombre}', cantidad=stock, precio=1000)
+            for nombre, (stock, _) in datos.items()
+        }
+        ProductoDiario.objects.bulk_create([
+            ProductoDiario(fecha=hoy - timedelta(days=d), producto=productos[nombre], unidades=n,
+                           ingresos=n * 1000, lineas=1)
+            for nombre, (_, n) in datos.items() if n
+            for d in range(30)
+        ])
+        metricas = metricas_reposicion()
+        self.assertEqual([f['nombre'] for f in productos_en_atencion(metricas)], ['A', 'B', 'C', 'D'])
+        self.assertEqual([f['nombre'] for f in productos_en_atencion(metricas, top=2)], ['A', 'B'])
+        primera = productos_en_atencion(metricas)[0]
+        self.assertEqual((primera['metodo'], primera['dias_cobertura']), ('ses', 1.0))
+        self.assertEqual(primera['fecha_quiebre'], str(hoy + timedelta(days=1)))
+
+
+class RfmTests(TestCase):
+    """Puntajes por quintil y segmento de cada cliente, con y sin funciones de ventana."""
+
+    @classmethod
+    def setUpTestData(cls):
+        ahora = timezone.now()
+        # rut: (días desde la última compra, compras); quintiles R y F de 1 a 5
+        cls.clientes = {
+            'nuevo': (1, 1), 'campeon': (2, 5), 'leal': (3, 3), 'en_riesgo': (4, 4), 'hibernando': (5, 2),
+        }
+        for rut, (dias, compras) in cls.clientes.items():
+            cliente = Cliente.objects.create(rut=rut)
+            for i in range(compras):
+                venta = Venta.objects.create(cliente=cliente, total=1000, items=1)
+                Venta.objects.filter(pk=venta.pk).update(fecha=ahora - timedelta(days=dias + 7 * i))
+
+    def _resumen(self):
+        return resumen_rfm(Venta.objects.all(), top=5)
+
+    def test_segmentos(self):
+        resumen = self._resumen()
+        self.assertEqual(resumen['clientes'], 5)
+        por_rut = {c['rut']: c for c in resumen['top_clientes']}
+        self.assertEqual({rut: c['segmento'] for rut, c in por_rut.items()}, {
+            'nuevo': 'nuevos', 'campeon': 'campeones', 'leal': 'leales',
+            'en_riesgo': 'en_riesgo', 'hibernando': 'hibernando',
+        })
+        self.assertEqual((por_rut['campeon']['r'], por_rut['campeon']['f'], por_rut['campeon']['m']), (4, 5, 5))
+        self.assertEqual(por_rut['campeon']['recencia_dias'], 2)
+        # El top viene por monto: 5 compras de 1000 primero
+        self.assertEqual([c['rut'] for c in resumen['top_clientes']][:2], ['campeon', 'en_riesgo'])
+        self.assertEqual(resumen['segmentos']['campeones'], {'clientes': 1, 'monto': 5000})
+        self.assertEqual(resumen['segmentos']['potenciales'], {'clientes': 0, 'monto': 0})
+        self.assertEqual(sum(map(sum, resumen['matriz_rf'])), 5)
+        self.assertEqual(resumen['matriz_rf'][4][0], 1)  # nuevo: R=5, F=1
+
+    def test_sin_funciones_de_ventana_da_lo_mismo(self):
+        con_ventana = self._resumen()
+        with mock.patch.object(connection.features, 'supports_over_clause', False):
+            sin_ventana = self._resumen()
+        self.assertEqual(sin_ventana, con_ventana)
+
+    def test_reglas_de_segmento(self):
+        casos = {(5, 5): 'campeones', (4, 4): 'campeones', (3, 3): 'leales', (5, 1): 'nuevos',
+                 (3, 1): 'potenciales', (2, 5): 'en_riesgo', (1, 2): 'hibernando'}
+        self.assertEqual({rf: segmento(*rf) for rf in casos}, casos)
+
+
+class LeaderboardTests(TestCase):
+    """Top-N incremental: `acumular` suma sin releer y `reiniciar` recarga desde los resúmenes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente = Cliente.objects.create(rut='12345678-9')
+        cls.mouse = Producto.objects.create(nombre='Mouse', codigo='MOU-01', cantidad=100, precio=1000)
+        cls.cable = Producto.objects.create(nombre='Cable', codigo='CAB-01', cantidad=100, precio=300)
+        cls.teclado = Producto.objects.create(nombre='Teclado', codigo='TEC-01', cantidad=100, precio=9000)
+
+    def setUp(self):
+        anterior = leaderboard.set_backend(leaderboard.LeaderboardEnMemoria())
+        self.addCleanup(leaderboard.set_backend, anterior)
+
+    def _vender(self, *lineas):
+        with self.captureOnCommitCallbacks(execute=True):
+            crear_venta(self.cliente, list(lineas))
+
+    def _top(self, metrica='unidades', n=10, periodo='dia'):
+        return [(f['codigo'], f[metrica]) for f in leaderboard.top(periodo, metrica, n)]
+
+    def test_top_tras_acumular(self):
+        self._vender((self.mouse, 2), (self.cable, 5))
+        self.assertEqual(self._top(), [('CAB-01', 5), ('MOU-01', 2)])
+        with mock.patch.object(leaderboard, 'reconstruir', wraps=leaderboard.reconstruir) as reconstruir:
+            self._vender((self.mouse, 4), (self.teclado, 1))
+            self._vender((self.teclado, 1))
+            # Ya cargado: las ventas nuevas se suman sin releer ProductoDiario
+            reconstruir.assert_not_called()
+            self.assertEqual(self._top(), [('MOU-01', 6), ('CAB-01', 5), ('TEC-01', 2)])
+            self.assertEqual(self._top(n=2), [('MOU-01', 6), ('CAB-01', 5)])
+            self.assertEqual(self._top('ingresos'), [('TEC-01', 18000), ('MOU-01', 6000), ('CAB-01', 1500)])
+            self.assertEqual(self._top(periodo='total'), self._top())
+
+    def test_venta_de_otro_dia_solo_cuenta_en_el_total(self):
+        self._vender((self.mouse, 1))
+        hace_un_ano = timezone.localdate() - timedelta(days=366)
+        leaderboard.acumular({(hace_un_ano, self.cable.pk): (7, 2100)})
+        self.assertEqual(self._top(), [('MOU-01', 1)])
+        self.assertEqual(self._top(periodo='total'), [('CAB-01', 7), ('MOU-01', 1)])
+
+    def test_reiniciar_recarga_desde_los_resumenes(self):
+        self._vender((self.mouse, 2), (self.cable, 1))
+        self.assertEqual(self._top(), [('MOU-01', 2), ('CAB-01', 1)])
+        # Un cambio en los resúmenes que el ranking no vio (p. ej. rollups.reconstruir)
+        ProductoDiario.objects.filter(producto=self.cable).update(unidades=9)
+        self.assertEqual(self._top(), [('MOU-01', 2), ('CAB-01', 1)])
+        leaderboard.reiniciar()
+        self.assertEqual(self._top(), [('CAB-01', 9), ('MOU-01', 2)])
+
+
+class ClientesGroqTests(SimpleTestCase):
+    """Un cliente Groq por clave y proceso; tras un fork el hijo arma su propio registro."""
+
+    def setUp(self):
+        for nombre, valor in (('_clientes', {}), ('_clientes_lock', threading.Lock()),
+                              ('_clientes_pid', os.getpid())):
+            parche = mock.patch.object(groq_utils, nombre, valor)
+            parche.start()
+            self.addCleanup(parche.stop)
+        parche = mock.patch.object(groq_utils, 'crear_cliente', side_effect=lambda *a: object())
+        self.crear_cliente = parche.start()
+        self.addCleanup(parche.stop)
+
+    def test_un_cliente_por_clave(self):
+        cliente = groq_utils.cliente_compartido('clave-a')
+        self.assertIs(groq_utils.cliente_compartido('clave-a'), cliente)
+        self.assertIsNot(groq_utils.cliente_compartido('clave-b'), cliente)
+        self.assertEqual(self.crear_cliente.call_count, 2)
+
+    def test_otro_pid_rehace_el_registro(self):
+        cliente = groq_utils.cliente_compartido('clave-a')
+        # Como si el registro viniera del padre (fork sin el hook de register_at_fork)
+        groq_utils._clientes_pid = os.getpid() + 1
+        nuevo = groq_utils.cliente_compartido('clave-a')
+        self.assertIsNot(nuevo, cliente)
+        self.assertEqual(groq_utils._clientes_pid, os.getpid())
+        self.assertEqual(list(groq_utils._clientes.values()), [nuevo])
+
+    @skipUnless(hasattr(os, 'fork') and hasattr(os, 'register_at_fork'), 'Requiere fork')
+    def test_hijo_de_fork_no_hereda_clientes(self):
+        groq_utils.cliente_compartido('clave-a')
+        lock_padre = groq_utils._clientes_lock
+        lock_padre.acquire()  # otro hilo del padre con el lock tomado al hacer fork
+        self.addCleanup(lock_padre.release)
+        lectura, escritura = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                ok = (not groq_utils._clientes and groq_utils._clientes_pid == os.getpid()
+                      and groq_utils._clientes_lock is not lock_padre
+                      and groq_utils._clientes_lock.acquire(timeout=1))
+                os.write(escritura, b'1' if ok else b'0')
+            finally:
+                os._exit(0)
+        os.close(escritura)
+        resultado = os.read(lectura, 1)
+        os.close(lectura)
+        os.waitpid(pid, 0)
+        self.assertEqual(resultado, b'1')
+        self.assertEqual(len(groq_utils._clientes), 1)
+
+
+class PreprocesarImagenTests(SimpleTestCase):
+    """Imagen que se envía a Groq Vision: lado máximo, orientación y MIME."""
+
+    def _codificar(self, imagen, formato, **opciones):
+        salida = io.BytesIO()
+        imagen.save(salida, formato, **opciones)
+        return salida.getvalue()
+
+    def _abrir(self, datos):
+        imagen = Image.open(io.BytesIO(datos))
+        imagen.load()
+        return imagen
+
+    def test_foto_grande_se_reduce_a_jpeg(self):
+        foto = self._codificar(Image.effect_noise((1920, 1200), 60).convert('RGB'), 'PNG')
+        datos, mime = groq_utils.preprocesar_imagen(foto)
+        self.assertEqual(mime, 'image/jpeg')
+        imagen = self._abrir(datos)
+        self.assertEqual((imagen.format, imagen.size), ('JPEG', (1280, 800)))
+        self.assertLess(len(datos), len(foto))
+
+    def test_webp_configurado(self):
+        foto = self._codificar(Image.effect_noise((1400, 1400), 60).convert('RGB'), 'PNG')
+        with mock.patch.object(groq_utils, 'GROQ_IMAGEN_FORMATO', 'WEBP'):
+            datos, mime = groq_utils.preprocesar_imagen(foto)
+        self.assertEqual(mime, 'image/webp')
+        imagen = self._abrir(datos)
+        self.assertEqual((imagen.format, imagen.size), ('WEBP', (1280, 1280)))
+
+    def test_orientacion_exif_se_aplica(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # rotada 90°
+        foto = self._codificar(Image.new('RGB', (200, 100), 'blue'), 'JPEG', exif=exif)
+        datos, mime = groq_utils.preprocesar_imagen(foto)
+        imagen = self._abrir(datos)
+        self.assertEqual((mime, imagen.size), ('image/jpeg', (100, 200)))
+        self.assertNotIn(0x0112, imagen.getexif())
+
+    def test_transparencia_sobre_fondo_blanco(self):
+        foto = self._codificar(Image.new('RGBA', (2000, 1000), (255, 0, 0, 0)), 'PNG')
+        datos, mime = groq_utils.preprocesar_imagen(foto)
+        imagen = self._abrir(datos)
+        self.assertEqual((mime, imagen.mode, imagen.size), ('image/jpeg', 'RGB', (1280, 640)))
+        self.assertTrue(all(canal >= 250 for canal in imagen.getpixel((10, 10))))
+
+    def test_original_chico_se_envia_tal_cual(self):
+        foto = self._codificar(Image.new('RGB', (64, 48), 'red'), 'PNG')
+        self.assertEqual(groq_utils.preprocesar_imagen(foto), (foto, 'image/png'))
+        gif = self._codificar(Image.new('P', (3000, 20)), 'GIF')
+        with mock.patch.object(groq_utils, 'GROQ_IMAGEN_LADO_MAX', 0):
+            self.assertEqual(groq_utils.preprocesar_imagen(gif), (gif, 'image/gif'))
@@ -3,6 +3,7 @@ from . import views
 from rest_framework import routers 
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from .auth_views import register, login, me
+from . import ai_views
 
 router = routers.DefaultRouter()
 router.register(r"users", views.UserViewSet)
@@ -12,6 +13,7 @@ router.register(r"clientes", views.ClienteViewSet)
 router.register(r"productos", views.ProductoViewSet)
 router.register(r"ventas", views.VentaViewSet)
 router.register(r"ventadetalle", views.VentaDetalleViewSet)
+router.register(r"reservas", views.ReservaViewSet, basename="reservas")
 router.register(r"chat", views.ChatMessageViewSet, basename="chat")
 router.register(r"images", views.ImageAnalysisViewSet, basename="images")
 router.register(r"analytics", views.AnalyticsViewSet, basename="analytics")
@@ -24,9 +26,11 @@ urlpatterns = [
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 
+    # POST de chat e imágenes a las vistas asíncronas (daphne): no retienen
+    # hilos mientras Groq responde. El resto de métodos sigue en los ViewSets.
     path(
         'api/chat/',
-        views.ChatMessageViewSet.as_view({'get': 'list', 'post': 'create'}),
+        ai_views.coleccion(ai_views.chat, views.ChatMessageViewSet.as_view({'get': 'list', 'post': 'create'})),
         name='chatmessage-list',
     ),
     path(
@@ -34,6 +38,14 @@ urlpatterns = [
         views.ChatMessageViewSet.as_view({'get': 'retrieve', 'delete': 'destroy'}),
         name='chatmessage-detail',
     ),
+    path(
+        'api/images/',
+        ai_views.coleccion(ai_views.imagen, views.ImageAnalysisViewSet.as_view({'get': 'list', 'post': 'create'})),
+        name='imageanalysis-list',
+    ),
+    # Alias de las mismas vistas
+    path('api/ai/chat/', ai_views.chat, name='ai_chat'),
+    path('api/ai/imagen/', ai_views.imagen, name='ai_imagen'),
 
     path("api/", include(router.urls)),
     path("api-auth/", include("rest_framework.urls", namespace="rest_framework")),
@@ -0,0 +1,339 @@
+"""
+Servicio de registro de ventas.
+
+Centraliza la creación de una venta con N líneas para que la vista web y la
+API compartan el mismo camino de escritura con un número constante de
+consultas, sin importar el tamaño del carrito:
+
+    1. Resolver todos los productos en una sola consulta.
+    2. Descontar el stock de todos ellos en un único UPDATE condicional.
+    3. Insertar la cabecera (con `total` e `items` ya calculados) y luego
+       los detalles con `bulk_create`.
+"""
+import base64
+import re
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Cliente, MovimientoStock, Producto, Venta, VentaDetalle
+from .reservas import (
+    ReservaNoDisponible, consumir_reserva, disponibilidad, restaurar_reserva, verificar_disponible,
+)
+from .rollups import resumir_al_confirmar
+from .stock import StockInsuficiente, descontar_stock_lote
+
+
+def normalizar_rut(rut: str):
+    """Normaliza un RUT al formato aceptado por `Cliente.rut_validator`.
+
+    Acepta 10 dígitos seguidos, 8 dígitos + DV sin guion, o el formato con
+    guion (ej. 22760900-7). Retorna None si no es válido.
+    """
+    # Elimina puntos y espacios, y convierte a mayúsculas para la K
+    rut_raw = (rut or '').strip().replace('.', '').replace(' ', '').upper()
+
+    # Si viene sin guion y tiene 9 o 10 caracteres, intentar formatear
+    if '-' not in rut_raw and len(rut_raw) in (9, 10):
+        # Si tiene 9 caracteres asumimos 8 + dv
+        if len(rut_raw) == 9:
+            rut_norm = rut_raw[:8] + '-' + rut_raw[8]
+        else:
+            # 10 dígitos: tomar los primeros 8, guion, resto como dv (si vienen 10 se considera 8+dv)
+            rut_norm = rut_raw[:8] + '-' + rut_raw[8:]
+    else:
+        rut_norm = rut_raw
+
+    # Validación final: acepta 10 dígitos seguidos o 8 dígitos + '-' + dv (num o K)
+    if not re.fullmatch(r'(?:\d{10}|\d{8}-[0-9K])', rut_norm):
+        return None
+    return rut_norm
+
+
+def resolver_productos(lineas):
+    """Resuelve los productos de todas las líneas en una sola consulta.
+
+    Cada línea identifica el producto por `producto` (id) o por `codigo`.
+    Retorna una lista de (producto, cantidad) en el mismo orden de entrada.
+    """
+    ids = {l['producto'] for l in lineas if l.get('producto')}
+    codigos = {l['codigo'] for l in lineas if not l.get('producto') and l.get('codigo')}
+    productos = list(Producto.objects.filter(Q(pk__in=ids) | Q(codigo__in=codigos)).prefetch_related('slots'))
+    por_id = {p.pk: p for p in productos}
+    por_codigo = {p.codigo: p for p in productos}
+
+    resueltas = []
+    for linea in lineas:
+        if linea.get('producto'):
+            producto = por_id.get(linea['producto'])
+        else:
+            producto = por_codigo.get(linea.get('codigo'))
+        if producto is None:
+            ref = linea.get('producto') or linea.get('codigo')
+            raise ValidationError(f"Producto no encontrado: {ref}")
+        resueltas.append((producto, int(linea['cantidad'])))
+    return resueltas
+
+
+def crear_venta(cliente: Cliente, lineas, reserva=None) -> Venta:
+    """Registra una venta con sus líneas de forma transaccional.
+
+    `lineas` es una lista de (producto, cantidad) ya resuelta. Levanta
+    `StockInsuficiente` (y revierte todo) si algún producto no alcanza,
+    contando como no disponible lo retenido por reservas ajenas. Si la venta
+    convierte una `reserva` (ver `reservas.obtener_reserva`), se consume
+    antes de descontar: si otro checkout ya la consumió (o venció) se levanta
+    `ReservaNoDisponible`, y si la venta falla se restaura.
+    """
+    cantidades = {}
+    for producto, cantidad in lineas:
+        cantidades[producto.pk] = cantidades.get(producto.pk, 0) + cantidad
+
+    if reserva is not None:
+        consumida = consumir_reserva(reserva['id'], reserva['usuario'])
+        if consumida is None:
+            raise ReservaNoDisponible(reserva['id'])
+        reserva = consumida
+    try:
+        verificar_disponible(lineas)
+        with transaction.atomic():
+            venta = Venta.objects.create(cliente=cliente, **totales_lineas(lineas))
+            descontar_stock_lote(cantidades, venta=venta)
+            VentaDetalle.objects.bulk_create([
+                VentaDetalle(
+                    venta=venta,
+                    producto=producto,
+                    cantidad=cantidad,
+                    # bulk_create no pasa por save(): fijar el precio aquí
+                    precio_unitario=producto.precio,
+                )
+                for producto, cantidad in lineas
+            ])
+    except Exception:
+        if reserva is not None:
+            restaurar_reserva(reserva)
+        raise
+    return venta
+
+
+def totales_lineas(lineas) -> dict:
+    """Calcula {"total", "items"} de una venta a partir de sus (producto, cantidad)."""
+    return {
+        'total': sum((producto.precio * cantidad for producto, cantidad in lineas), Decimal('0')),
+        'items': sum(cantidad for _, cantidad in lineas),
+    }
+
+
+def recalcular_totales(ventas=None) -> int:
+    """Recalcula `total` e `items` desde los detalles en un solo UPDATE.
+
+    `ventas` es un queryset (por defecto todas). Quien modifique detalles
+    fuera de `crear_venta`/`sincronizar_ventas` debe llamarla en la misma
+    transacción. Retorna las filas afectadas.
+    """
+    por_venta = VentaDetalle.objects.filter(venta=OuterRef('pk')).values('venta')
+    qs = Venta.objects.all() if ventas is None else ventas
+    return qs.update(
+        total=Coalesce(
+            Subquery(por_venta.annotate(s=Sum(F('cantidad') * F('precio_unitario'))).values('s')),
+            Value(0), output_field=DecimalField(max_digits=12, decimal_places=2),
+        ),
+        items=Coalesce(Subquery(por_venta.annotate(s=Sum('cantidad')).values('s')), Value(0)),
+    )
+
+
+def sincronizar_ventas(ventas, tamano_lote: int = 500):
+    """Ingresa en bloque ventas registradas offline por un POS.
+
+    Cada venta trae `clave` (clave de idempotencia generada por el cliente),
+    `rut`, `lineas` y opcionalmente `fecha`. Se procesa en lotes de
+    `tamano_lote`, cada uno en su propia transacción con `bulk_create`, de
+    modo que un reintento solo reprocesa lo que no quedó confirmado. Lo
+    retenido por reservas vigentes no cuenta como disponible.
+
+    Si un lote choca tres veces con otros requests, sus ventas se procesan
+    de a una y las que aún fallan quedan "rechazada" con el error; el POS
+    puede reenviarlas con la misma clave.
+
+    Retorna un resultado por venta, en el orden de entrada:
+        {"clave": ..., "estado": "creada" | "duplicada" | "rechazada", "venta": id | None, "error": str}
+    """
+    resultados = {}
+    for i in range(0, len(ventas), tamano_lote):
+        lote = ventas[i:i + tamano_lote]
+        for _ in range(3):
+            try:
+                resultados.update(_sincronizar_lote(lote))
+                break
+            except (IntegrityError, StockInsuficiente):
+                # Otro request confirmó las mismas claves o consumió el stock
+                # entre la lectura y el UPDATE: reintentar con datos frescos.
+                continue
+        else:
+            for v in lote:
+                try:
+                    resultados.update(_sincronizar_lote([v]))
+                except (IntegrityError, StockInsuficiente) as e:
+                    error = (
+                        e.messages[0] if isinstance(e, StockInsuficiente)
+                        else 'Conflicto con otra sincronización en curso; reintente'
+                    )
+                    resultados[v['clave']] = {'clave': v['clave'], 'estado': 'rechazada', 'venta': None, 'error': error}
+    return [resultados[v['clave']] for v in ventas]
+
+
+def _sincronizar_lote(lote):
+    resultados = {}
+    claves = [v['clave'] for v in lote]
+    existentes = dict(
+        Venta.objects.filter(clave_idempotencia__in=claves).values_list('clave_idempotencia', 'pk')
+    )
+    pendientes = []
+    vistas = set()
+    for v in lote:
+        clave = v['clave']
+        if clave in existentes:
+            resultados[clave] = {'clave': clave, 'estado': 'duplicada', 'venta': existentes[clave]}
+        elif clave not in vistas:
+            vistas.add(clave)
+            pendientes.append(v)
+    if not pendientes:
+        return resultados
+
+    # Productos de todo el lote en una consulta
+    ids = {l['producto'] for v in pendientes for l in v['lineas'] if l.get('producto')}
+    codigos = {l['codigo'] for v in pendientes for l in v['lineas'] if not l.get('producto') and l.get('codigo')}
+    productos = list(Producto.objects.filter(Q(pk__in=ids) | Q(codigo__in=codigos)).prefetch_related('slots'))
+    por_id = {p.pk: p for p in productos}
+    por_codigo = {p.codigo: p for p in productos}
+    # Lo retenido por reservas de la app no se vende aunque la venta sea offline
+    stock = {pid: disponible for pid, (_, _, disponible) in disponibilidad(productos).items()}
+
+    # Validar cada venta contra el stock leído, acumulando lo aceptado
+    aceptadas = []
+    cantidades = {}
+    for v in pendientes:
+        clave = v['clave']
+        lineas = []
+        error = None
+        for l in v['lineas']:
+            producto = por_id.get(l['producto']) if l.get('producto') else por_codigo.get(l.get('codigo'))
+            if producto is None:
+                error = f"Producto no encontrado: {l.get('producto') or l.get('codigo')}"
+                break
+            lineas.append((producto, int(l['cantidad'])))
+        if error is None:
+            requerido = {}
+            for producto, cantidad in lineas:
+                requerido[producto.pk] = requerido.get(producto.pk, 0) + cantidad
+            for pid, n in requerido.items():
+                if stock[pid] < n:
+                    nombre = next(p.nombre for p, _ in lineas if p.pk == pid)
+                    error = f"Stock insuficiente para {nombre} (disponible: {stock[pid]})"
+                    break
+        if error is not None:
+            resultados[clave] = {'clave': clave, 'estado': 'rechazada', 'venta': None, 'error': error}
+            continue
+        for pid, n in requerido.items():
+            stock[pid] -= n
+            cantidades[pid] = cantidades.get(pid, 0) + n
+        aceptadas.append((v, lineas))
+    if not aceptadas:
+        return resultados
+
+    with transaction.atomic():
+        # Clientes: crear los que falten en bloque y resolver todos en una consulta
+        ruts = {v['rut'] for v, _ in aceptadas}
+        Cliente.objects.bulk_create([Cliente(rut=rut) for rut in ruts], ignore_conflicts=True)
+        clientes = {c.rut: c for c in Cliente.objects.filter(rut__in=ruts)}
+
+        ventas_obj = Venta.objects.bulk_create([
+            Venta(
+                cliente=clientes[v['rut']],
+                clave_idempotencia=v['clave'],
+                **totales_lineas(lineas),
+                **({'fecha': v['fecha']} if v.get('fecha') else {}),
+            )
+            for v, lineas in aceptadas
+        ])
+        # Un movimiento de stock por venta y producto, en el mismo lote
+        movimientos = []
+        for venta, (_, lineas) in zip(ventas_obj, aceptadas):
+            por_producto = {}
+            for producto, cantidad in lineas:
+                por_producto[producto.pk] = por_producto.get(producto.pk, 0) + cantidad
+            movimientos.extend(
+                MovimientoStock(producto_id=pid, tipo=MovimientoStock.VENTA, cantidad=-n, venta=venta, fecha=venta.fecha)
+                for pid, n in por_producto.items()
+            )
+        descontar_stock_lote(cantidades, movimientos=movimientos)
+        VentaDetalle.objects.bulk_create([
+            VentaDetalle(venta=venta, producto=producto, cantidad=cantidad, precio_unitario=producto.precio)
+            for venta, (_, lineas) in zip(ventas_obj, aceptadas)
+            for producto, cantidad in lineas
+        ], batch_size=1000)
+        # bulk_create no emite la señal que resume las ventas nuevas
+        resumir_al_confirmar()
+
+    for venta, (v, _) in zip(ventas_obj, aceptadas):
+        resultados[v['clave']] = {'clave': v['clave'], 'estado': 'creada', 'venta': venta.pk}
+    return resultados
+
+
+def filtrar_periodo(ventas, fecha_inicio=None, fecha_fin=None):
+    """Filtra `ventas` por días (YYYY-MM-DD, ambos inclusive) en la zona local.
+
+    Traduce los días a un rango semiabierto de datetimes en vez de usar
+    `fecha__date`, para que la consulta use el índice `venta_fecha_id`.
+    Levanta ValidationError si alguna fecha no es válida.
+    """
+    for valor, ultimo in ((fecha_inicio, False), (fecha_fin, True)):
+        if not valor:
+            continue
+        dia = parse_date(valor) if isinstance(valor, str) else valor
+        if dia is None:
+            raise ValidationError(f"Fecha inválida: {valor}")
+        if ultimo:
+            dia += timedelta(days=1)
+        limite = timezone.make_aware(datetime.combine(dia, time.min))
+        ventas = ventas.filter(fecha__lt=limite) if ultimo else ventas.filter(fecha__gte=limite)
+    return ventas
+
+
+def totales_periodo(ventas) -> dict:
+    """Totales del periodo en un solo aggregate: {"total", "ventas", "items"}."""
+    r = ventas.order_by().aggregate(total=Sum('total'), ventas=Count('id'), items=Sum('items'))
+    return {'total': r['total'] or Decimal('0'), 'ventas': r['ventas'], 'items': r['items'] or 0}
+
+
+def _codificar_cursor(venta) -> str:
+    valor = f"{venta.fecha.isoformat()}|{venta.pk}"
+    return base64.urlsafe_b64encode(valor.encode()).decode()
+
+
+def pagina_ventas(ventas, cursor: str = None, tamano: int = 20):
+    """Página de ventas más recientes primero con cursor keyset (fecha, id).
+
+    A diferencia de OFFSET, el costo no crece con la profundidad de la
+    página: cada página es un rango sobre el índice `venta_fecha_id`.
+    Retorna (ventas, cursor_siguiente | None). Levanta ValidationError si
+    el cursor no es válido.
+    """
+    if cursor:
+        try:
+            fecha, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+            fecha, pk = parse_datetime(fecha), int(pk)
+        except (ValueError, UnicodeDecodeError):
+            fecha = None
+        if fecha is None:
+            raise ValidationError('Cursor inválido')
+        ventas = ventas.filter(Q(fecha__lt=fecha) | Q(fecha=fecha, pk__lt=pk))
+    pagina = list(ventas.order_by('-fecha', '-pk')[:tamano + 1])
+    siguiente = _codificar_cursor(pagina[tamano - 1]) if len(pagina) > tamano else None
+    return pagina[:tamano], siguiente
@@ -1,29 +1,55 @@
 # Importaciones necesarias de Django y modelos propios
 from django.shortcuts import render, redirect, get_object_or_404
-from django.utils.timezone import now
+from django.utils.timezone import localdate, now
 from django.db.models import Sum, Count, Q, F, DecimalField
 from django.db.models import ProtectedError
+from django.core.exceptions import ValidationError
 from django.contrib import messages
-from .models import Producto, Cliente, Venta, VentaDetalle, ChatMessage, ImageAnalysis, Categoria
+from .models import (
+    Producto, Cliente, Venta, VentaDetalle, ChatMessage, ImageAnalysis, Categoria,
+    VentaDiaria, ProductoDiario, CategoriaDiaria,
+)
 from django.db import transaction
 import re
 import unicodedata
 import json
 import logging
-from datetime import timedelta
+from datetime import date, datetime, timedelta, timezone as dt_timezone
 import secrets
 import string
 
+from asgiref.sync import async_to_sync
 from django.contrib.auth.models import Group, User
-from rest_framework import permissions, viewsets, status
+from rest_framework import permissions, viewsets, status, serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from .serializers import (
     GroupSerializer, UserSerializer, ClienteSerializer, ProductoSerializer,
-    VentaSerializer, VentaDetalleSerializer, ChatMessageSerializer, ImageAnalysisSerializer, CategoriaSerializer
+    VentaSerializer, VentaDetalleSerializer, ChatMessageSerializer, ImageAnalysisSerializer, CategoriaSerializer,
+    CheckoutSerializer, VentaSyncSerializer, ReservaSerializer,
+)
+from .analytics_cache import cacheado
+from . import chat_cache, imagen_cache
+from .exports import (
+    ExportacionStreamingMixin, escribir_analiticas, escribir_inventario, escribir_ventas, respuesta_xlsx,
 )
 from .groq_utils import (
-    chat_with_groq, analyze_image_with_groq, generate_stock_suggestions, analyze_sales_trends
+    analyze_image_with_groq, generate_stock_suggestions, analyze_sales_trends
+)
+from .stock import (
+    StockInsuficiente, descontar_stock, devolver_stock, ajustar_stock, fijar_stock, guardar_sin_stock,
+    activar_modo_caliente, stock_con_slots, umbral_stock,
+)
+from .reposicion import metricas_reposicion, productos_en_atencion
+from .reservas import (
+    ReservaNoDisponible, disponibilidad, liberar_reserva, obtener_reserva, reservar, verificar_disponible,
+)
+from .rfm import analitica_clientes, resumen_rfm
+from . import canasta, leaderboard
+from .rollups import ajustar_lineas
+from .ventas import (
+    crear_venta, filtrar_periodo, normalizar_rut, pagina_ventas, recalcular_totales, resolver_productos,
+    sincronizar_ventas, totales_periodo,
 )
 
 logger = logging.getLogger(__name__)
@@ -69,20 +95,26 @@ def derive_prefix_from_category_name(name: str, default: str = 'SKU') -> str:
     except Exception:
         return default
 
-class CategoriaViewSet(viewsets.ModelViewSet):
+class CategoriaViewSet(ExportacionStreamingMixin, viewsets.ModelViewSet):
     queryset = Categoria.objects.all().order_by("nombre")
     serializer_class = CategoriaSerializer
     permission_classes = [permissions.IsAuthenticated]
+    campos_exportacion = ('id', 'nombre', 'descripcion', 'activa')
 
-class ClienteViewSet(viewsets.ModelViewSet):
+class ClienteViewSet(ExportacionStreamingMixin, viewsets.ModelViewSet):
     queryset = Cliente.objects.all().order_by("rut")
     serializer_class = ClienteSerializer
     permission_classes = [permissions.IsAuthenticated]
+    campos_exportacion = ('id', 'rut', 'nombre', 'correo', 'habitual')
 
-class ProductoViewSet(viewsets.ModelViewSet):
-    queryset = Producto.objects.all().order_by("nombre")
+class ProductoViewSet(ExportacionStreamingMixin, viewsets.ModelViewSet):
+    queryset = Producto.objects.prefetch_related('slots').order_by("nombre")
     serializer_class = ProductoSerializer
     permission_classes = [permissions.IsAuthenticated]
+    campos_exportacion = ('id', 'codigo', 'nombre', 'categoria_id', 'precio', 'cantidad', 'stock', 'descripcion')
+
+    def queryset_exportacion(self):
+        return stock_con_slots(super().queryset_exportacion())
 
     def create(self, request, *args, **kwargs):
         data = request.data.copy()
@@ -177,6 +209,46 @@ class ProductoViewSet(viewsets.ModelViewSet):
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
+    @action(detail=True, methods=['post'])
+    def modo_caliente(self, request, pk=None):
+        """Activa/desactiva el modo caliente (stock repartido en slots) para promociones.
+        Uso: POST /api/productos/{id}/modo_caliente/ {"slots": 8}   (0 desactiva)
+        """
+        try:
+            slots = int(request.data.get('slots', 0))
+        except (TypeError, ValueError):
+            slots = -1
+        if not 0 <= slots <= 64:
+            return Response({'error': 'slots debe ser un entero entre 0 y 64'}, status=status.HTTP_400_BAD_REQUEST)
+        producto = self.get_object()
+        activar_modo_caliente(producto.pk, slots)
+        producto = self.get_queryset().get(pk=producto.pk)
+        return Response(self.get_serializer(producto).data, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'])
+    def frecuentemente_juntos(self, request, pk=None):
+        """Productos que más se compran junto a este, con soporte, confianza y lift.
+
+        Lee la matriz de co-ocurrencia (`canasta.py`), no las ventas.
+        Uso: GET /api/productos/{id}/frecuentemente_juntos/?n=10&orden=lift&minimo=3
+        """
+        p = request.query_params
+        try:
+            n = min(max(int(p.get('n', 10)), 1), 50)
+            minimo = max(int(p.get('minimo', 1)), 1)
+            producto = get_object_or_404(Producto.objects.only('pk'), pk=pk)
+            data = canasta.frecuentemente_juntos(producto.pk, n=n, orden=p.get('orden', 'confianza'), minimo=minimo)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(data)
+
+    @action(detail=False, methods=['get'])
+    def exportar(self, request):
+        """Inventario completo en Excel.
+        Uso: GET /api/productos/exportar/
+        """
+        return respuesta_xlsx(escribir_inventario, f'inventario_{now():%Y%m%d}.xlsx')
+
     @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
     def precio(self, request):
         """Consulta rápida de precio por código (solo lectura)."""
@@ -237,70 +309,270 @@ class ProductoViewSet(viewsets.ModelViewSet):
         best = candidates[0]
         return Response({'nombre': best.nombre, 'codigo': best.codigo, 'precio': float(best.precio)}, status=status.HTTP_200_OK)
 
-class VentaViewSet(viewsets.ModelViewSet):
+class VentaViewSet(ExportacionStreamingMixin, viewsets.ModelViewSet):
     queryset = Venta.objects.all().order_by("-fecha")
     serializer_class = VentaSerializer
     permission_classes = [permissions.IsAuthenticated]
+    campos_exportacion = ('id', 'fecha', 'cliente_id', 'cliente__rut', 'items', 'total', 'stock_actualizado')
+
+    @action(detail=False, methods=['post'])
+    def checkout(self, request):
+        """Registra una venta multi-línea con un número constante de consultas.
+        Uso: POST /api/ventas/checkout/
+            {"rut": "22760900-7", "lineas": [{"codigo": "SKU-1", "cantidad": 2}, {"producto": 5, "cantidad": 1}]}
+            {"rut": "22760900-7", "reserva": "<id de /api/reservas/>"}
+        """
+        serializer = CheckoutSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        reserva = None
+        if data.get('reserva'):
+            reserva = obtener_reserva(data['reserva'], usuario=request.user)
+            if reserva is None:
+                return Response({'error': 'Reserva inexistente o vencida'}, status=status.HTTP_410_GONE)
+        # Sin líneas explícitas se vende exactamente lo reservado
+        lineas = data.get('lineas') or [
+            {'producto': pid, 'cantidad': n} for pid, n in reserva['items'].items()
+        ]
+        try:
+            lineas = resolver_productos(lineas)
+            cliente, _ = Cliente.objects.get_or_create(rut=data['rut'])
+            venta = crear_venta(cliente, lineas, reserva=reserva)
+        except ReservaNoDisponible as e:
+            # Otro checkout la convirtió (o venció) mientras se procesaba esta
+            return Response({'error': e.messages[0]}, status=status.HTTP_410_GONE)
+        except StockInsuficiente as e:
+            return Response({'error': e.messages[0]}, status=status.HTTP_409_CONFLICT)
+        except ValidationError as e:
+            return Response({'error': e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            self.get_serializer(venta).data,
+            status=status.HTTP_201_CREATED
+        )
+
+    @action(detail=False, methods=['post'])
+    def sincronizar(self, request):
+        """Ingesta en bloque de ventas offline con claves de idempotencia.
+        Uso: POST /api/ventas/sincronizar/
+            {"ventas": [{"clave": "pos1-000123", "rut": "22760900-7", "fecha": "2025-12-11T14:03:00Z",
+                         "lineas": [{"codigo": "SKU-1", "cantidad": 2}]}, ...]}
+        Reintentar el mismo lote es seguro: las claves ya registradas vuelven como "duplicada".
+        """
+        ventas = request.data.get('ventas')
+        if not isinstance(ventas, list) or not ventas:
+            return Response({'error': 'ventas debe ser una lista no vacía'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Validar cada venta por separado para devolver un resultado por venta, en orden
+        resultados = [None] * len(ventas)
+        validas = []
+        posiciones = []
+        for i, item in enumerate(ventas):
+            serializer = VentaSyncSerializer(data=item)
+            if serializer.is_valid():
+                validas.append(serializer.validated_data)
+                posiciones.append(i)
+            else:
+                clave = item.get('clave') if isinstance(item, dict) else None
+                resultados[i] = {'clave': clave, 'estado': 'rechazada', 'venta': None, 'error': serializer.errors}
+
+        for i, resultado in zip(posiciones, sincronizar_ventas(validas) if validas else []):
+            resultados[i] = resultado
+        resumen = {estado: sum(1 for r in resultados if r['estado'] == estado) for estado in ('creada', 'duplicada', 'rechazada')}
+        return Response({'resumen': resumen, 'resultados': resultados}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def resumen(self, request):
+        """Totales del periodo y una página de ventas con cursor keyset.
+        Uso: GET /api/ventas/resumen/?fecha_inicio=2025-12-01&fecha_fin=2025-12-31&tamano=50&cursor=...
+        """
+        p = request.query_params
+        try:
+            tamano = min(max(int(p.get('tamano', 20)), 1), 200)
+            ventas = filtrar_periodo(Venta.objects.all(), p.get('fecha_inicio'), p.get('fecha_fin'))
+            totales = totales_periodo(ventas)
+            pagina, siguiente = pagina_ventas(
+                ventas.only('id', 'fecha', 'total', 'items', 'cliente__rut').select_related('cliente'),
+                p.get('cursor'), tamano,
+            )
+        except ValueError:
+            return Response({'error': 'tamano debe ser un entero'}, status=status.HTTP_400_BAD_REQUEST)
+        except ValidationError as e:
+            return Response({'error': e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            **totales,
+            'siguiente': siguiente,
+            'resultados': [
+                {'id': v.pk, 'fecha': v.fecha, 'cliente': v.cliente.rut, 'items': v.items, 'total': v.total}
+                for v in pagina
+            ],
+        })
+
+    @action(detail=False, methods=['get'])
+    def exportar(self, request):
+        """Ventas del periodo con sus líneas en Excel.
+        Uso: GET /api/ventas/exportar/?fecha_inicio=2025-12-01&fecha_fin=2025-12-31
+        """
+        p = request.query_params
+        try:
+            ventas = filtrar_periodo(Venta.objects.all(), p.get('fecha_inicio'), p.get('fecha_fin'))
+        except ValidationError as e:
+            return Response({'error': e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
+        return respuesta_xlsx(lambda libro: escribir_ventas(libro, ventas), f'ventas_{now():%Y%m%d}.xlsx')
+
+class ReservaViewSet(viewsets.ViewSet):
+    """Reservas de stock con vencimiento para carritos de la app móvil.
+
+    POST   /api/reservas/                      {"lineas": [...], "ttl": 600}
+    GET    /api/reservas/{id}/
+    DELETE /api/reservas/{id}/
+    GET    /api/reservas/disponibilidad/?productos=1,2,3
+
+    Cada reserva pertenece al usuario que la creó: para los demás responde
+    404, como si no existiera.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    @staticmethod
+    def _respuesta(reserva):
+        return {
+            'id': reserva['id'],
+            'expira': datetime.fromtimestamp(reserva['expira'], tz=dt_timezone.utc),
+            'lineas': [{'producto': pid, 'cantidad': n} for pid, n in reserva['items'].items()],
+        }
+
+    def create(self, request):
+        serializer = ReservaSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            lineas = resolver_productos(serializer.validated_data['lineas'])
+            reserva = reservar(lineas, ttl=serializer.validated_data.get('ttl'), usuario=request.user)
+        except StockInsuficiente as e:
+            return Response({'error': e.messages[0]}, status=status.HTTP_409_CONFLICT)
+        except ValidationError as e:
+            return Response({'error': e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self._respuesta(reserva), status=status.HTTP_201_CREATED)
+
+    def retrieve(self, request, pk=None):
+        reserva = obtener_reserva(pk, usuario=request.user)
+        if reserva is None:
+            return Response({'error': 'Reserva inexistente o vencida'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(self._respuesta(reserva))
+
+    def destroy(self, request, pk=None):
+        reserva = obtener_reserva(pk)
+        if reserva is not None and reserva['usuario'] != request.user.pk:
+            return Response({'error': 'Reserva inexistente o vencida'}, status=status.HTTP_404_NOT_FOUND)
+        # Inexistente o ya vencida: nada que liberar, DELETE sigue siendo idempotente
+        liberar_reserva(pk)
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
-class VentaDetalleViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['get'])
+    def disponibilidad(self, request):
+        try:
+            ids = [int(x) for x in request.query_params.get('productos', '').split(',') if x.strip()]
+        except ValueError:
+            return Response({'error': 'productos debe ser una lista de ids separados por coma'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        productos = Producto.objects.filter(pk__in=ids).prefetch_related('slots')
+        return Response([
+            {'producto': pid, 'stock': stock, 'reservado': reservado, 'disponible': disponible}
+            for pid, (stock, reservado, disponible) in disponibilidad(productos).items()
+        ])
+
+
+class VentaDetalleViewSet(ExportacionStreamingMixin, viewsets.ModelViewSet):
     queryset = VentaDetalle.objects.all()
     serializer_class = VentaDetalleSerializer
     permission_classes = [permissions.IsAuthenticated]
-    
-
-class UserViewSet(viewsets.ModelViewSet):
+    campos_exportacion = ('id', 'venta_id', 'producto_id', 'cantidad', 'precio_unitario')
+
+    def _guardar_con_stock(self, serializer, producto_anterior=None, cantidad_anterior=0):
+        """Guarda el detalle ajustando stock con el servicio condicional."""
+        producto = serializer.validated_data.get('producto', producto_anterior)
+        cantidad = serializer.validated_data.get('cantidad', cantidad_anterior)
+        venta_anterior = serializer.instance.venta if serializer.instance else None
+        venta_nueva = serializer.validated_data.get('venta', venta_anterior)
+        # La línea tal como está en los resúmenes, para restarla
+        quitadas = []
+        if serializer.instance:
+            quitadas.append((venta_anterior, producto_anterior, cantidad_anterior, serializer.instance.precio_unitario))
+        # Unidades que se descuentan de más: no tomar las retenidas por reservas
+        if producto_anterior is None or producto_anterior.pk != producto.pk:
+            adicional = cantidad
+        else:
+            adicional = cantidad - cantidad_anterior
+        try:
+            if adicional > 0:
+                verificar_disponible([(producto, adicional)])
+            with transaction.atomic():
+                for venta_id in {v.pk for v in (venta_anterior, venta_nueva) if v is not None}:
+                    canasta.marcar_venta(venta_id)
+                detalle = serializer.save()
+                if producto_anterior is not None and producto_anterior.pk != producto.pk:
+                    devolver_stock(producto_anterior.pk, cantidad_anterior, venta=detalle.venta)
+                    descontar_stock(producto.pk, cantidad, venta=detalle.venta)
+                else:
+                    ajustar_stock(producto.pk, cantidad_anterior - cantidad, venta=detalle.venta)
+                ventas = {detalle.venta} | ({venta_anterior} if venta_anterior else set())
+                recalcular_totales(Venta.objects.filter(pk__in=[v.pk for v in ventas]))
+                ajustar_lineas(quitadas, [(detalle.venta, producto, cantidad, detalle.precio_unitario)])
+        except StockInsuficiente as e:
+            raise serializers.ValidationError({'cantidad': e.messages})
+
+    def perform_create(self, serializer):
+        self._guardar_con_stock(serializer)
+
+    def perform_update(self, serializer):
+        inst = serializer.instance
+        self._guardar_con_stock(serializer, producto_anterior=inst.producto, cantidad_anterior=inst.cantidad)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            canasta.marcar_venta(instance.venta_id)
+            devolver_stock(instance.producto_id, instance.cantidad, venta=instance.venta)
+            instance.delete()
+            recalcular_totales(Venta.objects.filter(pk=instance.venta_id))
+            ajustar_lineas(quitadas=[(instance.venta, instance.producto, instance.cantidad, instance.precio_unitario)])
+
+
+class UserViewSet(ExportacionStreamingMixin, viewsets.ModelViewSet):
     queryset = User.objects.all().order_by("-date_joined")
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
+    campos_exportacion = ('id', 'username', 'email', 'first_name', 'last_name', 'is_active', 'date_joined')
 
 
-class GroupViewSet(viewsets.ModelViewSet):
+class GroupViewSet(ExportacionStreamingMixin, viewsets.ModelViewSet):
     queryset = Group.objects.all().order_by("name")
     serializer_class = GroupSerializer
     permission_classes = [permissions.IsAuthenticated]
+    campos_exportacion = ('id', 'name')
 
 
-class ChatMessageViewSet(viewsets.ModelViewSet):
+class ChatMessageViewSet(ExportacionStreamingMixin, viewsets.ModelViewSet):
     """ViewSet para chat IA."""
     serializer_class = ChatMessageSerializer
     permission_classes = [permissions.IsAuthenticated]
+    campos_exportacion = ('id', 'timestamp', 'context_type', 'user_message', 'ai_response')
 
     def get_queryset(self):
         """Solo retorna mensajes del usuario autenticado."""
         return ChatMessage.objects.filter(user=self.request.user).order_by('-timestamp')
 
     def create(self, request, *args, **kwargs):
-        """Envía un mensaje a Groq y guarda en historial."""
-        user_message = request.data.get('user_message', '').strip()
-        context_type = request.data.get('context_type', 'general')
-
-        if not user_message:
-            return Response(
-                {'error': 'El mensaje no puede estar vacío.'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        """Envía un mensaje a Groq y guarda en historial.
 
-        # Respuesta determinista desde inventario (sin IA) si la pregunta es de precio/stock
-        inv_answer = self._try_inventory_answer(user_message)
-        if inv_answer:
-            chat_msg = ChatMessage.objects.create(
-                user=request.user,
-                user_message=user_message,
-                ai_response=inv_answer,
-                context_type=context_type
-            )
-            serializer = self.get_serializer(chat_msg)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-
-        # Obtener contexto según tipo (productos, ventas, etc)
-        context = self._build_context(context_type, user_message)
-
-        # Obtener últimos 5 mensajes como historial
-        history = list(
-            ChatMessage.objects.filter(user=request.user).order_by('-timestamp')[:5]
-        )
-        history.reverse()
-        history_messages = [
+        POST /api/chat/ se enruta directo a `ai_views.chat`; aquí solo llegan
+        las demás rutas del router, con el mismo flujo.
+        """
+        from .ai_views import responder_chat
+        return async_to_sync(responder_chat)(request.user, request.data)
+
+    @staticmethod
+    def _history_messages(history):
+        """Historial (más reciente primero) en el formato de mensajes de Groq."""
+        history = list(reversed(history))
+        return [
             {"role": "user", "content": h.user_message}
             for h in history
         ] + [
@@ -308,29 +580,8 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
             for h in history
         ]
 
-        # Llamar a Groq
-        ai_response = chat_with_groq(user_message, context=context, history=history_messages)
-
-        # Si Groq falló, no guardar el mensaje como si fuera respuesta válida.
-        # En su lugar, devolver 503 para que el frontend pueda manejar el error.
-        if isinstance(ai_response, str) and ai_response.strip().lower().startswith('error'):
-            return Response(
-                {'error': ai_response, 'code': 'GROQ_UNAVAILABLE'},
-                status=status.HTTP_503_SERVICE_UNAVAILABLE
-            )
-
-        # Guardar en BD
-        chat_msg = ChatMessage.objects.create(
-            user=request.user,
-            user_message=user_message,
-            ai_response=ai_response,
-            context_type=context_type
-        )
-
-        serializer = self.get_serializer(chat_msg)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
-
-    def _try_inventory_answer(self, user_message: str):
+    @staticmethod
+    def _try_inventory_answer(user_message: str):
         """Devuelve una respuesta basada en la BD si la consulta pide precio/stock.
         Si no identifica producto con confianza, retorna None y se usa IA.
         """
@@ -346,7 +597,8 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
             if not triggers:
                 return None
 
-            qs = Producto.objects.select_related('categoria').all()
+            # `stock`: cantidad más los slots de los productos en modo caliente
+            qs = stock_con_slots(Producto.objects.select_related('categoria'))
             # Buscar por código explícito (prefijo-XXXX o alfanumérico largo)
             code_match = re.findall(r"[A-Za-z]{2,}-[A-Za-z0-9]{3,}|[A-Z0-9]{4,}", text)
             for c in code_match:
@@ -356,8 +608,8 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
                     if asks_price:
                         parts.append(f"El precio de {p.nombre} es ${float(p.precio):.2f}.")
                     if asks_stock:
-                        parts.append(f"Stock disponible: {int(p.cantidad)} unidades.")
-                    return " ".join(parts) or f"{p.nombre}: precio ${float(p.precio):.2f}, stock {int(p.cantidad)}."
+                        parts.append(f"Stock disponible: {int(p.stock)} unidades.")
+                    return " ".join(parts) or f"{p.nombre}: precio ${float(p.precio):.2f}, stock {int(p.stock)}."
 
             # Filtro por nombre usando tokens (OR para ser menos estricto)
             tokens = [t for t in re.findall(r"[A-Za-zÁÉÍÓÚÜÑáéíóúüñ0-9]+", text) if len(t) >= 2]
@@ -387,19 +639,20 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
             if asks_price:
                 parts.append(f"El precio de {best.nombre} es ${float(best.precio):.2f}.")
             if asks_stock:
-                parts.append(f"Stock disponible: {int(best.cantidad)} unidades.")
+                parts.append(f"Stock disponible: {int(best.stock)} unidades.")
             if not parts:
                 # Pregunta genérica sobre existencia
-                parts.append(f"Tenemos {best.nombre}. Precio ${float(best.precio):.2f} y stock {int(best.cantidad)}.")
+                parts.append(f"Tenemos {best.nombre}. Precio ${float(best.precio):.2f} y stock {int(best.stock)}.")
             return " ".join(parts)
         except Exception:
             return None
 
-    def _build_context(self, context_type, user_message: str = ""):
+    @staticmethod
+    def _build_context(context_type, user_message: str = ""):
         """Construye contexto según tipo solicitado, con filtro por nombre/código si la consulta lo sugiere."""
         if context_type == 'producto':
             # Catálogo con datos confiables del inventario
-            all_qs = Producto.objects.select_related('categoria').all()
+            all_qs = Producto.objects.select_related('categoria')
             productos_qs = all_qs
             # Filtro básico según la consulta: intenta por código y nombre parcial
             query = (user_message or '').strip()
@@ -422,7 +675,8 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
                 productos.append({
                     'nombre': p.nombre,
                     'codigo': p.codigo,
-                    'cantidad': int(p.cantidad or 0),
+                    # Sin la cantidad exacta: cambia con cada venta y la respuesta se cachea (chat_cache.py)
+                    'stock_bajo': p.stock_bajo,
                     'precio': float(p.precio or 0),
                     'categoria': p.categoria.nombre if p.categoria else None,
                     'descripcion': p.descripcion or '',
@@ -430,19 +684,37 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
             guidance = (
                 "Usa EXCLUSIVAMENTE este catálogo para responder sobre productos, precios y stock. "
                 "Si el usuario pregunta por un producto que no aparece aquí, responde literalmente: 'En este momento no tenemos ese producto'. "
-                "Cuando te pidan el precio, devuelve el campo 'precio' exacto de este catálogo, sin estimaciones."
+                "Cuando te pidan el precio, devuelve el campo 'precio' exacto de este catálogo, sin estimaciones. "
+                "El catálogo no trae cantidades exactas: si preguntan por stock, indica si está bajo ('stock_bajo') "
+                "y sugiere consultar por el código del producto para ver las unidades disponibles."
             )
             return f"{guidance}\nCatalogo:\n{json.dumps(productos, ensure_ascii=False)}"
         elif context_type == 'venta':
-            ventas_recent = Venta.objects.filter(
-                fecha__gte=now() - timedelta(days=30)
-            ).values('cliente__nombre', 'fecha').annotate(total=Sum('detalles__cantidad'))
-            return f"Ventas últimos 30 días:\n{json.dumps(list(ventas_recent), default=str, ensure_ascii=False)}"
+            # Resúmenes diarios: ~30 filas en vez de cada venta del periodo
+            desde = now().date() - timedelta(days=30)
+            por_dia = VentaDiaria.objects.filter(fecha__gte=desde).values(
+                'fecha', 'ventas', 'unidades', 'ingresos'
+            ).order_by('fecha')
+            top = ProductoDiario.objects.filter(fecha__gte=desde).values('producto__nombre').annotate(
+                unidades=Sum('unidades'), ingresos=Sum('ingresos')
+            ).order_by('-unidades')[:10]
+            datos = {'ventas_por_dia': list(por_dia), 'productos_mas_vendidos': list(top)}
+            return f"Ventas últimos 30 días:\n{json.dumps(datos, default=str, ensure_ascii=False)}"
         elif context_type == 'stock':
-            bajo_stock = Producto.objects.filter(cantidad__lt=10).values('nombre', 'cantidad')
+            # Sin la cantidad exacta, como en el catálogo: la lista cambia solo al cruzar umbrales
+            bajo_stock = Producto.objects.filter(stock_bajo=True).annotate(
+                umbral=umbral_stock()
+            ).values('nombre', 'codigo', 'umbral')
             return f"Productos con bajo stock:\n{json.dumps(list(bajo_stock), default=str, ensure_ascii=False)}"
         return None
 
+    @action(detail=False, methods=['get'])
+    def cache(self, request):
+        """Aciertos y fallos del caché de respuestas del chat (`chat_cache.py`).
+        Uso: GET /api/chat/cache/
+        """
+        return Response(chat_cache.estadisticas())
+
     @action(detail=False, methods=['get'])
     def history(self, request):
         """Retorna el historial de chat del usuario."""
@@ -451,10 +723,11 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class ImageAnalysisViewSet(viewsets.ModelViewSet):
+class ImageAnalysisViewSet(ExportacionStreamingMixin, viewsets.ModelViewSet):
     """ViewSet para análisis de imágenes con Groq Vision."""
     serializer_class = ImageAnalysisSerializer
     permission_classes = [permissions.IsAuthenticated]
+    campos_exportacion = ('id', 'timestamp', 'image', 'producto_created_id', 'analysis_result')
 
     def get_queryset(self):
         """Solo retorna análisis del usuario autenticado."""
@@ -464,63 +737,56 @@ class ImageAnalysisViewSet(viewsets.ModelViewSet):
         """
         Analiza una imagen y extrae información de producto.
         SIEMPRE devuelve un JSON válido con estructura completa.
+
+        POST /api/images/ se enruta directo a `ai_views.imagen`; aquí solo
+        llegan las demás rutas del router, con el mismo flujo.
         """
-        # Validación de archivo
-        if 'image' not in request.FILES:
-            return Response(
+        from .ai_views import responder_imagen
+        return async_to_sync(responder_imagen)(request)
+
+    @staticmethod
+    def _leer_imagen(request):
+        """Bytes de la imagen subida en `image`, o (None, respuesta 400) si falta o no es válida."""
+        def rechazo(error, descripcion):
+            return None, Response(
                 {
-                    'error': 'No se proporcionó una imagen.',
+                    'error': error,
                     'analysis_result': {
                         'producto': '',
                         'precio_estimado': 0.0,
                         'categoria': '',
-                        'descripcion': 'Imagen no proporcionada'
+                        'descripcion': descripcion
                     }
                 },
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        # Validación de archivo
+        if 'image' not in request.FILES:
+            return rechazo('No se proporcionó una imagen.', 'Imagen no proporcionada')
+
         image_file = request.FILES['image']
-        
+
         # Validar tipo de archivo
         valid_types = ['image/jpeg', 'image/png', 'image/gif', 'image/webp']
         if image_file.content_type not in valid_types:
             logger.warning(f"Tipo de archivo inválido: {image_file.content_type}")
-            return Response(
-                {
-                    'error': f'Tipo de archivo no válido. Use: {", ".join(valid_types)}',
-                    'analysis_result': {
-                        'producto': '',
-                        'precio_estimado': 0.0,
-                        'categoria': '',
-                        'descripcion': 'Formato de imagen no soportado'
-                    }
-                },
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
+            return rechazo(f'Tipo de archivo no válido. Use: {", ".join(valid_types)}',
+                           'Formato de imagen no soportado')
+
         try:
-            image_bytes = image_file.read()
+            return image_file.read(), None
         except Exception as e:
             logger.error(f"Error leyendo archivo: {str(e)}")
-            return Response(
-                {
-                    'error': 'Error al leer el archivo de imagen',
-                    'analysis_result': {
-                        'producto': '',
-                        'precio_estimado': 0.0,
-                        'categoria': '',
-                        'descripcion': 'No se pudo procesar la imagen'
-                    }
-                },
-                status=status.HTTP_400_BAD_REQUEST
-            )
+            return rechazo('Error al leer el archivo de imagen', 'No se pudo procesar la imagen')
 
-        # Usar la función mejorada de análisis
-        from .groq_utils import analyze_product_image_v2
-        # En Railway es mejor fallar rápido que agotar timeouts del proxy (502).
-        analysis_result = analyze_product_image_v2(image_bytes, max_retries=0)
-        
+    @staticmethod
+    def _respuesta_analisis(request, analysis_result, coincidencia=None):
+        """Respuesta de `create` (objeto, o lista con `?array=1` / `X-Wrap-Array: 1`).
+
+        `coincidencia` es la de `imagen_cache.buscar` (`exacto`/`similar`)
+        cuando el análisis salió del caché.
+        """
         # Log detallado para debugging
         logger.info(f"📊 Resultado del análisis: {analysis_result}")
         logger.info(f"  - Producto: '{analysis_result.get('producto')}'")
@@ -537,12 +803,13 @@ class ImageAnalysisViewSet(viewsets.ModelViewSet):
                 "descripcion": analysis_result.get("descripcion") or "",
                 **({"error": analysis_result.get("error")} if analysis_result.get("error") else {}),
             },
+            **({"duplicado": coincidencia} if coincidencia else {}),
         }
 
-        wrap_as_array = (request.query_params.get('array') in ['1', 'true', 'True']) or (request.headers.get('X-Wrap-Array') == '1')
-        if wrap_as_array:
-            return Response([payload], status=status.HTTP_200_OK)
-        return Response(payload, status=status.HTTP_200_OK)
+        wrap_as_array = (request.GET.get('array') in ['1', 'true', 'True']) or (request.headers.get('X-Wrap-Array') == '1')
+        response = Response([payload] if wrap_as_array else payload, status=status.HTTP_200_OK)
+        response['X-Cache'] = 'HIT' if coincidencia else 'MISS'
+        return response
 
     @action(detail=False, methods=['post'])
     def debug_analysis(self, request):
@@ -622,9 +889,14 @@ class ImageAnalysisViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Analizar imagen con versión mejorada
-        from .groq_utils import analyze_product_image_v2
-        analysis_data = analyze_product_image_v2(image_bytes, max_retries=2)
+        # Misma imagen ya analizada: resultado guardado, sin Groq. Solo aciertos
+        # exactos: una foto parecida puede ser otra variante y crearía el producto equivocado
+        huellas, analysis_data, _ = imagen_cache.buscar(image_bytes, similares=False)
+        if analysis_data is None:
+            # Analizar imagen con versión mejorada
+            from .groq_utils import analyze_product_image_v2
+            analysis_data = analyze_product_image_v2(image_bytes, max_retries=2)
+            imagen_cache.guardar(huellas, analysis_data)
 
         logger.info(f"Análisis completado: {analysis_data}")
 
@@ -671,7 +943,8 @@ class ImageAnalysisViewSet(viewsets.ModelViewSet):
 
             logger.info(f"Producto creado. ID: {producto.id}, Nombre: {nombre}")
 
-            # No persistir imagen ni registros de análisis (requisito: sin almacenamiento)
+            # No persistir la imagen (requisito: sin almacenamiento); el análisis
+            # solo queda como entrada del caché por contenido
             img_analysis = None
 
             return Response(
@@ -736,94 +1009,244 @@ class ImageAnalysisViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
+def _respuesta_cacheada(data, hit):
+    response = Response(data)
+    response['X-Cache'] = 'HIT' if hit else 'MISS'
+    return response
+
+
 class AnalyticsViewSet(viewsets.ViewSet):
     """ViewSet para análisis de ventas y recomendaciones."""
     permission_classes = [permissions.IsAuthenticated]
 
     @action(detail=False, methods=['get'])
     def trends(self, request):
-        """Analiza tendencias de ventas de los últimos 30 días."""
+        """Analiza tendencias de ventas de los últimos 30 días.
+
+        Lee los resúmenes diarios (una fila por día y por producto vendido)
+        en vez de recorrer todas las líneas de venta del periodo. La
+        respuesta (incluido el análisis de Groq) queda en caché hasta que
+        cambien los datos; los segmentos de clientes tienen su propia entrada
+        (`_clientes_rfm`) y no se recalculan con cada venta.
+        """
         days = int(request.query_params.get('days', 30))
-        start_date = now() - timedelta(days=days)
-
-        ventas = Venta.objects.filter(fecha__gte=start_date).values(
-            'fecha__date'
-        ).annotate(
-            total_units=Sum('detalles__cantidad'),
-            total_sales=Sum(
-                F('detalles__cantidad') * F('detalles__precio_unitario'),
-                output_field=DecimalField()
-            )
-        ).order_by('fecha__date')
+        # El rango resuelto va en la clave: el mismo `days` mañana es otro periodo
+        hoy = localdate()
+        start_date = hoy - timedelta(days=days)
+        data, hit = cacheado(
+            'trends', {**request.query_params.dict(), 'desde': start_date, 'hasta': hoy},
+            lambda: self._trends(days, start_date, hoy),
+            guardar_si=lambda d: not d['ai_analysis'].startswith('Error'),
+        )
+        return _respuesta_cacheada(data, hit)
 
-        productos_vendidos = VentaDetalle.objects.filter(
-            venta__fecha__gte=start_date
+    @staticmethod
+    def _trends(days, start_date, hoy):
+
+        ventas = VentaDiaria.objects.filter(fecha__gte=start_date).values(
+            'fecha', 'ventas', 'unidades', 'ingresos'
+        ).order_by('fecha')
+
+        productos_vendidos = ProductoDiario.objects.filter(
+            fecha__gte=start_date
         ).values('producto__nombre').annotate(
-            cantidad=Sum('cantidad'),
-            ingresos=Sum(F('cantidad') * F('precio_unitario'), output_field=DecimalField())
+            cantidad=Sum('unidades'),
+            ingresos=Sum('ingresos')
         ).order_by('-cantidad')
 
+        categorias = CategoriaDiaria.objects.filter(
+            fecha__gte=start_date
+        ).values('categoria__nombre').annotate(
+            cantidad=Sum('unidades'),
+            ingresos=Sum('ingresos')
+        ).order_by('-ingresos')
+
         analytics_data = {
             'periodo_dias': days,
-            'ventas_por_fecha': list(ventas),
+            'ventas_por_fecha': [
+                {'fecha__date': v['fecha'], 'ventas': v['ventas'],
+                 'total_units': v['unidades'], 'total_sales': v['ingresos']}
+                for v in ventas
+            ],
             'productos_top': list(productos_vendidos[:10]),
-            'fecha_analisis': str(now().date())
+            'categorias': list(categorias[:10]),
+            'clientes': AnalyticsViewSet._clientes_rfm(start_date),
+            # Pares comprados juntos (histórico), base de la venta cruzada
+            'ventas_cruzadas': canasta.pares_frecuentes(10),
+            'fecha_analisis': str(hoy)
         }
 
         # Generar análisis con Groq
         analysis_text = analyze_sales_trends(analytics_data)
 
-        return Response({
+        return {
             'analytics_data': analytics_data,
             'ai_analysis': analysis_text
-        })
+        }
+
+    @staticmethod
+    def _clientes_rfm(desde):
+        """Segmentos RFM desde `desde` para el prompt de `trends`, en su propia entrada del caché.
+
+        Recorre todas las ventas del periodo agrupadas por cliente, y los
+        segmentos casi no cambian con una venta más: se renuevan por TTL y
+        no cada vez que `trends` se recalcula por la versión de datos.
+        """
+        datos, _ = cacheado(
+            'trends_clientes', {'desde': desde, 'top': 5},
+            lambda: resumen_rfm(filtrar_periodo(Venta.objects.all(), desde, None), top=5),
+            versionado=False,
+        )
+        return datos
+
+    @action(detail=False, methods=['get'])
+    def top(self, request):
+        """Top-N productos del día, semana, mes o histórico, por unidades o ingresos.
+
+        Lee el ranking incremental (`leaderboard.py`): el costo depende de N,
+        no del volumen de ventas.
+        Uso: GET /api/analytics/top/?periodo=semana&metrica=ingresos&n=10
+        """
+        p = request.query_params
+        periodo = p.get('periodo', 'dia')
+        metrica = p.get('metrica', 'unidades')
+        try:
+            n = min(max(int(p.get('n', 10)), 1), 100)
+            productos = leaderboard.top(periodo, metrica, n)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'periodo': periodo, 'metrica': metrica, 'productos': productos})
+
+    @action(detail=False, methods=['get'])
+    def clientes(self, request):
+        """Segmentos RFM y cohortes mensuales de clientes, en caché por periodo.
+        Uso: GET /api/analytics/clientes/?fecha_inicio=2025-01-01&fecha_fin=2025-12-31&top=20
+        Sin fechas se analizan los últimos 365 días.
+        """
+        p = request.query_params
+        try:
+            fecha_fin = date.fromisoformat(p['fecha_fin']) if p.get('fecha_fin') else localdate()
+            fecha_inicio = (
+                date.fromisoformat(p['fecha_inicio']) if p.get('fecha_inicio')
+                else fecha_fin - timedelta(days=364)
+            )
+            top = min(max(int(p.get('top', 20)), 1), 200)
+        except ValueError:
+            return Response({'error': 'Parámetros inválidos (fechas YYYY-MM-DD, top entero)'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if fecha_inicio > fecha_fin:
+            return Response({'error': 'fecha_inicio debe ser anterior a fecha_fin'}, status=status.HTTP_400_BAD_REQUEST)
+        data, hit = cacheado(
+            'clientes', {'desde': fecha_inicio, 'hasta': fecha_fin, 'top': top},
+            lambda: analitica_clientes(fecha_inicio, fecha_fin, top=top),
+        )
+        return _respuesta_cacheada(data, hit)
 
     @action(detail=False, methods=['get'])
     def stock_suggestions(self, request):
-        """Genera sugerencias de reorden de stock."""
-        productos = Producto.objects.all().values('id', 'nombre', 'codigo', 'cantidad', 'precio')
-
-        # Calcular velocidad de venta por producto (últimos 30 días)
-        days = 30
-        start_date = now() - timedelta(days=days)
-
-        velocidades = {}
-        for prod in productos:
-            vendidos = VentaDetalle.objects.filter(
-                producto_id=prod['id'],
-                venta__fecha__gte=start_date
-            ).aggregate(total=Sum('cantidad'))['total'] or 0
-            velocidades[prod['nombre']] = {
-                'stock_actual': prod['cantidad'],
-                'precio': str(prod['precio']),
-                'vendidos_30dias': vendidos,
-                'velocidad_diaria': round(vendidos / days, 2)
-            }
-
-        # Generar sugerencias con Groq
-        suggestions_text = generate_stock_suggestions(velocidades)
+        """Genera sugerencias de reorden de stock.
+
+        Las métricas de todo el catálogo salen de dos consultas y se calculan
+        en bloque (ver `reposicion.py` y `forecast.py`): pronóstico de
+        demanda, stock de seguridad y punto de reorden por producto. A Groq
+        solo se envían los `top` productos más urgentes para que explique los
+        números; con ia=0 no se llama a Groq.
+        Parámetros: dias (30), top (20), plazo (7), cobertura (14),
+        nivel_servicio (0.95), ia (1).
+        """
+        try:
+            days = int(request.query_params.get('dias', 30))
+            top = int(request.query_params.get('top', 20))
+            plazo = int(request.query_params.get('plazo', 7))
+            cobertura = int(request.query_params.get('cobertura', 14))
+            nivel_servicio = float(request.query_params.get('nivel_servicio', 0.95))
+        except ValueError:
+            return Response({'error': 'Parámetros numéricos inválidos'}, status=status.HTTP_400_BAD_REQUEST)
+        if days < 1 or top < 1:
+            return Response({'error': 'dias y top deben ser mayores que 0'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0.5 <= nivel_servicio < 1:
+            return Response({'error': 'nivel_servicio debe estar entre 0.5 y 1'}, status=status.HTTP_400_BAD_REQUEST)
+        usar_ia = request.query_params.get('ia', '1') not in ('0', 'false')
+
+        # Las métricas se calculan hasta hoy (`reposicion.py`): el día va en la clave
+        data, hit = cacheado(
+            'stock_suggestions', {**request.query_params.dict(), 'hoy': localdate()},
+            lambda: self._stock_suggestions(days, top, plazo, cobertura, nivel_servicio, usar_ia),
+            guardar_si=lambda d: not d['sugerencias_reorden'].startswith('Error'),
+        )
+        return _respuesta_cacheada(data, hit)
+
+    @staticmethod
+    def _stock_suggestions(days, top, plazo, cobertura, nivel_servicio=0.95, usar_ia=True):
+        metricas = metricas_reposicion(dias=days, plazo=plazo, cobertura=cobertura,
+                                       nivel_servicio=nivel_servicio)
+        urgentes = productos_en_atencion(metricas, top=min(top, 100))
+        velocidades = {p['nombre']: p for p in urgentes}
+
+        # Generar sugerencias con Groq (solo si hay algo que reponer)
+        if not velocidades:
+            suggestions_text = 'Ningún producto requiere reposición en el horizonte analizado.'
+        elif usar_ia:
+            suggestions_text = generate_stock_suggestions(velocidades)
+        else:
+            suggestions_text = ''
 
-        return Response({
+        return {
             'velocidades_venta': velocidades,
             'sugerencias_reorden': suggestions_text,
-            'fecha_analisis': str(now().date())
-        })
+            'productos_analizados': len(metricas['id']),
+            'productos_en_atencion': int(metricas['atencion'].sum()),
+            'fecha_analisis': str(localdate())
+        }
 
     @action(detail=False, methods=['get'])
-    def low_stock_alert(self, request):
-        """Retorna productos con stock bajo."""
-        threshold = int(request.query_params.get('threshold', 10))
-        low_stock = Producto.objects.filter(cantidad__lt=threshold).values(
-            'id', 'nombre', 'codigo', 'cantidad', 'precio'
+    def exportar(self, request):
+        """Resúmenes diarios de los últimos `days` días y métricas de reposición en Excel.
+        Uso: GET /api/analytics/exportar/?days=90
+        """
+        try:
+            days = int(request.query_params.get('days', 30))
+        except ValueError:
+            return Response({'error': 'days debe ser un entero'}, status=status.HTTP_400_BAD_REQUEST)
+        hasta = now().date()
+        desde = hasta - timedelta(days=days)
+        return respuesta_xlsx(
+            lambda libro: escribir_analiticas(libro, desde, hasta), f'analiticas_{hasta:%Y%m%d}.xlsx'
         )
+
+    @action(detail=False, methods=['get'])
+    def low_stock_alert(self, request):
+        """Retorna productos bajo su `stock_minimo`.
+
+        Lee el índice parcial de `stock_bajo` (lo mantiene el servicio de
+        stock en cada mutación). Con `threshold` se usa ese umbral para todos
+        los productos, como antes. Para enterarse al momento conviene
+        escuchar la notificación `stock_bajo` por WebSocket en vez de
+        consultar este endpoint.
+        """
+        threshold = request.query_params.get('threshold')
+        productos = stock_con_slots(Producto.objects.all())
+        if threshold is None:
+            productos = productos.filter(stock_bajo=True)
+        else:
+            try:
+                productos = productos.filter(stock__lt=int(threshold))
+            except ValueError:
+                return Response({'error': 'threshold debe ser un entero'}, status=status.HTTP_400_BAD_REQUEST)
+        low_stock = list(productos.annotate(umbral=umbral_stock()).order_by('stock').values(
+            'id', 'nombre', 'codigo', 'stock', 'umbral', 'precio'
+        ))
+        for p in low_stock:
+            p['cantidad'] = p['stock']
+            p['stock_minimo'] = p.pop('umbral')
         return Response({
-            'threshold': threshold,
-            'productos': list(low_stock),
+            'threshold': int(threshold) if threshold is not None else None,
+            'productos': low_stock,
             'cantidad_critica': len(low_stock)
         })
 
 def lista_productos(request):
-    productos = Producto.objects.all()
+    productos = Producto.objects.select_related('categoria').prefetch_related('slots')
     return render(request, 'tienda/lista_productos.html', {'productos': productos})
 
 def ws_test(request):
@@ -831,27 +1254,22 @@ def ws_test(request):
 
 # Vista para mostrar el resumen de ventas, con filtro por fechas
 def resumen_ventas(request):
-    from django.utils.dateparse import parse_date
-    # Obtiene todas las ventas, ordenadas por fecha descendente
-    ventas_qs = Venta.objects.select_related('cliente').prefetch_related('detalles__producto').order_by('-fecha')
-    # Obtiene los parámetros de filtro de fecha desde la URL
+    # Filtro por rango de fechas (opcional) y cursor de la página actual
     fecha_inicio = request.GET.get('fecha_inicio')
     fecha_fin = request.GET.get('fecha_fin')
-    ventas = ventas_qs
-    # Aplica filtro por fecha de inicio si corresponde
-    if fecha_inicio:
-        ventas = ventas.filter(fecha__date__gte=fecha_inicio)
-    # Aplica filtro por fecha de fin si corresponde
-    if fecha_fin:
-        ventas = ventas.filter(fecha__date__lte=fecha_fin)
-    # Limita a las últimas 20 ventas o las filtradas
-    ventas = ventas[:20]
-    # Calcula el total vendido en el periodo mostrado
-    total = sum(v.total() for v in ventas)
+    try:
+        ventas = filtrar_periodo(Venta.objects.select_related('cliente'), fecha_inicio, fecha_fin)
+        # Totales de todo el periodo en la BD, no solo de la página visible
+        totales = totales_periodo(ventas)
+        pagina, siguiente = pagina_ventas(ventas, request.GET.get('cursor'))
+    except ValidationError as e:
+        return render(request, 'tienda/error.html', {'mensaje': e.messages[0]})
 
     return render(request, 'tienda/resumen_ventas.html', {
-        'ventas': ventas,
-        'total': total,
+        'ventas': pagina,
+        'total': totales['total'],
+        'cantidad_ventas': totales['ventas'],
+        'siguiente': siguiente,
         'hoy': now().date(),
         'fecha_inicio': fecha_inicio or '',
         'fecha_fin': fecha_fin or '',
@@ -874,11 +1292,13 @@ def agregar_producto(request):
             producto = get_object_or_404(Producto, id=producto_id)
             producto.nombre = nombre
             producto.codigo = codigo
-            producto.cantidad = cantidad
             producto.precio = precio
             producto.categoria_id = categoria_id
             producto.descripcion = descripcion
-            producto.save()
+            # La cantidad se fija como ajuste en el libro de movimientos
+            with transaction.atomic():
+                guardar_sin_stock(producto)
+                fijar_stock(producto.pk, cantidad)
 
             # Mensaje de actualización
             messages.success(request, '✅ Producto actualizado con éxito.')
@@ -917,33 +1337,11 @@ def eliminar_producto(request, producto_id):
 
 # Vista para registrar una venta
 def registrar_venta(request):
-    productos = Producto.objects.all()
+    productos = Producto.objects.prefetch_related('slots')
     if request.method == 'POST':
-        # Obtiene los datos del formulario
-        rut = request.POST['rut'].strip()
-        # Normaliza el RUT: elimina puntos y convierte a mayúsculas para la K
-        rut_raw = rut.replace('.', '').upper()
-
-        # Si recibe 9 o 10 dígitos sin guion, se puede considerar:
-        # - 10 dígitos seguidos: lo permitimos (ej. 2276090072)
-        # - 9 dígitos (8 + dv) sin guion: agregamos el guion
-        # Aceptamos también formato con guion (ej. 22760900-7)
-        # Quitar espacios
-        rut_raw = rut_raw.replace(' ', '')
-
-        # Si viene sin guion y tiene 9 o 10 caracteres, intentar formatear
-        if '-' not in rut_raw and len(rut_raw) in (9, 10):
-            # Si tiene 9 caracteres asumimos 8 + dv
-            if len(rut_raw) == 9:
-                rut_norm = rut_raw[:8] + '-' + rut_raw[8]
-            else:
-                # 10 dígitos: tomar los primeros 8, guion, resto como dv (si vienen 10 se considera 8+dv)
-                rut_norm = rut_raw[:8] + '-' + rut_raw[8:]
-        else:
-            rut_norm = rut_raw
-
-        # Validación final: acepta 10 dígitos seguidos o 8 dígitos + '-' + dv (num o K)
-        if not re.fullmatch(r'(?:\d{10}|\d{8}-[0-9K])', rut_norm):
+        # Obtiene los datos del formulario y normaliza el RUT
+        rut_norm = normalizar_rut(request.POST['rut'])
+        if not rut_norm:
             messages.error(request, 'RUT inválido. Use 10 dígitos seguidos o formato 8 dígitos-VD (ej. 22760900-7).')
             return render(request, 'tienda/registrar_venta.html', {'productos': productos})
 
@@ -957,11 +1355,6 @@ def registrar_venta(request):
         # Busca el producto por su código
         producto = get_object_or_404(Producto, codigo=codigo)
 
-        # Valida que haya suficiente stock
-        if producto.cantidad < cantidad:
-            messages.error(request, '❌ No puedes vender más de lo que hay en stock.')
-            return render(request, 'tienda/error.html', {'mensaje': 'Stock insuficiente'})
-
         # Busca o crea el cliente
         cliente, creado = Cliente.objects.get_or_create(rut=rut)
         if habitual:
@@ -972,17 +1365,10 @@ def registrar_venta(request):
 
         # Registra la venta y el detalle en una transacción, actualizando stock
         try:
-            with transaction.atomic():
-                venta = Venta.objects.create(cliente=cliente)
-                detalle = VentaDetalle.objects.create(
-                    venta=venta,
-                    producto=producto,
-                    cantidad=cantidad,
-                    precio_unitario=producto.precio,
-                )
-                # Descontar stock
-                producto.cantidad -= cantidad
-                producto.save()
+            crear_venta(cliente, [(producto, cantidad)])
+        except StockInsuficiente:
+            messages.error(request, '❌ No puedes vender más de lo que hay en stock.')
+            return render(request, 'tienda/error.html', {'mensaje': 'Stock insuficiente'})
         except Exception as e:
             messages.error(request, f'❌ Error al registrar la venta: {e}')
             return render(request, 'tienda/error.html', {'mensaje': str(e)})